@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from threading import Lock
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# bytes from the start and the end of a file that are hashed for its fingerprint
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024
+
+
+def fingerprint(path: str | Path) -> str:
+    '''
+    Fast fingerprint of a file's content: size, modification time and a hash of its first and last block.
+    '''
+    stat = os.stat(path)
+    digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+
+    with open(path, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+        if stat.st_size > FINGERPRINT_BLOCK_SIZE:
+            file.seek(max(stat.st_size - FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE))
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+def evict(root: str | Path, quota: int, keep: Path | None = None):
+    '''
+    Remove the least recently used cache directories in `root` until all of them fit into `quota` bytes.
+    `keep` is the directory of the running conversion, it is never removed.
+    '''
+    root = Path(root)
+    if not root.is_dir():
+        return
+
+    directories = []
+    for directory in root.iterdir():
+        if not directory.is_dir() or directory == keep:
+            continue
+        size = sum(file.stat().st_size for file in directory.rglob('*') if file.is_file())
+        manifest = directory / 'cache.json'
+        last_used = manifest.stat().st_mtime if manifest.exists() else directory.stat().st_mtime
+        directories.append((last_used, size, directory))
+
+    used = sum(size for _, size, _ in directories)
+    if keep is not None and keep.is_dir():
+        used += sum(file.stat().st_size for file in keep.rglob('*') if file.is_file())
+
+    for _, size, directory in sorted(directories, key=lambda entry: entry[0]):
+        if used <= quota:
+            break
+        logger.info(f'Removing the cached files in {directory} ({size / 1024**2:.0f} MB), the cache is larger than {quota / 1024**3:.0f} GB.')
+        shutil.rmtree(directory, ignore_errors=True)
+        used -= size
+
+
+class ArtifactCache:
+    '''
+    Manifest of the files every stage (extraction, decoding, OCR, formatting) created for one input file.
+    A file is reused if the key it was created with is still the same. The key is a hash of the fingerprint of
+    the input file, the stage and the settings that affect the stage, which include the key of the file the
+    stage was created from, so changing a setting only redoes its stage and the following ones.
+    A cache that isn't persistent only knows the files created since it was created and never writes cache.json.
+    The caches of all input files are in their own directories of one root, evict keeps the root in its quota.
+    '''
+
+    def __init__(self, directory: str | Path, input_fingerprint: str, persistent: bool = True):
+        self.directory = Path(directory)
+        self.path = self.directory / 'cache.json'
+        self.fingerprint = input_fingerprint
+        self.persistent = persistent
+        self.lock = Lock()
+        self.entries = {}
+
+        if not persistent:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf8') as file:
+                self.entries = json.load(file)
+            # the modification time of the manifest is the last use of the cache for evict
+            os.utime(self.path)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def in_memory(directory: str | Path) -> 'ArtifactCache':
+        '''
+        Cache for a conversion without an input fingerprint, nothing of an earlier conversion is reused.
+        '''
+        return ArtifactCache(directory, uuid4().hex, persistent=False)
+
+    def key(self, stage: str, settings: dict) -> str:
+        data = json.dumps({'fingerprint': self.fingerprint, 'stage': stage, 'settings': settings}, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def get_key(self, name: str) -> str | None:
+        '''
+        Returns the key the file was created with or None if it is not in the cache.
+        '''
+        entry = self.entries.get(name)
+        return entry['key'] if entry else None
+
+    def get_meta(self, name: str) -> dict:
+        entry = self.entries.get(name)
+        return entry['meta'] if entry else {}
+
+    def is_valid(self, name: str, key: str) -> bool:
+        return self.get_key(name) == key and (self.directory / name).exists()
+
+    def store(self, name: str, key: str, meta: dict | None = None):
+        '''
+        Add a file after its stage finished successfully.
+        '''
+        with self.lock:
+            self.entries[name] = {'key': key, 'meta': meta or {}}
+            self.__save()
+
+    def invalidate(self, name: str):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self.__save()
+
+    def remove_unfinished(self, keep_suffixes: tuple[str, ...] = ('.journal',)):
+        '''
+        Remove the files of stages that didn't finish, e.g. a half extracted stream after the conversion was
+        cancelled. Finished files and the journals of stopped OCR runs are kept for the next conversion.
+        '''
+        # the files of the other stages may belong to a persistent cache of the directory
+        if not self.persistent or not self.directory.is_dir():
+            return
+
+        for path in self.directory.iterdir():
+            if path.is_file() and path.name not in self.entries and path != self.path and path.suffix not in keep_suffixes:
+                path.unlink(missing_ok=True)
+
+    def __save(self):
+        if not self.persistent:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            json.dump(self.entries, file, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,58 @@
+from collections.abc import Callable
+from contextlib import contextmanager
+from threading import Event, Lock
+
+
+class ConversionCancelled(Exception):
+    '''Raised at the next cancellation point after the CancellationToken of a conversion was cancelled.'''
+
+
+class CancellationToken:
+    '''
+    Cooperative cancellation of a conversion. The extraction, the OCR and muxing check the token between their
+    steps (every display set, every command), callbacks release what can't check it themselves, e.g. the
+    process runner kills the process groups of the running commands.
+    '''
+
+    def __init__(self):
+        self.event = Event()
+        self.lock = Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks = list(self.callbacks)
+
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise ConversionCancelled()
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        '''
+        Call `callback` if the token is cancelled while the block runs, right away if it already is.
+        '''
+        with self.lock:
+            cancelled = self.event.is_set()
+            if not cancelled:
+                self.callbacks.append(callback)
+
+        if cancelled:
+            callback()
+
+        try:
+            yield
+        finally:
+            with self.lock:
+                if callback in self.callbacks:
+                    self.callbacks.remove(callback)
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from threading import Lock
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Capabilities:
+    '''
+    Registry of the external tools (Tesseract, ffmpeg, ffprobe, mkvextract): their versions, installed Tesseract
+    languages and supported features. Probing a tool starts processes, so the results are stored in the data
+    directory and only probed again if the path or the modification time of the binary changes.
+    '''
+
+    TOOLS = ('tesseract', 'ffmpeg', 'ffprobe', 'mkvextract')
+
+    capabilities = None
+    capabilities_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not cls.capabilities:
+            with cls.capabilities_lock:
+                if not cls.capabilities:
+                    capabilities = super(Capabilities, cls).__new__(cls, *args, **kwargs)
+                    capabilities._initialize_capabilities()
+                    cls.capabilities = capabilities
+        return cls.capabilities
+
+    def _initialize_capabilities(self):
+        self.config = Config()
+        self.lock = Lock()
+        self.path = self.config.get_datadir() / 'capabilities.json'
+        self.checked = set() # tools whose binary was checked in this process
+        self.tools = {}
+
+        try:
+            with open(self.path, 'r', encoding='utf8') as file:
+                self.tools = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    def refresh(self):
+        '''
+        Check all tools, e.g. in the background at startup.
+        '''
+        for tool in self.TOOLS:
+            self.get(tool)
+
+    def get(self, tool: str) -> dict | None:
+        '''
+        Returns the capabilities of a tool or None if it is not installed.
+        '''
+        with self.lock:
+            if tool in self.checked:
+                return self.tools.get(tool)
+
+            path = shutil.which(tool)
+            if path is None:
+                logger.warning(f'{tool} was not found.')
+                if self.tools.pop(tool, None) is not None:
+                    self.__save()
+            else:
+                mtime = os.path.getmtime(path)
+                cached = self.tools.get(tool)
+                if cached is None or cached['path'] != path or cached['mtime'] != mtime or self.__data_changed(cached):
+                    self.tools[tool] = self.__probe(tool, path, mtime)
+                    self.__save()
+
+            self.checked.add(tool)
+            return self.tools.get(tool)
+
+    def get_version(self, tool: str) -> str | None:
+        capabilities = self.get(tool)
+        return capabilities['version'] if capabilities else None
+
+    def has_feature(self, tool: str, feature: str) -> bool:
+        capabilities = self.get(tool)
+        return capabilities is not None and feature in capabilities['features']
+
+    def get_languages(self) -> list[str]:
+        '''
+        Returns the installed Tesseract languages.
+        '''
+        capabilities = self.get('tesseract')
+        return capabilities['languages'] if capabilities else []
+
+    def __probe(self, tool: str, path: str, mtime: float) -> dict:
+        logger.debug(f'Probing {tool} at {path}.')
+        capabilities = {'path': path, 'mtime': mtime, 'version': None, 'features': [], 'languages': []}
+
+        match tool:
+            case 'tesseract':
+                capabilities['version'] = self.__find_version(self.__run([path, '--version']), r'tesseract v?(\S+)')
+                # first line is 'List of available languages in "<tessdata directory>" (<count>):'
+                output = self.__run([path, '--list-langs'], False).splitlines()
+                capabilities['languages'] = [lang.strip() for lang in output[1:] if lang.strip()]
+
+                # installing a language changes the tessdata directory, not the binary
+                data_dir = re.search(r'"(.+)"', output[0]) if output else None
+                if data_dir and os.path.isdir(data_dir.group(1)):
+                    capabilities['data_dir'] = data_dir.group(1)
+                    capabilities['data_mtime'] = os.path.getmtime(data_dir.group(1))
+                major = re.match(r'\d+', capabilities['version'] or '')
+                if major and int(major.group()) >= 4:
+                    capabilities['features'].append('lstm')
+            case 'ffmpeg':
+                capabilities['version'] = self.__find_version(self.__run([path, '-version']), r'ffmpeg version (\S+)')
+                # muxers used for extracting subtitles and their metadata
+                muxers = self.__run([path, '-hide_banner', '-muxers'])
+                capabilities['features'] = [muxer for muxer in ('sup', 'srt', 'ffmetadata', 'matroska') if re.search(rf'^\s*E\s+{muxer}\b', muxers, re.MULTILINE)]
+            case 'ffprobe':
+                capabilities['version'] = self.__find_version(self.__run([path, '-version']), r'ffprobe version (\S+)')
+            case 'mkvextract':
+                capabilities['version'] = self.__find_version(self.__run([path, '--version']), r'mkvextract v(\S+)')
+
+        return capabilities
+
+    def __data_changed(self, capabilities: dict) -> bool:
+        data_dir = capabilities.get('data_dir')
+        if data_dir is None:
+            return False
+
+        return not os.path.isdir(data_dir) or os.path.getmtime(data_dir) != capabilities['data_mtime']
+
+    def __run(self, command: list[str], include_stderr: bool = True) -> str:
+        try:
+            process = subprocess.run(command, capture_output=True, text=True, timeout=30)
+            return process.stdout + process.stderr if include_stderr else process.stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f'Could not run {command[0]}: {e}.')
+            return ''
+
+    def __find_version(self, output: str, pattern: str) -> str | None:
+        match = re.search(pattern, output)
+        return match.group(1) if match else None
+
+    def __save(self):
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp') # converter processes may save at the same time
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            json.dump(self.tools, file, indent=2)
+        os.replace(tmp_path, self.path)
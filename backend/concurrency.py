@@ -0,0 +1,113 @@
+import logging
+import math
+import os
+import sys
+import sysconfig
+from pathlib import Path
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# thread pools of the BLAS libraries numpy can be built with
+BLAS_THREAD_VARIABLES = ['OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'BLIS_NUM_THREADS']
+
+
+def cgroup_cpu_quota() -> float | None:
+    '''
+    Returns the number of CPUs the cgroup of the process may use (e.g. in a container) or None if there is no limit.
+    '''
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1
+        quota = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_quota_us').read_text())
+        period = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_period_us').read_text())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus() -> int:
+    '''
+    Number of CPUs this process can actually run on, respecting the CPU affinity and cgroup quotas.
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+
+    return cpus
+
+
+def ocr_workers() -> int:
+    '''
+    Number of subtitle tracks that are converted at the same time, 0 in the config means one per available CPU.
+    '''
+    workers = Config().get_value(Config.Settings.OCR_WORKERS)
+    return workers if workers > 0 else available_cpus()
+
+
+def is_free_threaded() -> bool:
+    '''
+    True if the interpreter runs without the GIL (free-threaded build of Python 3.13+ with the GIL disabled).
+    '''
+    if not sysconfig.get_config_var('Py_GIL_DISABLED'):
+        return False
+
+    # the GIL can be enabled again at runtime, e.g. by PYTHON_GIL=1 or an incompatible extension
+    return not sys._is_gil_enabled()
+
+
+def ocr_executor() -> str:
+    '''
+    Returns where the OCR runs, 'threads' or 'processes'. With the GIL, decoding and binarizing in the track
+    threads block each other, so 'auto' uses OCR processes if there is more than one worker. Without the GIL, threads use all CPUs without the
+    cost of starting processes and sending the images.
+    '''
+    executor = Config().get_value(Config.Settings.OCR_EXECUTOR)
+    if executor in ('threads', 'processes'):
+        return executor
+
+    return 'threads' if is_free_threaded() or ocr_workers() == 1 else 'processes'
+
+
+def set_thread_limits():
+    '''
+    Limit the threads of Tesseract (OpenMP) and the BLAS libraries.
+    Every track runs its own Tesseract processes, so additional threads per process only compete for the same CPUs.
+    Must be called before numpy is imported, the environment variables are inherited by all child processes.
+    '''
+    config = Config()
+    omp_threads = config.get_value(Config.Settings.OMP_THREADS)
+    blas_threads = config.get_value(Config.Settings.BLAS_THREADS)
+
+    if omp_threads > 0:
+        os.environ['OMP_THREAD_LIMIT'] = str(omp_threads)
+
+    if blas_threads > 0:
+        for variable in BLAS_THREAD_VARIABLES:
+            os.environ[variable] = str(blas_threads)
+
+    logger.debug(f'Using {available_cpus()} CPUs, OMP_THREAD_LIMIT={omp_threads}, BLAS threads={blas_threads}.')
+
+
+def set_opencv_threads():
+    import cv2
+
+    opencv_threads = Config().get_value(Config.Settings.OPENCV_THREADS)
+    if opencv_threads > 0:
+        cv2.setNumThreads(opencv_threads)
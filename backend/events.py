@@ -0,0 +1,131 @@
+'''
+Results and progress events of a conversion. They are small picklable dataclasses, so they can be sent to the GUI
+process through a queue, and this module doesn't import the converter, so the GUI process can unpickle them
+without loading OpenCV, numpy or Tesseract.
+'''
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+import time
+from controller.jobs import Jobs
+
+# seconds between two progress events of the same track
+PROGRESS_INTERVAL = 0.25
+
+
+@dataclass
+class TrackResult:
+    '''
+    Result of converting one track, every track thread fills its own result instead of shared state.
+    '''
+    track_id: int
+    lang: str | None = None
+    detected_lang: str | None = None
+    stats: dict = field(default_factory=dict)
+    exit_code: int = 0
+
+
+@dataclass
+class FileResult:
+    '''
+    Result of converting one file with the results of its tracks and the time of every job in seconds.
+    '''
+    path: str
+    success: bool = False
+    cancelled: bool = False
+    error: str | None = None
+    sub_dir: Path | None = None
+    languages: list[str] = field(default_factory=list)
+    tracks: list[TrackResult] = field(default_factory=list)
+    timings: dict[str, float] = field(default_factory=dict)
+    bytes_saved: int = 0 # reads from a network share that staging the file saved
+
+
+# the file of an event is filled in by SubMain, the extractor and the converter don't know it
+
+@dataclass(frozen=True)
+class JobStarted:
+    job: Jobs
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class ExtractionProgress:
+    track_id: int
+    bytes: int # size of the extracted stream so far
+    fraction: float | None # None if the tool doesn't report it
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class TrackProgress:
+    track_id: int
+    processed: int # display sets (or VobSub packs)
+    total: int
+    images_per_second: float # images read by the OCR
+    eta: float | None # seconds
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class FileFinished:
+    result: FileResult
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class FileFailed:
+    result: FileResult
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class BatchPlanned:
+    '''
+    Estimated seconds of the batch and of every file, the files are converted in the order of `estimates`.
+    '''
+    total_seconds: float
+    estimates: dict[str, float]
+    file: str | None = None
+
+
+@dataclass(frozen=True)
+class EditRequested:
+    '''
+    Sent by the GUI's on_edit callback, the subtitles can be edited until the user answers.
+    '''
+    sub_dir: Path
+    file: str | None = None
+
+
+ConversionEvent = JobStarted | ExtractionProgress | TrackProgress | FileFinished | FileFailed | BatchPlanned | EditRequested
+
+
+class TrackProgressReporter:
+    '''
+    Sends the TrackProgress of one track at most every PROGRESS_INTERVAL seconds, calling update for every
+    display set only compares two timestamps.
+    '''
+
+    def __init__(self, on_event: Callable[[ConversionEvent], None] | None, track_id: int, total: int):
+        self.on_event = on_event
+        self.track_id = track_id
+        self.total = total
+        self.start = self.last_event = time.perf_counter()
+        self.first_processed = None # display sets recognized before a resumed conversion don't count for the rate
+
+    def update(self, processed: int, images: int, force: bool = False):
+        if self.on_event is None:
+            return
+
+        now = time.perf_counter()
+        if self.first_processed is None:
+            self.first_processed = processed
+        if not force and now - self.last_event < PROGRESS_INTERVAL:
+            return
+
+        self.last_event = now
+        elapsed = now - self.start
+        rate = (processed - self.first_processed) / elapsed if elapsed > 0 else 0
+        eta = (self.total - processed) / rate if rate > 0 else None
+        self.on_event(TrackProgress(self.track_id, processed, self.total, images / elapsed if elapsed > 0 else 0, eta))
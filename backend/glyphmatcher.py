@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass
+from threading import Lock
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from backend.textlines import find_text_lines
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Glyph:
+    key: str
+    left: int
+    right: int
+
+
+class GlyphMatcher:
+    '''
+    Recognizes subtitle images by looking up the bitmaps of their glyphs.
+
+    All images of a bitmap subtitle track are rendered with the same font, so most glyphs repeat pixel by pixel.
+    The table glyph -> character is learned from the Tesseract results of the first images. Afterwards images
+    with only known glyphs are recognized without Tesseract. The table is stored per language in the data
+    directory, the keys are the exact bitmaps, so different fonts can share the same file.
+
+    OCR processes learn with their own matchers, the glyphs they learned are taken after every image and
+    merged into the matcher of the converter, which saves them.
+    '''
+
+    matchers = {}
+    matchers_lock = Lock()
+
+    MIN_COMPONENT_AREA = 3 # ignore single pixels left by the binarization
+    MIN_VOTES = 2
+    MIN_AGREEMENT = 0.75
+
+    def __init__(self, name: str, min_samples: int = 50):
+        self.config = Config()
+        self.name = name
+        self.min_samples = min_samples
+        self.lock = Lock()
+
+        self.samples = 0
+        self.glyphs: dict[str, Counter] = {}
+        self.spacing: dict[str, list[int | None]] = {} # glyph height -> [max gap between letters, min gap between words]
+        self.learned = self.empty_learned() # learned since take_learned was called
+
+        self.db_path = self.config.get_datadir() / 'glyphs' / f'{name}.json'
+        self.load()
+
+    @classmethod
+    def get(cls, lang: str | None) -> 'GlyphMatcher':
+        '''
+        Returns the shared matcher for a language, so all tracks of the same language learn together.
+        '''
+        name = lang or 'eng'
+
+        with cls.matchers_lock:
+            if name not in cls.matchers:
+                cls.matchers[name] = GlyphMatcher(name)
+            return cls.matchers[name]
+
+    def load(self):
+        if not self.db_path.exists():
+            return
+
+        try:
+            with open(self.db_path, 'r', encoding='utf8') as file:
+                db = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not load glyph database {self.db_path}: {e}.')
+            return
+
+        self.samples = db.get('samples', 0)
+        self.glyphs = {key: Counter(chars) for key, chars in db.get('glyphs', {}).items()}
+        self.spacing = db.get('spacing', {})
+        logger.debug(f'Loaded {len(self.glyphs)} glyphs from {self.db_path}.')
+
+    def save(self):
+        with self.lock:
+            db = {
+                'samples': self.samples,
+                'glyphs': {key: dict(chars) for key, chars in self.glyphs.items()},
+                'spacing': self.spacing
+            }
+
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.db_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf8') as file:
+                json.dump(db, file, ensure_ascii=False)
+            os.replace(tmp_path, self.db_path)
+
+    def segment(self, img: Image.Image) -> list[tuple[int, list[Glyph]]]:
+        '''
+        Split a binarized image (black text on white background) into lines of glyphs.
+        Returns a list of (glyph height, glyphs) tuples, one for each line.
+        '''
+        mask = np.array(img.convert('L')) < 128
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+
+        lines = []
+        for top, bottom in find_text_lines(mask):
+            # components whose vertical center lies in the line
+            centers = stats[1:, cv2.CC_STAT_TOP] + stats[1:, cv2.CC_STAT_HEIGHT] / 2
+            ids = np.flatnonzero((centers >= top) & (centers < bottom) & (stats[1:, cv2.CC_STAT_AREA] >= self.MIN_COMPONENT_AREA)) + 1
+            ids = sorted(ids, key=lambda i: stats[i, cv2.CC_STAT_LEFT])
+
+            # components that overlap horizontally form one glyph (e.g. "i", "ä", ":")
+            groups = []
+            for i in ids:
+                left = stats[i, cv2.CC_STAT_LEFT]
+                right = left + stats[i, cv2.CC_STAT_WIDTH]
+                if groups and left < groups[-1][1]:
+                    groups[-1][1] = max(groups[-1][1], right)
+                    groups[-1][2].append(i)
+                else:
+                    groups.append([left, right, [i]])
+
+            if not groups:
+                continue
+
+            boxes = []
+            for left, right, group in groups:
+                group_top = min(stats[i, cv2.CC_STAT_TOP] for i in group)
+                group_bottom = max(stats[i, cv2.CC_STAT_TOP] + stats[i, cv2.CC_STAT_HEIGHT] for i in group)
+                boxes.append((left, right, group_top, group_bottom, group))
+
+            baseline = np.median([box[3] for box in boxes])
+            glyph_height = int(np.median([box[3] - box[2] for box in boxes]))
+
+            glyphs = []
+            for left, right, group_top, group_bottom, group in boxes:
+                bitmap = np.isin(labels[group_top:group_bottom, left:right], group)
+
+                # position relative to the baseline to tell apart glyphs like "," and "'"
+                offset = round((group_bottom - baseline) / max(glyph_height, 1) * 4)
+                digest = hashlib.sha1(np.packbits(bitmap).tobytes()).hexdigest()[:20]
+                key = f'{bitmap.shape[0]}x{bitmap.shape[1]}:{offset}:{digest}'
+                glyphs.append(Glyph(key, int(left), int(right)))
+
+            lines.append((glyph_height, glyphs))
+
+        return lines
+
+    def learn(self, img: Image.Image, text: str) -> bool:
+        '''
+        Learn the glyphs of an image from its OCR result.
+        Lines are only used if the number of glyphs matches the number of characters.
+        '''
+        text_lines = [line.split() for line in text.splitlines() if line.strip()]
+        lines = self.segment(img)
+
+        if len(text_lines) != len(lines):
+            return False
+
+        learned = False
+        with self.lock:
+            for (glyph_height, glyphs), words in zip(lines, text_lines):
+                chars = ''.join(words)
+                if len(chars) != len(glyphs):
+                    continue
+
+                for glyph, char in zip(glyphs, chars):
+                    self.glyphs.setdefault(glyph.key, Counter())[char] += 1
+                    self.learned['glyphs'].setdefault(glyph.key, Counter())[char] += 1
+
+                # positions of the first glyph of each word
+                word_starts = {int(i) for i in np.cumsum([len(word) for word in words])[:-1]}
+                gaps = [None, None]
+                for i in range(1, len(glyphs)):
+                    gap = glyphs[i].left - glyphs[i - 1].right
+                    if i in word_starts:
+                        gaps[1] = gap if gaps[1] is None else min(gaps[1], gap)
+                    else:
+                        gaps[0] = gap if gaps[0] is None else max(gaps[0], gap)
+                self.add_spacing(self.spacing, str(glyph_height), gaps)
+                self.add_spacing(self.learned['spacing'], str(glyph_height), gaps)
+
+                learned = True
+
+            if learned:
+                self.samples += 1
+                self.learned['samples'] += 1
+
+        return learned
+
+    @staticmethod
+    def empty_learned() -> dict:
+        return {'samples': 0, 'glyphs': {}, 'spacing': {}}
+
+    @staticmethod
+    def add_spacing(spacing: dict[str, list[int | None]], glyph_height: str, gaps: list[int | None]):
+        letter_gap, word_gap = spacing.setdefault(glyph_height, [None, None])
+        if gaps[0] is not None:
+            spacing[glyph_height][0] = gaps[0] if letter_gap is None else max(letter_gap, gaps[0])
+        if gaps[1] is not None:
+            spacing[glyph_height][1] = gaps[1] if word_gap is None else min(word_gap, gaps[1])
+
+    def take_learned(self) -> dict | None:
+        '''
+        Returns what was learned since the last call (None if nothing), e.g. to send it from an OCR process.
+        '''
+        with self.lock:
+            if not self.learned['samples']:
+                return None
+            learned, self.learned = self.learned, self.empty_learned()
+
+        learned['glyphs'] = {key: dict(chars) for key, chars in learned['glyphs'].items()}
+        return learned
+
+    def merge(self, learned: dict):
+        '''
+        Add the glyphs another matcher learned (see take_learned).
+        '''
+        with self.lock:
+            self.samples += learned['samples']
+            for key, chars in learned['glyphs'].items():
+                self.glyphs.setdefault(key, Counter()).update(chars)
+            for glyph_height, gaps in learned['spacing'].items():
+                self.add_spacing(self.spacing, glyph_height, gaps)
+
+    def lookup(self, key: str) -> str | None:
+        chars = self.glyphs.get(key)
+        if not chars:
+            return None
+
+        char, votes = chars.most_common(1)[0]
+        if votes < self.MIN_VOTES or votes / sum(chars.values()) < self.MIN_AGREEMENT:
+            return None
+
+        return char
+
+    def is_space(self, gap: int, glyph_height: int) -> bool | None:
+        # the median glyph height depends on the letters of the line, so use the closest known font size
+        heights = [int(height) for height in self.spacing if abs(int(height) - glyph_height) <= glyph_height / 4]
+        if not heights:
+            return None
+
+        letter_gap, word_gap = self.spacing[str(min(heights, key=lambda height: abs(height - glyph_height)))]
+
+        if word_gap is not None and gap >= word_gap:
+            return True
+        if letter_gap is not None and gap <= letter_gap:
+            return False
+        if letter_gap is not None and word_gap is not None:
+            return gap >= (letter_gap + word_gap) / 2
+
+        return None # spacing of this font size is not known yet
+
+    def recognize(self, img: Image.Image) -> str | None:
+        '''
+        Recognize the text of a binarized image.
+        Returns None if the image contains glyphs that are not known yet.
+        '''
+        if self.samples < self.min_samples:
+            return None
+
+        lines = self.segment(img)
+        text_lines = []
+
+        with self.lock:
+            for glyph_height, glyphs in lines:
+                line = ''
+                for i, glyph in enumerate(glyphs):
+                    char = self.lookup(glyph.key)
+                    if char is None:
+                        return None
+
+                    if i > 0:
+                        space = self.is_space(glyph.left - glyphs[i - 1].right, glyph_height)
+                        if space is None:
+                            return None
+                        if space:
+                            line += ' '
+
+                    line += char
+                text_lines.append(line)
+
+        return '\n'.join(text_lines)
@@ -1,35 +1,46 @@
-from config import Config
+import logging
+from backend.capabilities import Capabilities
+
+logger = logging.getLogger(__name__)
+
+# ISO 639-2/B codes (used in MKV files) whose ISO 639-2/T code (used by Tesseract) is different
+ALT_LANG_CODES = {'alb': 'sqi',
+                  'arm': 'hye',
+                  'baq': 'eus',
+                  'bur': 'mya',
+                  'chi': 'zho',
+                  'cze': 'ces',
+                  'dut': 'nld',
+                  'fre': 'fra',
+                  'geo': 'kat',
+                  'ger': 'deu',
+                  'gre': 'ell',
+                  'ice': 'isl',
+                  'mac': 'mkd',
+                  'may': 'msa',
+                  'mao': 'mri',
+                  'per': 'fas',
+                  'rum': 'ron',
+                  'slo': 'slk',
+                  'tib': 'bod',
+                  'wel': 'cym'}
 
 def convert_language(lang: str) -> str:
     '''
     Convert the language code from ISO 639-2/B to ISO 639-2/T
     which is used for OCR
     '''
-    alt_lang_codes = {'alb': 'sqi',
-                        'arm': 'hye',
-                        'baq': 'eus',
-                        'bur': 'mya',
-                        'chi': 'zho',
-                        'cze': 'ces',
-                        'dut': 'nld',
-                        'fre': 'fra',
-                        'geo': 'kat',
-                        'ger': 'deu',
-                        'gre': 'ell',
-                        'ice': 'isl',
-                        'mac': 'mkd',
-                        'may': 'msa',
-                        'mao': 'mri',
-                        'per': 'fas',
-                        'rum': 'ron',
-                        'slo': 'slk',
-                        'tib': 'bod',
-                        'wel': 'cym'}
-
-    return alt_lang_codes.get(lang, lang)
+    return ALT_LANG_CODES.get(lang, lang)
+
+def convert_language_to_tag(lang: str) -> str:
+    '''
+    Convert a Tesseract language (e.g. "deu" or "chi_sim") to the ISO 639-2/B code of the MKV language tag
+    '''
+    lang = lang.split('_')[0]
+    tags = {code: tag for tag, code in ALT_LANG_CODES.items()}
+    return tags.get(lang, lang)
 
 def diff_langs_from_text(text: str) -> dict[str, str]:
-    config = Config()
     if text == "":
         return {}
     
@@ -40,7 +51,7 @@ def diff_langs_from_text(text: str) -> dict[str, str]:
             continue
 
         if "->" not in line or line.count("->") > 1:
-            config.logger.error(f"Invalid input: {line}.")
+            logger.error(f"Invalid input: {line}.")
             continue
 
         old_lang, new_lang = line.split("->")
@@ -48,13 +59,16 @@ def diff_langs_from_text(text: str) -> dict[str, str]:
         new_lang = new_lang.strip()
         
         if old_lang != convert_language(old_lang):
-            config.logger.info(f'Changed "{old_lang}" to "{convert_language(old_lang)}".')
+            logger.info(f'Changed "{old_lang}" to "{convert_language(old_lang)}".')
             old_lang = convert_language(old_lang)
 
         if new_lang != convert_language(new_lang):
-            config.logger.info(f'Changed "{new_lang}" to "{convert_language(new_lang)}".')
+            logger.info(f'Changed "{new_lang}" to "{convert_language(new_lang)}".')
             new_lang = convert_language(new_lang)
 
+        if new_lang not in Capabilities().get_languages():
+            logger.warning(f'Language "{new_lang}" is not installed for Tesseract.')
+
         diff_langs[old_lang] = new_lang
 
     return diff_langs
@@ -0,0 +1,63 @@
+import zipfile
+from collections.abc import Callable
+import numpy as np
+from backend.artifactcache import ArtifactCache
+
+
+class ImageArchive:
+    '''
+    Cached decoded images of one subtitle track, one array per display set (or VobSub pack) in a zip of .npy
+    files like np.savez. If the archive in the cache has the same key, the images are read from it instead of
+    decoded, so e.g. the OCR with another language skips decoding. Otherwise the images are written while the
+    track is decoded, so they are never all in memory, and the archive is only added to the cache once all
+    display sets were decoded.
+    '''
+
+    def __init__(self, cache: ArtifactCache, name: str, key: str, write: bool = True):
+        self.cache = cache
+        self.name = name
+        self.key = key
+        self.path = cache.directory / name
+        self.reader = None
+        self.writer = None
+
+        if cache.is_valid(name, key):
+            self.reader = np.load(self.path, allow_pickle=False)
+        else:
+            cache.invalidate(name)
+            if write:
+                # the images are mostly transparent, the fastest compression already shrinks them a lot
+                self.writer = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+
+    def get(self, index: int, decode: Callable[[], np.ndarray], store: bool = True) -> np.ndarray:
+        '''
+        Returns the image of the display set `index`, decoded with `decode` if it isn't cached.
+        '''
+        if self.reader is not None:
+            name = str(index)
+            if name not in self.reader.files: # decoding failed when the archive was written
+                raise ValueError('the image could not be decoded')
+            return self.reader[name]
+
+        img = decode()
+        if store and self.writer is not None:
+            with self.writer.open(f'{index}.npy', 'w', force_zip64=True) as file:
+                np.lib.format.write_array(file, np.ascontiguousarray(img), allow_pickle=False)
+        return img
+
+    def finish(self):
+        '''
+        Add the archive to the cache after all display sets were decoded.
+        '''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.cache.store(self.name, self.key)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+from pathlib import Path
+from pysrt import SubRipItem, SubRipTime
+
+logger = logging.getLogger(__name__)
+
+
+class OCRJournal:
+    '''
+    Append-only journal of the recognized subtitles of one track, so a stopped conversion can resume where it
+    stopped instead of reading the whole track again.
+
+    The first line is a header with the fingerprint of the source file, the settings of the conversion and the
+    calibration of the OCR (language, scale, brightness window). Every following line is one subtitle with
+    the index of the display set (or VobSub pack) that completed it, which is the checkpoint to resume after.
+    '''
+
+    VERSION = 3
+
+    def __init__(self, path: str | Path, source: str | Path, settings: dict):
+        self.path = Path(path)
+        self.source = str(source)
+        self.settings = settings
+        self.file = None
+
+        self.calibration = {}
+        self.items = []
+        self.checkpoint = -1
+
+    def get_fingerprint(self) -> dict:
+        stat = os.stat(self.source)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load(self) -> bool:
+        '''
+        Load the journal of a previous run, returns False if there is none or it doesn't match the source
+        file and the settings anymore.
+        '''
+        try:
+            with open(self.path, 'r', encoding='utf8') as file:
+                content = file.read()
+            lines = content.splitlines()
+            header = json.loads(lines[0])
+        except (OSError, ValueError, IndexError):
+            return False
+
+        if header.get('version') != self.VERSION or header.get('source') != self.get_fingerprint() or header.get('settings') != self.settings:
+            logger.debug(f'Discarding outdated journal {self.path}.')
+            return False
+
+        self.calibration = header['calibration']
+        valid_lines = 1
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError: # last line of a stopped run may be incomplete
+                break
+            start, end = SubRipTime.from_ordinal(entry['start']), SubRipTime.from_ordinal(entry['end'])
+            self.items.append(SubRipItem(len(self.items), start, end, entry['text']))
+            self.checkpoint = entry['index']
+            valid_lines += 1
+
+        if valid_lines < len(lines) or not content.endswith('\n'):
+            # drop the incomplete line, so new lines don't continue it
+            with open(self.path, 'w', encoding='utf8') as file:
+                file.write(''.join(line + '\n' for line in lines[:valid_lines]))
+
+        self.file = open(self.path, 'a', encoding='utf8')
+        return True
+
+    def start(self, calibration: dict):
+        '''
+        Start a new journal after the OCR was calibrated.
+        '''
+        self.calibration = calibration
+        self.file = open(self.path, 'w', encoding='utf8')
+        self.__write({'version': self.VERSION, 'source': self.get_fingerprint(), 'settings': self.settings, 'calibration': calibration})
+
+    def append(self, index: int, item: SubRipItem):
+        self.__write({'index': index, 'start': item.start.ordinal, 'end': item.end.ordinal, 'text': item.text})
+        self.checkpoint = index
+
+    def remove(self):
+        '''
+        Remove the journal when the subtitle file is complete.
+        '''
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __write(self, entry: dict):
+        # flushed after every line, the journal has to survive a killed process
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
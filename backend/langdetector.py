@@ -0,0 +1,64 @@
+from dataclasses import replace
+import re
+import numpy as np
+from backend.cancellation import CancellationToken
+from backend.ocrengine import OCREngine
+from config import Config
+from controller.ocr_profiles import OCRProfile, OCRProfiles
+
+
+class LanguageDetector:
+    '''
+    Detects the language of an untagged or mis-tagged track by reading a few of its images with every
+    candidate model. A wrong model produces words it doesn't know, so they get a low confidence and contain
+    characters that are not letters. The candidate with the best mean score wins.
+    '''
+
+    SAMPLE_SIZE = 6
+    MAX_CANDIDATES = 6
+
+    # letters of any script with apostrophes and hyphens inside the word, surrounded by punctuation
+    WORD_PATTERN = re.compile(r"[^\w]*([^\W\d_]+(?:['’-][^\W\d_]+)*)[^\w]*")
+
+    def __init__(self, candidates: list[str], text_brightness_diff: float, profile: OCRProfile = OCRProfiles.get_profile(OCRProfiles.BALANCED), cancel: CancellationToken | None = None):
+        self.candidates = candidates[:self.MAX_CANDIDATES]
+        self.text_brightness_diff = text_brightness_diff
+        # one cheap pass per image is enough to compare the models
+        self.profile = replace(profile, tier_two=False)
+        self.cancel = cancel
+        self.config = Config()
+
+    def detect(self, samples: list[np.ndarray]) -> tuple[str | None, dict[str, float]]:
+        '''
+        Returns the best candidate (None if no image contained text) and the scores of all candidates.
+        Every sample is read once per candidate, so the caller should pass about SAMPLE_SIZE images.
+        '''
+        scores = {}
+        scale = None
+
+        for lang in self.candidates:
+            ocr = OCREngine(lang, self.text_brightness_diff, use_glyph_cache=False, profile=self.profile, cancel=self.cancel)
+
+            # the scale only depends on the images, not on the language
+            if scale is None:
+                ocr.calibrate_scale(samples)
+                scale = ocr.scale
+            ocr.scale = scale
+
+            results = [ocr.recognize(img) for img in samples]
+            results = [self.score(result.text, result.confidence) for result in results if result.text]
+            if results:
+                scores[lang] = sum(results) / len(results)
+
+        if not scores:
+            return None, scores
+
+        return max(scores, key=scores.get), scores
+
+    def score(self, text: str, confidence: float) -> float:
+        '''
+        Mean word confidence weighted by the share of plausible words.
+        '''
+        words = text.split()
+        hits = sum(1 for word in words if self.WORD_PATTERN.fullmatch(word))
+        return confidence * hits / len(words)
@@ -1,39 +1,66 @@
+import logging
 import os
 import shutil
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
 from config import Config
 from controller.jobs import Jobs
 from controller.sub_formats import SubtitleFormats, SubtitleFileEndings
+from controller.ocr_profiles import OCRProfiles
 import time
-import subprocess
 from backend.subextractor import SubExtractor
 from backend.subconverter import SubtitleConverter
+from backend.events import ConversionEvent, FileFailed, FileFinished, FileResult, JobStarted
+from backend.processes import ProcessRunner
+from backend.artifactcache import ArtifactCache, evict, fingerprint
+from backend.staging import StagedFile, Staging
+from backend.cancellation import CancellationToken, ConversionCancelled
+import backend.helper as subhelper
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConversionOptions:
+    keep_imgs: bool = False
+    keep_old_mkvs: bool = False
+    keep_old_subs: bool = False
+    keep_new_subs: bool = False
+    diff_langs: dict = field(default_factory=dict)
+    sub_format: SubtitleFormats = SubtitleFormats.SRT
+    text_brightness_diff: float = 0.03
+    ocr_profile: OCRProfiles = OCRProfiles.BALANCED
+    # 'continue', 'stop' or a function that gets the failed FileResult and returns whether to continue
+    on_error: str | Callable[[FileResult], bool] = 'continue'
+    # called with the subtitle directory before muxing, the subtitles can be edited until it returns
+    on_edit: Callable[[Path], None] | None = None
+    # cancelling the token stops the conversion at the next file, display set or command
+    cancel: CancellationToken | None = None
+
+
 class SubMain:
 
-    def __init__(self, files: list = [], edit_flag: bool = False, keep_imgs: bool = False, keep_old_mkvs: bool = False, keep_old_subs: bool = False, keep_new_subs: bool = False, diff_langs: dict = {}, sub_format: SubtitleFormats = SubtitleFormats.SRT, text_brightness_diff: float = 0.1, shared_dict: dict = None):
-        
+    def __init__(self, files: list = [], options: ConversionOptions | None = None, on_event: Callable[[ConversionEvent], None] | None = None):
+
         self.file_paths = files
-        self.edit_flag = edit_flag
-        self.keep_imgs = keep_imgs
-        self.keep_old_mkvs = keep_old_mkvs
-        self.keep_old_subs = keep_old_subs
-        self.keep_new_subs = keep_new_subs
-        self.diff_langs = diff_langs
-        self.format = SubtitleFileEndings.get_format(sub_format.name).value
-        self.text_brightness_diff = text_brightness_diff
-        self.shared_dict = shared_dict
+        self.options = options or ConversionOptions()
+        self.on_event = on_event
+
+        self.keep_imgs = self.options.keep_imgs
+        self.keep_old_mkvs = self.options.keep_old_mkvs
+        self.keep_old_subs = self.options.keep_old_subs
+        self.keep_new_subs = self.options.keep_new_subs
+        self.diff_langs = self.options.diff_langs
+        self.format = SubtitleFileEndings.get_format(self.options.sub_format.name).value
+        self.text_brightness_diff = self.options.text_brightness_diff
+        self.ocr_profile = self.options.ocr_profile
+        self.cancel = self.options.cancel or CancellationToken()
+        self.staging = Staging(self.cancel)
 
         self.config = Config()
         self.translate = self.config.translate
 
-        self.shared_dict['finished_files_counter'] = 0
-        self.shared_dict['files_with_error_counter'] = 0
-        self.shared_dict['current_job'] = Jobs.IDLE
-
-        self.shared_dict['error_code'] = 0
-        self.shared_dict['error_message'] = ''
-
     # estimate new file size based on size of new subtitles
     def calc_size(self) -> int:
         file_size = os.path.getsize(self.file_path)
@@ -41,7 +68,7 @@ class SubMain:
         for track_id in range(self.subtitle_counter):
             path = os.path.join(self.sub_dir, str(track_id)) # path to subtitle file without extension
 
-            new_size -= os.path.getsize(f"{path}.sup")
+            new_size -= os.path.getsize(self.cache.directory / f"{track_id}.sup")
 
             if os.path.exists(f"{path}.{self.format}"):
                 new_size += os.path.getsize(f"{path}.{self.format}")
@@ -49,17 +76,13 @@ class SubMain:
         return new_size
 
     def mux_file(self):
-        if self.shared_dict.get('continue_flag', None) is False:
-            return
-
-        self.config.logger.info(f'Muxing file {self.file_name}.')
+        logger.info(f'Muxing file {self.file_name}.')
         new_file_dir = os.path.dirname(self.file_path)
         new_file_path = Path(new_file_dir) / f"{self.file_name} (1).mkv"
 
-        self.shared_dict['current_job'] = Jobs.MUXING
-
         ffmpeg_cmd = [
             "ffmpeg",
+            "-nostats", "-progress", "pipe:1",
             "-i", self.file_path,
             "-y"
         ]
@@ -85,13 +108,18 @@ class SubMain:
         ffmpeg_cmd += ["-c", "copy", new_file_path]
 
 
-        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        runner = ProcessRunner()
+        # the new file is as large as the old one, so its device is limited as well
+        result = runner.run(ffmpeg_cmd, cancel=self.cancel, path=self.file_path, output=new_file_path, timeout=runner.timeout_for(self.file_path), retries=1)
 
-        for line in iter(process.stderr.readline, ''):
-            if "Timestamps are unset in a packet" in line:
-                self.config.logger.warning(line + ". This may lead to a decreased playback performance.")
+        # e.g. a full disk, the new file is incomplete then
+        if result.returncode != 0:
+            last_line = (result.stderr.strip().splitlines() or [''])[-1]
+            raise Exception(f'ffmpeg exited with code {result.returncode} while muxing: {last_line}')
 
-        process.wait()
+        for line in result.stderr.splitlines():
+            if "Timestamps are unset in a packet" in line:
+                logger.warning(line + ". This may lead to a decreased playback performance.")
 
     # remove file that may not exist anymore without throwing an error
     def silent_remove(self, file: str):
@@ -100,108 +128,251 @@ class SubMain:
         except OSError:
             pass
 
-    def clean(self):
+    def publish_subtitles(self):
+        '''
+        Copy the new subtitles from the cache to the subtitle directory, where they are edited and muxed from.
+        '''
+        os.makedirs(self.sub_dir, exist_ok=True)
+        for track_id in range(self.subtitle_counter):
+            shutil.copyfile(self.cache.directory / f'{track_id}.{self.format}', self.sub_dir / f'{track_id}.{self.format}')
+
+    def clean(self, cancelled: bool = False, failed: bool = False):
         new_file_dir = os.path.dirname(self.file_path)
         new_file_path = os.path.join(new_file_dir, f"{self.file_name} (1).mkv")
 
-        self.config.logger.info("Cleaning up.")
+        logger.info("Cleaning up.")
 
-        if not (self.keep_old_subs or self.keep_new_subs):
-            if not self.keep_imgs:
-                shutil.rmtree(self.img_dir.parent)
-            else:
-                shutil.rmtree(self.sub_dir)
-        elif not self.keep_old_subs:
+        # the file failed before its directories were known
+        if self.sub_dir is None:
+            return
+
+        if cancelled:
+            self.remove_unfinished(new_file_path)
+            return
+
+        # the cache keeps the extracted streams and the results of the OCR for the next conversion,
+        # only the outputs the user asked for are kept in the subtitle and image directories
+        if self.keep_old_subs:
+            os.makedirs(self.sub_dir, exist_ok=True)
             for track_id in range(self.subtitle_counter):
-                self.silent_remove(os.path.join(self.sub_dir, f'{track_id}.sup'))
-        elif not self.keep_new_subs:
+                for file_ending in ('sup', 'sub', 'idx'):
+                    old_sub = self.cache.directory / f'{track_id}.{file_ending}'
+                    if old_sub.exists():
+                        shutil.copyfile(old_sub, self.sub_dir / old_sub.name)
+        if not self.keep_new_subs:
             for track_id in range(self.subtitle_counter):
-                self.silent_remove(os.path.join(self.sub_dir, f'{track_id}.srt'))
                 self.silent_remove(os.path.join(self.sub_dir, f'{track_id}.{self.format}'))
+        if not self.keep_imgs:
+            shutil.rmtree(self.img_dir, ignore_errors=True)
 
-        if not self.keep_old_mkvs:
+        # the directories don't exist if the file failed before extracting
+        for directory in (self.sub_dir, self.sub_dir.parent):
+            try:
+                os.rmdir(directory)
+            except OSError: # not empty
+                pass
+
+        # a failed or killed mux leaves a partial new file, the old file is only replaced after a successful one
+        if failed:
+            self.silent_remove(new_file_path)
+            # like after a cancellation, the journals of the tracks are kept to resume their OCR
+            if self.cache is not None:
+                self.cache.remove_unfinished()
+        elif not self.keep_old_mkvs and os.path.exists(new_file_path):
             os.remove(self.file_path)
             os.rename(new_file_path, self.file_path)
 
-    def convert(self):
-        self.shared_dict['continue_flag'] = None
-        
-        for self.file_path in self.file_paths:
-            self.file_name = os.path.splitext(os.path.basename(self.file_path))[0]
-            
-            try:
-                self.config.logger.info(f'Processing {self.file_name}.')
-
-                main_dir_path = self.config.get_datadir() / 'subtitles' / self.file_name
-                self.img_dir = main_dir_path / 'images'
-                self.sub_dir = main_dir_path / 'subtitles'
-
-                self.shared_dict['current_job'] = Jobs.EXTRACT
-                self.config.logger.debug(f'Starting to extract subtitles.')
-
-                extractor = SubExtractor(self.file_path, self.sub_dir)
-                extractor.start()
-
-                self.subtitle_counter = extractor.subtitle_counter
-                self.subtitle_languages = extractor.subtitle_languages
-
-                self.config.logger.debug(f'Finished extracting subtitles.')
-
-                # skip title if no PGS subtitles were found
-                if self.subtitle_counter == 0:
-                    self.config.logger.info("No subtitles found.")
-                    continue
-
-                self.config.logger.debug(f'Starting to convert subtitles.')
-                self.shared_dict['current_job'] = Jobs.CONVERT
-
-                converter = SubtitleConverter(self.subtitle_counter, self.subtitle_languages, self.diff_langs, self.sub_dir, self.img_dir, self.format, self.keep_imgs, self.text_brightness_diff)
-                converter.convert_subtitles()
-                self.config.logger.debug(f'Finished converting subtitles.')
-
-                self.shared_dict['edit_flag'] = self.edit_flag
-                self.shared_dict['sub_dir'] = self.sub_dir
-
-                if self.edit_flag:
-                    self.config.logger.debug(f'Pause for editing subtitles in {self.sub_dir}.')
-                    if os.name == "nt":
-                        os.system(f"explorer.exe \"{os.path.join(os.getcwd(), self.sub_dir)}\"")
-                    
-                    while self.shared_dict.get('edit_flag', False) is not False:
-                        time.sleep(1)
-
-                    self.config.logger.debug(f'Continue after pausing for subtitle editing.')
-                
-                self.mux_file()
-                self.clean()
-
-                self.config.logger.info(f'Finished {self.file_name}.')
-                self.shared_dict['finished_files_counter'] += 1
-            except Exception as e:
-                self.shared_dict['files_with_error_counter'] += 1
-                self.shared_dict['error_code'] = 2
-                self.shared_dict['error_message'] = self.translate('Error while processing {file_name}: {error}').format(file_name=self.file_name, error=e)
-                self.config.logger.error(f'Error while processing {self.file_name}: {e}')
-
-                # wait for user input to continue
-                while self.shared_dict.get('continue_flag', None) is None:
-                    time.sleep(1)
-
-                if self.shared_dict.get('continue_flag', None):
-                    self.config.logger.debug("Continuing with the next file after error.")
-                    self.clean()
-                else:
-                    self.config.logger.debug("Exiting program after error.")
-                    self.clean()
-                    break
-
-        self.shared_dict['current_job'] = Jobs.FINISHED
-    
-# ----------------FOR THE CONTROLLER----------------
-    def set_continue_flag(self, flag: bool):
-        self.shared_dict['continue_flag'] = flag
-        self.reset_error_code()
-    
-    def reset_error_code(self):
-        self.shared_dict['error_code'] = 0
-        self.shared_dict['error_message'] = ''
+    def remove_unfinished(self, new_file_path: str):
+        '''
+        Remove the outputs of a cancelled conversion that are not finished: the half muxed file, the subtitle
+        images and the files of stages that didn't finish. Finished stages and the journals of the OCR are kept,
+        so converting the file again continues where it was cancelled.
+        '''
+        self.silent_remove(new_file_path)
+
+        if not self.keep_imgs:
+            shutil.rmtree(self.img_dir, ignore_errors=True)
+        if self.cache is not None:
+            self.cache.remove_unfinished()
+
+    def convert(self) -> list[FileResult]:
+        results = []
+
+        for file_path in self.file_paths:
+            if self.cancel.cancelled:
+                break
+
+            result = self.convert_file(file_path)
+            results.append(result)
+
+            if result.cancelled:
+                logger.info("Conversion cancelled.")
+                break
+            if not result.success and not self.__continue_after_error(result):
+                logger.debug("Exiting program after error.")
+                break
+
+        runner = ProcessRunner()
+        if runner.stats['kills']:
+            logger.warning(f'Killed {runner.stats["kills"]} stalled processes, retried {runner.stats["retries"]} commands.')
+
+        return results
+
+    def write_back(self, staged: StagedFile, result: FileResult, extractions: int):
+        '''
+        Copy the new file of a staged file next to the original, cleaning up continues with the original.
+        '''
+        new_file_name = f"{self.file_name} (1).mkv"
+        logger.info(f'Writing {new_file_name} back to {staged.original.parent}.')
+        self.staging.write_back(staged.directory / new_file_name, staged.original.parent / new_file_name)
+        self.file_path = self.source_path
+
+        # every extraction would have read the file from the share once more
+        result.bytes_saved = extractions * staged.size
+        logger.info(f'Staging saved {result.bytes_saved / 1024**2:.0f} MB of reads from the network share.')
+
+    def convert_file(self, file_path: str) -> FileResult:
+        # the passes read self.file_path, which is the local copy of a staged file
+        self.file_path = self.source_path = file_path
+        staged = None
+        self.file_name = os.path.splitext(os.path.basename(self.file_path))[0]
+        self.subtitle_counter = 0
+        self.img_dir = self.sub_dir = self.cache = None
+        result = FileResult(str(file_path))
+        start = job_start = time.perf_counter()
+
+        def start_job(job: Jobs, timing: str | None = None):
+            nonlocal job_start
+            now = time.perf_counter()
+            if timing is not None:
+                result.timings[timing] = now - job_start
+            job_start = now
+            self.__emit(JobStarted(job))
+
+        try:
+            logger.info(f'Processing {self.file_name}.')
+
+            # the fingerprint keeps files with the same name apart
+            file_fingerprint = fingerprint(self.file_path)
+            main_dir_path = self.config.get_datadir() / 'subtitles' / f'{self.file_name}-{file_fingerprint[:12]}'
+            cache_dir = self.config.get_datadir() / 'cache' / main_dir_path.name
+            self.img_dir = main_dir_path / 'images'
+            self.sub_dir = main_dir_path / 'subtitles'
+            result.sub_dir = self.sub_dir
+
+            staged = self.staging.stage(self.file_path, main_dir_path.name)
+            if staged is not None:
+                self.file_path = str(staged.path)
+
+            start_job(Jobs.EXTRACT)
+            logger.debug(f'Starting to extract subtitles.')
+
+            self.cache = ArtifactCache(cache_dir, file_fingerprint)
+            extractor = SubExtractor(self.file_path, cache_dir, self.cache, self.__emit, self.cancel)
+            extractor.start()
+
+            self.subtitle_counter = extractor.subtitle_counter
+            self.subtitle_languages = extractor.subtitle_languages
+
+            logger.debug(f'Finished extracting subtitles.')
+
+            # skip title if no PGS subtitles were found
+            if self.subtitle_counter == 0:
+                logger.info("No subtitles found.")
+                result.timings['extract'] = result.timings['total'] = time.perf_counter() - start
+                result.success = True
+                self.__emit(FileFinished(result))
+                return result
+
+            logger.debug(f'Starting to convert subtitles.')
+            self.cancel.raise_if_cancelled()
+            start_job(Jobs.CONVERT, 'extract')
+
+            # the converter works in the cache directory, the new subtitles are copied to the subtitle directory
+            converter = SubtitleConverter(self.subtitle_counter, self.subtitle_languages, self.diff_langs, cache_dir, self.img_dir, self.format, self.keep_imgs, self.text_brightness_diff, self.ocr_profile, self.cache, self.__emit, self.cancel)
+            converter.convert_subtitles()
+            result.tracks = converter.track_results
+
+            # tag the tracks with their detected language when muxing
+            for track_id, lang in converter.detected_languages.items():
+                tag = subhelper.convert_language_to_tag(lang)
+                if tag != self.subtitle_languages[track_id]:
+                    logger.info(f'Changing the language of subtitle #{track_id} from "{self.subtitle_languages[track_id]}" to "{tag}".')
+                    self.subtitle_languages[track_id] = tag
+            result.languages = self.subtitle_languages
+            self.publish_subtitles()
+            logger.debug(f'Finished converting subtitles.')
+
+            if self.options.on_edit is not None:
+                result.timings['convert'] = time.perf_counter() - job_start
+                job_start = time.perf_counter()
+                logger.debug(f'Pause for editing subtitles in {self.sub_dir}.')
+                self.options.on_edit(self.sub_dir)
+                logger.debug(f'Continue after pausing for subtitle editing.')
+                start_job(Jobs.MUXING, 'edit')
+            else:
+                start_job(Jobs.MUXING, 'convert')
+
+            self.cancel.raise_if_cancelled() # e.g. while the subtitles were edited
+            self.mux_file()
+            if staged is not None:
+                self.write_back(staged, result, extractor.extractions)
+            result.timings['mux'] = time.perf_counter() - job_start
+            self.clean()
+
+            logger.info(f'Finished {self.file_name}.')
+            result.success = True
+            result.timings['total'] = time.perf_counter() - start
+            self.__emit(FileFinished(result))
+        except Exception as e:
+            result.timings['total'] = time.perf_counter() - start
+            self.file_path = self.source_path
+
+            # errors after a cancellation are caused by it, e.g. by a killed command
+            if isinstance(e, ConversionCancelled) or self.cancel.cancelled:
+                result.cancelled = True
+                result.error = 'Cancelled'
+                logger.info(f'Cancelled {self.file_name}.')
+                self.__emit(JobStarted(Jobs.CANCEL))
+                self.clean(cancelled=True)
+            else:
+                result.error = str(e)
+                logger.error(f'Error while processing {self.file_name}: {e}')
+                self.__emit(FileFailed(result))
+                self.clean(failed=True)
+        finally:
+            if staged is not None:
+                self.staging.remove(staged)
+            if self.cache is not None:
+                evict(self.cache.directory.parent, self.config.get_value(Config.Settings.CACHE_QUOTA) * 1024**3, keep=self.cache.directory)
+
+        return result
+
+    def __continue_after_error(self, result: FileResult) -> bool:
+        match self.options.on_error:
+            case 'continue':
+                return True
+            case 'stop':
+                return False
+            case policy:
+                return bool(policy(result))
+
+    def __emit(self, event: ConversionEvent):
+        # called by the track threads and the process runner as well
+        if self.on_event is not None:
+            self.on_event(replace(event, file=self.source_path))
+
+
+def convert_file(path: str, options: ConversionOptions | None = None, on_event: Callable[[ConversionEvent], None] | None = None) -> FileResult:
+    '''
+    Convert the subtitles of one MKV file in the calling thread. Errors are returned in the result, not raised.
+    '''
+    return SubMain([path], options, on_event).convert_file(path)
+
+
+def convert_files(paths: list[str], options: ConversionOptions | None = None, on_event: Callable[[ConversionEvent], None] | None = None) -> list[FileResult]:
+    '''
+    Convert the subtitles of several MKV files one after another, `options.on_error` decides whether to
+    continue after a failed file. After `options.cancel` was cancelled the files that didn't start are skipped.
+    '''
+    return SubMain(paths, options, on_event).convert()
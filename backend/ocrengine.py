@@ -0,0 +1,383 @@
+from collections.abc import Iterable
+from contextlib import nullcontext
+from dataclasses import dataclass
+import io
+import logging
+import multiprocessing
+import os
+import shlex
+import subprocess
+import time
+from threading import Lock
+import numpy as np
+import pytesseract
+from PIL import Image
+import cv2
+from backend.cancellation import CancellationToken
+from backend.glyphmatcher import GlyphMatcher
+from backend.textlines import find_text_lines
+from config import Config
+from controller.ocr_profiles import OCRProfile, OCRProfiles
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OCRResult:
+    text: str
+    confidence: float # mean word confidence (0-100)
+    tier: int = 1
+
+
+class OCREngine:
+    '''
+    Recognizes the text of the subtitle images of one track.
+
+    The first tier is a cheap pass with the default preprocessing. Only images whose mean word confidence is
+    below the confidence threshold of the profile get the second tier, which upscales the image and tries other
+    brightness windows.
+    '''
+
+    # brightness windows of the second tier, fractions of the V channel range (see get_window)
+    TIER_TWO_BRIGHTNESS_DIFFS = (0.06, 0.19)
+
+    # brightness windows tried when tuning a track, e.g. for yellow text or grey outlines
+    BRIGHTNESS_CANDIDATES = (0.03, 0.06, 0.12, 0.19, 0.25)
+    TUNING_SAMPLE_SIZE = 5
+
+    # Tesseract works best if the x-height of the text is within this band (in pixels)
+    X_HEIGHT_BAND = (20, 32)
+    TARGET_X_HEIGHT = 26
+    SCALE_LIMITS = (0.25, 4)
+
+    # (model, language) pairs whose missing model was already reported
+    missing_models = set()
+    missing_models_lock = Lock()
+
+    def __init__(self, lang: str | None, text_brightness_diff: float, use_glyph_cache: bool = True, profile: OCRProfile = OCRProfiles.get_profile(OCRProfiles.BALANCED), cancel: CancellationToken | None = None):
+        self.lang = lang
+        self.text_brightness_diff = text_brightness_diff
+        # window of the first tier around the brightest pixel in V channel units (0-255). The configured deviation
+        # is applied unscaled as it always was, so the first tier keeps its binarization, only the windows of the
+        # second tier and the tuning are scaled to the brightness range with get_window
+        self.brightness_window = text_brightness_diff
+        self.use_glyph_cache = use_glyph_cache
+        self.profile = profile
+        self.cancel = cancel
+        self.confidence_threshold = profile.confidence_threshold
+        self.config = Config()
+        self.tesseract_config = self.get_tesseract_config()
+        self.padding = 25
+        self.scale = 1
+
+        self.ocr_timeout = self.config.get_value(Config.Settings.OCR_TIMEOUT) or 0
+        # checked once, so the log calls for every image cost nothing if debug logging of the engine is disabled
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+
+        self.stats = {'images': 0, 'tier_two': 0, 'scale': 1, 'brightness_window': self.brightness_window, 'tuning_calls': 0, 'tuning_time': 0, 'timeouts': 0}
+
+    def calibrate_scale(self, samples: list[np.ndarray]):
+        '''
+        Choose the scale of the track from a sample of its images, so the text lands in the optimal x-height band.
+        '''
+        if not self.profile.rescale:
+            return
+
+        x_heights = []
+        for img in samples:
+            mask = np.array(self.process_image(img).convert('L')) < 128
+            x_heights += [self.measure_x_height(mask[top:bottom]) for top, bottom in find_text_lines(mask)]
+
+        if not x_heights:
+            return
+
+        x_height = float(np.median(x_heights))
+        if self.X_HEIGHT_BAND[0] <= x_height <= self.X_HEIGHT_BAND[1]:
+            self.scale = 1
+        else:
+            self.scale = float(np.clip(self.TARGET_X_HEIGHT / x_height, *self.SCALE_LIMITS))
+
+        self.stats['scale'] = self.scale
+        logger.debug(f'Measured x-height of {x_height:.1f}px in {len(samples)} images, using scale {self.scale:.2f}.')
+
+    def calibrate_brightness(self, samples: list[np.ndarray]):
+        '''
+        Choose the brightness window of the track from a sample of its images: the window with the best mean
+        confidence wins, images without text count as 0. Must be called after calibrate_scale.
+        The tuning reads at most TUNING_SAMPLE_SIZE images per window and stops early if the
+        configured window already reads every image reliably.
+        '''
+        samples = [img for img in samples if np.any(img[:, :, 3] > 0)][:self.TUNING_SAMPLE_SIZE]
+        if not samples:
+            return
+
+        # known glyphs would be recognized with full confidence in every window
+        use_glyph_cache, self.use_glyph_cache = self.use_glyph_cache, False
+        start = time.perf_counter()
+        scores = {}
+
+        try:
+            windows = (self.brightness_window, *(self.get_window(brightness_diff) for brightness_diff in self.BRIGHTNESS_CANDIDATES))
+            for window in dict.fromkeys(windows):
+                results = [self.read(self.process_image(img, window)) for img in samples]
+                self.stats['tuning_calls'] += len(samples)
+                scores[window] = sum(result.confidence for result in results if result.text) / len(results)
+
+                if window == self.brightness_window and all(result.text and result.confidence >= self.confidence_threshold for result in results):
+                    break
+        finally:
+            self.use_glyph_cache = use_glyph_cache
+
+        # the configured window wins ties
+        self.brightness_window = self.stats['brightness_window'] = max(scores, key=scores.get)
+        self.stats['tuning_time'] = time.perf_counter() - start
+        logger.debug(f'Brightness scores: {", ".join(f"{window:g}: {score:.1f}" for window, score in scores.items())}, using {self.brightness_window:g}.')
+
+    def get_tesseract_config(self) -> str:
+        tesseract_config = f'--oem {self.profile.oem} --psm {self.profile.psm}'
+
+        tessdata_setting = {'fast': Config.Settings.TESSDATA_FAST, 'best': Config.Settings.TESSDATA_BEST}.get(self.profile.model)
+        if tessdata_setting is None:
+            return tesseract_config
+
+        # use the model directory of the profile if it has a model for the language
+        tessdata_dir = self.config.get_value(tessdata_setting)
+        if tessdata_dir and os.path.exists(os.path.join(tessdata_dir, f'{self.lang or "eng"}.traineddata')):
+            tesseract_config += f' --tessdata-dir "{tessdata_dir}"'
+        else:
+            self.warn_missing_model()
+
+        return tesseract_config
+
+    def warn_missing_model(self):
+        '''
+        Warn once per model and language, an engine is created for every track, worker, sample and plan.
+        '''
+        with self.missing_models_lock:
+            if (self.profile.model, self.lang) in self.missing_models:
+                return
+            self.missing_models.add((self.profile.model, self.lang))
+
+        # the main process already warned about the engines of its workers
+        log = logger.warning if multiprocessing.parent_process() is None else logger.debug
+        log(f'No tessdata_{self.profile.model} model found for "{self.lang or "eng"}", using the default model instead.')
+
+    def measure_x_height(self, line: np.ndarray) -> int:
+        # the rows between baseline and x-height contain most of the text, ascenders and descenders are thin
+        row_sums = line.sum(axis=1)
+        return int(np.count_nonzero(row_sums >= row_sums.max() / 2))
+
+    def recognize(self, img: np.ndarray) -> OCRResult:
+        '''
+        Recognize the text of a RGBA image with values between 0 and 1.
+        '''
+        if not np.any(img[:, :, 3] > 0): # nothing visible
+            return OCRResult('', 100)
+
+        tier_two_images = (self.process_image(img, window) for window in self.get_tier_two_windows())
+        return self.recognize_processed(self.process_image(img), tier_two_images)
+
+    def recognize_processed(self, img: Image.Image, tier_two_images: Iterable[Image.Image]) -> OCRResult:
+        '''
+        Recognize the text of an already processed image, the processed images of the second tier are only used
+        if the first tier is not confident enough.
+        '''
+        result = self.recognize_first_tier(img)
+        if not self.needs_tier_two(result):
+            return result
+
+        return self.recognize_second_tier(result, tier_two_images)
+
+    def recognize_first_tier(self, img: Image.Image) -> OCRResult:
+        self.stats['images'] += 1
+        result = self.read(img)
+
+        if self.debug and not self.needs_tier_two(result):
+            logger.debug(f'Image #{self.stats["images"]}: confidence {result.confidence:.0f} in the first tier.')
+        return result
+
+    def needs_tier_two(self, result: OCRResult) -> bool:
+        return self.profile.tier_two and result.confidence < self.confidence_threshold
+
+    def recognize_second_tier(self, result: OCRResult, tier_two_images: Iterable[Image.Image]) -> OCRResult:
+        '''
+        Read the processed images of the second tier of an image, `result` is the result of its first tier.
+        '''
+        self.stats['tier_two'] += 1
+        results = [result]
+        for processed in tier_two_images:
+            results.append(self.read(processed, self.scale * self.profile.tier_two_scale, tier=2))
+
+        best = max(results, key=lambda result: result.confidence)
+        if self.debug:
+            logger.debug(f'Image #{self.stats["images"]}: confidence {result.confidence:.0f} in the first tier, {best.confidence:.0f} after the second tier.')
+        return best
+
+    def get_tier_two_windows(self) -> tuple:
+        if not self.profile.tier_two:
+            return ()
+
+        return (self.brightness_window, *(self.get_window(brightness_diff) for brightness_diff in self.TIER_TWO_BRIGHTNESS_DIFFS))
+
+    @staticmethod
+    def get_window(brightness_diff: float) -> float:
+        '''
+        Brightness window in V channel units of a deviation that is a fraction of the brightness range.
+        '''
+        return 255 * brightness_diff
+
+    def read(self, img: Image.Image, scale: float | None = None, tier: int = 1) -> OCRResult:
+        '''
+        Read a processed image line by line.
+        '''
+        if scale is None:
+            scale = self.scale
+
+        results = [self.read_line(line, scale, tier) for line in self.split_lines(img)]
+        results = [result for result in results if result.text]
+
+        if not results:
+            return OCRResult('', 0, tier)
+
+        text = '\n'.join(result.text for result in results)
+        confidence = min(result.confidence for result in results)
+        return OCRResult(text, confidence, tier)
+
+    def read_line(self, img: Image.Image, scale: float = 1, tier: int = 1) -> OCRResult:
+        # images with only known glyphs don't need Tesseract
+        # glyphs are matched before scaling, because resampling changes their bitmaps depending on their position
+        if self.use_glyph_cache and tier == 1:
+            glyph_matcher = GlyphMatcher.get(self.lang)
+            text = glyph_matcher.recognize(img)
+            if text is not None:
+                return OCRResult(text, 100, tier)
+
+        # the image is exactly one line, so Tesseract can skip the page layout analysis
+        data = self.run_tesseract(self.resize(img, scale))
+        if data is None:
+            self.stats['timeouts'] += 1
+            logger.error(f'Killed Tesseract, it did not finish within {self.ocr_timeout}s. Skipping this line.')
+            return OCRResult('', 0, tier)
+        words = [(word.strip(), float(conf)) for word, conf in zip(data['text'], data['conf']) if word.strip()]
+
+        if not words:
+            return OCRResult('', 0, tier)
+
+        text = ' '.join(word for word, _ in words)
+        confidence = sum(conf for _, conf in words) / len(words)
+
+        # only learn from reliable results
+        if self.use_glyph_cache and tier == 1 and confidence >= self.confidence_threshold:
+            GlyphMatcher.get(self.lang).learn(img, text)
+
+        return OCRResult(text, confidence, tier)
+
+    def run_tesseract(self, img: Image.Image) -> dict[str, list[str]] | None:
+        '''
+        Run Tesseract on an image and return the columns of its TSV output, None if it was killed after the
+        timeout. Unlike pytesseract, the process is killed as soon as the conversion is cancelled.
+        '''
+        image = io.BytesIO()
+        img.save(image, format='PNG')
+
+        command = [pytesseract.pytesseract.tesseract_cmd, 'stdin', 'stdout']
+        if self.lang:
+            command += ['-l', self.lang]
+        command += shlex.split(self.tesseract_config, posix=os.name != 'nt') + ['-c', 'tessedit_create_tsv=1']
+
+        if self.cancel is not None:
+            self.cancel.raise_if_cancelled()
+
+        window = {'creationflags': subprocess.CREATE_NO_WINDOW} if os.name == 'nt' else {}
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **window)
+        with self.cancel.on_cancel(process.kill) if self.cancel is not None else nullcontext():
+            try:
+                stdout, stderr = process.communicate(image.getvalue(), timeout=self.ocr_timeout or None)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                return None
+
+        if self.cancel is not None:
+            self.cancel.raise_if_cancelled()
+        if process.returncode != 0:
+            last_line = (stderr.decode(errors='replace').strip().splitlines() or [''])[-1]
+            raise RuntimeError(f'Tesseract exited with code {process.returncode}: {last_line}')
+
+        rows = [line.split('\t') for line in stdout.decode(errors='replace').splitlines() if line]
+        if not rows:
+            return {'text': [], 'conf': []}
+        header = rows[0]
+        # the text column is missing in rows without text
+        return {column: [row[i] if i < len(row) else '' for row in rows[1:]] for i, column in enumerate(header)}
+
+    def resize(self, img: Image.Image, scale: float) -> Image.Image:
+        if scale == 1:
+            return img
+
+        # downscaling needs to average the pixels, otherwise thin strokes disappear
+        resample = Image.BOX if scale < 1 else Image.BICUBIC
+        return img.resize((max(int(img.width*scale), 1), max(int(img.height*scale), 1)), resample)
+
+    def process_image(self, img: np.ndarray, window: float | None = None) -> Image.Image:
+        '''
+        Binarize a RGBA image: the pixels within `window` (V channel units) of the brightest one become black text.
+        '''
+        if window is None:
+            window = self.brightness_window
+
+        image = np.zeros((img.shape[0], img.shape[1], 4), dtype=np.uint8) # Create a black rgba background
+        image[:, :, :] = np.array(img*255, dtype=np.uint8) # Set the text color to white and keep the alpha channel as it is (for forced subtitles)
+
+        # Convert image to HSV color space (ignoring alpha channel)
+        hsv_image = cv2.cvtColor(image[:,:,:3], cv2.COLOR_BGR2HSV)
+        v_channel = hsv_image[:,:,2]
+
+        # Only consider pixels where alpha > 0 (not transparent)
+        alpha_channel = image[:,:,3]
+        valid_pixels = v_channel[alpha_channel > 0]
+
+        if len(valid_pixels) > 0:
+            max_v_value = int(np.max(valid_pixels))
+        else:
+            max_v_value = int(np.max(v_channel))
+
+        # Create a mask to only select the pixels with the highest V value (+- tolerance)
+        mask = cv2.inRange(v_channel, np.array(max_v_value - window), np.array(max_v_value + window))
+
+        # Only apply mask to non-transparent pixels
+        mask[alpha_channel == 0] = 0
+
+        # create empty white image (to make background white)
+        result = np.full((image.shape[0], image.shape[1], 3), 255, dtype=np.uint8)
+
+        # set pixels of mask to black (so text becomes black)
+        result[mask == 255] = [0, 0, 0]
+
+        img = Image.fromarray(result)
+
+        return self.add_padding(img)
+
+    def add_padding(self, img: Image.Image) -> Image.Image:
+        # add padding to image so text is not at the edge to improve OCR
+        width, height = img.size
+        new_width = width + 2*self.padding
+        new_height = height + 2*self.padding
+
+        new_img = Image.new(img.mode, (new_width, new_height), (255, 255, 255))
+        new_img.paste(img, (self.padding, self.padding))
+        return new_img
+
+    def split_lines(self, img: Image.Image) -> list[Image.Image]:
+        '''
+        Split a processed image into one image per text line, found by the horizontal projection of the text.
+        '''
+        mask = np.array(img.convert('L')) < 128
+        columns = np.flatnonzero(mask.any(axis=0))
+        lines = []
+
+        for top, bottom in find_text_lines(mask):
+            line = img.crop((int(columns[0]), top, int(columns[-1]) + 1, bottom))
+            lines.append(self.add_padding(line))
+
+        return lines
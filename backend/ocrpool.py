@@ -0,0 +1,264 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context, shared_memory
+from queue import Queue
+import sys
+from threading import Thread
+import numpy as np
+from PIL import Image
+from backend.cancellation import CancellationToken
+from backend.glyphmatcher import GlyphMatcher
+from backend.ocrengine import OCREngine, OCRResult
+from controller.ocr_profiles import OCRProfile
+from config import Config
+
+
+@dataclass(frozen=True)
+class EngineSpec:
+    '''
+    Everything an OCR process needs to create the same OCREngine as the track.
+    '''
+    lang: str | None
+    text_brightness_diff: float
+    use_glyph_cache: bool
+    profile: OCRProfile
+    scale: float
+    brightness_window: float
+
+    @staticmethod
+    def from_engine(ocr: OCREngine):
+        return EngineSpec(ocr.lang, ocr.text_brightness_diff, ocr.use_glyph_cache, ocr.profile, ocr.scale, ocr.brightness_window)
+
+
+@dataclass(frozen=True)
+class BitmapRef:
+    '''
+    Descriptor of the packed masks of one image in the shared memory of a BitmapRing.
+    Masks that don't fit into a slot are sent with the descriptor instead.
+    '''
+    memory: str | None
+    slot: int | None
+    offset: int
+    shape: tuple[int, int]
+    planes: int
+    data: bytes | None = None
+
+
+class BitmapRing:
+    '''
+    Shared memory with a fixed number of slots for the images that are waiting for or being read by an OCR process.
+    The processed images are black and white, so they are sent as masks with one bit per pixel (np.packbits)
+    instead of pickling the RGBA arrays. A slot is used again as soon as the OCR of its image is done and
+    writing blocks while all slots are in use.
+    '''
+
+    SLOT_SIZE = 512 * 1024 # enough for the mask of a padded 1080p image
+
+    def __init__(self, slots: int, slot_size: int = SLOT_SIZE):
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.free_slots = Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+
+    def write(self, masks: list[np.ndarray]) -> BitmapRef:
+        shape = masks[0].shape
+        packed = pack_masks(masks)
+
+        if packed.nbytes > self.slot_size:
+            return BitmapRef(None, None, 0, shape, len(masks), packed.tobytes())
+
+        slot = self.free_slots.get()
+        offset = slot * self.slot_size
+        self.memory.buf[offset:offset + packed.nbytes] = packed.tobytes()
+        return BitmapRef(self.memory.name, slot, offset, shape, len(masks))
+
+    def release(self, ref: BitmapRef):
+        if ref.slot is not None:
+            self.free_slots.put(ref.slot)
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def pack_masks(masks: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate([np.packbits(mask, axis=None) for mask in masks])
+
+
+def to_mask(image: Image.Image) -> np.ndarray:
+    return np.array(image.convert('L')) < 128
+
+
+# state of an OCR process
+attached_memories = {}
+engines = {}
+cancel = None
+
+
+def initialize_process(stop, *worker_args):
+    '''
+    Initializer of an OCR process. The token of the process is cancelled when the dispatcher sets `stop`, which
+    kills the Tesseract process of the image that is being read.
+    '''
+    global cancel
+    Config.initialize_worker(*worker_args)
+    cancel = CancellationToken()
+    Thread(target=lambda: stop.wait() and cancel.cancel(), name="Cancel", daemon=True).start()
+
+
+def attach_memory(name: str) -> shared_memory.SharedMemory:
+    memory = attached_memories.get(name)
+    if memory is None:
+        # the converter owns the memory, spawned processes share its resource tracker on older versions
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            memory = shared_memory.SharedMemory(name=name)
+        attached_memories[name] = memory
+
+    return memory
+
+
+def read_bitmaps(ref: BitmapRef) -> list[Image.Image]:
+    height, width = ref.shape
+    plane_size = (height * width + 7) // 8
+
+    if ref.data is not None:
+        packed = np.frombuffer(ref.data, dtype=np.uint8)
+    else:
+        # copy, so the slot can be used again while this image is read
+        packed = np.frombuffer(attach_memory(ref.memory).buf, dtype=np.uint8, count=ref.planes * plane_size, offset=ref.offset).copy()
+
+    images = []
+    for plane in range(ref.planes):
+        mask = np.unpackbits(packed[plane * plane_size:(plane + 1) * plane_size], count=height * width).reshape(height, width)
+        images.append(Image.fromarray(np.where(mask, 0, 255).astype(np.uint8)).convert('RGB'))
+
+    return images
+
+
+def recognize_bitmaps(spec: EngineSpec, ref: BitmapRef, first: OCRResult | None = None) -> tuple[OCRResult, dict[str, int], dict | None]:
+    '''
+    Runs in an OCR process, returns the result, the changes of the counters in the stats of the engine and the
+    glyphs learned from the image. Reads the first tier of an image, or its second tier if `first` is the
+    result of its first tier.
+    '''
+    ocr = engines.get(spec)
+    if ocr is None:
+        ocr = OCREngine(spec.lang, spec.text_brightness_diff, spec.use_glyph_cache, spec.profile, cancel)
+        ocr.scale = spec.scale
+        ocr.brightness_window = spec.brightness_window
+        engines[spec] = ocr
+
+    images = read_bitmaps(ref)
+    counters = {key: ocr.stats[key] for key in ('images', 'tier_two', 'timeouts')}
+    if first is None:
+        result = ocr.recognize_first_tier(images[0])
+    else:
+        result = ocr.recognize_second_tier(first, images)
+
+    learned = GlyphMatcher.get(spec.lang).take_learned() if spec.use_glyph_cache else None
+    return result, {key: ocr.stats[key] - value for key, value in counters.items()}, learned
+
+
+class OCRDispatcher:
+    '''
+    Runs the OCR of the images of all tracks, either in the thread of the track or in a pool of OCR processes.
+    In process mode the track thread decodes and binarizes the images and only a BitmapRef is sent to the pool.
+    The images of the second tier are only binarized for images whose first tier was not confident enough.
+    '''
+
+    def __init__(self, workers: int, use_processes: bool = False):
+        self.use_processes = use_processes
+        self.executor = None
+        self.tier_two_executor = None
+        self.ring = None
+        self.stop = None
+
+        if use_processes:
+            # spawn instead of fork, forking a process with running threads can deadlock
+            context = get_context('spawn')
+            self.stop = context.Event()
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initialize_process,
+                                                initargs=(self.stop, *Config().get_worker_args()))
+            self.ring = BitmapRing(2 * workers) # one image being read and one waiting per process
+            # the results of the pool are handled by a single thread, so it must not binarize or wait for a slot
+            self.tier_two_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="OCR tier two")
+
+    def submit(self, ocr: OCREngine, img: np.ndarray) -> Future:
+        '''
+        Recognize a RGBA image with values between 0 and 1, the future returns an OCRResult.
+        '''
+        future = Future()
+
+        if not self.use_processes or not np.any(img[:, :, 3] > 0):
+            try:
+                future.set_result(ocr.recognize(img))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        spec = EngineSpec.from_engine(ocr)
+        ref = self.ring.write([to_mask(ocr.process_image(img))])
+
+        def first_tier_done(process_future: Future):
+            self.ring.release(ref)
+            result = self.__get_result(ocr, process_future, future)
+            if result is None:
+                return
+
+            if ocr.needs_tier_two(result):
+                self.tier_two_executor.submit(self.__submit_tier_two, ocr, spec, img, result, future)
+            else:
+                future.set_result(result)
+
+        self.executor.submit(recognize_bitmaps, spec, ref).add_done_callback(first_tier_done)
+        return future
+
+    def __submit_tier_two(self, ocr: OCREngine, spec: EngineSpec, img: np.ndarray, first: OCRResult, future: Future):
+        try:
+            masks = [to_mask(ocr.process_image(img, window)) for window in ocr.get_tier_two_windows()]
+            # sent with the descriptor, waiting for a slot here could block the images of the first tier
+            ref = BitmapRef(None, None, 0, masks[0].shape, len(masks), pack_masks(masks).tobytes())
+
+            def tier_two_done(process_future: Future):
+                result = self.__get_result(ocr, process_future, future)
+                if result is not None:
+                    future.set_result(result)
+
+            self.executor.submit(recognize_bitmaps, spec, ref, first).add_done_callback(tier_two_done)
+        except Exception as e: # e.g. the pool was shut down after a cancellation
+            future.set_exception(e)
+
+    def __get_result(self, ocr: OCREngine, process_future: Future, future: Future) -> OCRResult | None:
+        '''
+        Result of an OCR process with its counters added to the stats of the track and its learned glyphs
+        merged into the matcher of the language, None if it failed.
+        '''
+        try:
+            result, counters, learned = process_future.result()
+        except Exception as e:
+            future.set_exception(e)
+            return None
+
+        for key, value in counters.items():
+            ocr.stats[key] += value
+        if learned is not None:
+            GlyphMatcher.get(ocr.lang).merge(learned)
+        return result
+
+    def cancel_pending(self):
+        '''
+        Drop the images that are waiting for an OCR process, their futures are cancelled, and kill the Tesseract
+        processes of the images that are being read.
+        '''
+        if self.executor is not None:
+            self.stop.set()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.tier_two_executor.shutdown()
+            self.ring.close()
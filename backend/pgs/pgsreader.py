@@ -12,8 +12,6 @@ PCS = int('0x16', base=16) # Presentation Composition Segment, 0x16
 WDS = int('0x17', base=16) # Window Definition Segment, 0x17
 END = int('0x80', base=16) # End of Display Set Segment, 0x80
 
-exit_code = 0
-
 # Named tuple access for static PDS palettes 
 Palette = namedtuple('Palette', "Y Cr Cb Alpha")
 
@@ -25,6 +23,7 @@ class PGSReader:
 
     def __init__(self, filepath):
         self.filedir, self.file = pathsplit(filepath) 
+        self.exit_code = 0 # per reader, so tracks can be read in parallel
         with open(filepath, 'rb') as f:
             self.bytes = f.read()
             
@@ -128,8 +127,6 @@ class ObjectDefinitionSegment(BaseSegment):
     }
     
     def __init__(self, bytes_):
-        global exit_code
-        
         BaseSegment.__init__(self, bytes_)
         self.id = int(self.data[0:2].hex(), base=16)
         self.version = self.data[2]
@@ -0,0 +1,292 @@
+'''
+Pre-flight plan of a batch: probes all files at the same time and estimates the time of every file and of the
+batch from the number of display sets of their image based tracks.
+
+The plan before a conversion is a heuristic that only reads the headers of the files, so it doesn't add a read
+of every file on a slow share: the display sets come from the statistics tags of a track or, without them, from
+the duration of the file, and every image takes DEFAULT_SECONDS_PER_IMAGE. Only a thorough plan (a dry run)
+counts the packets of tracks without statistics tags, without decoding them, and times the OCR of a few sample
+images per language, both read the files again.
+
+The tracks of a file run in parallel on the OCR workers, so the OCR time of a file is the longest-first schedule
+of its tracks. The files themselves are converted one after another: ordering them longest-first doesn't shorten
+the batch, it only shows problems with the long files early.
+'''
+import heapq
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+import backend.concurrency as concurrency
+import backend.helper as subhelper
+from backend.cancellation import ConversionCancelled
+from backend.capabilities import Capabilities
+from backend.processes import ProcessRunner, ProcessTimeoutError
+from config import Config
+from controller.ocr_profiles import OCRProfiles
+
+if TYPE_CHECKING:
+    from backend.main import ConversionOptions
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CODECS = ('hdmv_pgs_subtitle', 'dvd_subtitle')
+# PGS clears a subtitle with a display set without image, every VobSub packet is an image
+IMAGE_SHARE = {'hdmv_pgs_subtitle': 0.5, 'dvd_subtitle': 1.0}
+# extraction and muxing each copy the streams of the whole file
+COPY_SPEED = 150 * 1024**2 # bytes per second
+# without a sample, e.g. for VobSub tracks in a language without PGS tracks
+DEFAULT_SECONDS_PER_IMAGE = 0.2
+# without statistics tags and counting, about one subtitle every four seconds
+ESTIMATED_IMAGES_PER_SECOND = 0.25
+SAMPLE_DURATION = 600 # seconds from the start of a track that are extracted for the sample
+SAMPLE_SIZE = 5 # images
+
+
+@dataclass
+class TrackPlan:
+    track_id: int # index of the subtitle stream
+    codec: str
+    lang: str # Tesseract language of the OCR
+    display_sets: int # 0 for text tracks
+    counted: bool # counted from the packets, otherwise read from the statistics tags of the file
+    estimated: bool = False # estimated from the duration of the file because it has no statistics tags
+    ocr_seconds: float = 0
+
+
+@dataclass
+class FilePlan:
+    path: str
+    size: int = 0
+    tracks: list[TrackPlan] = field(default_factory=list)
+    io_seconds: float = 0
+    ocr_seconds: float = 0 # longest-first over the OCR workers
+    total_seconds: float = 0
+    error: str | None = None
+
+
+@dataclass
+class BatchPlan:
+    files: list[FilePlan] # longest first, files that can't be converted last
+    workers: int
+    seconds_per_image: dict[str, float]
+    total_seconds: float
+    planning_seconds: float
+
+    @property
+    def order(self) -> list[str]:
+        return [file.path for file in self.files]
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), indent=2)
+
+
+def schedule_longest_first(durations: list[float], workers: int) -> float:
+    '''
+    Makespan of the jobs if every job goes to the least loaded worker, the longest job first (LPT).
+    '''
+    loads = [0.0] * max(1, min(workers, len(durations)))
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + duration)
+
+    return max(loads)
+
+
+class BatchPlanner:
+
+    def __init__(self, options: 'ConversionOptions', thorough: bool = False):
+        self.diff_langs = options.diff_langs
+        self.text_brightness_diff = options.text_brightness_diff
+        self.ocr_profile = OCRProfiles.get_profile(options.ocr_profile)
+        self.cancel = options.cancel
+        self.config = Config()
+        self.runner = ProcessRunner()
+        self.workers = concurrency.ocr_workers()
+        self.thorough = thorough
+
+    def plan(self, paths: list[str]) -> BatchPlan:
+        start = time.perf_counter()
+        files = [FilePlan(str(path)) for path in paths]
+
+        probes = self.runner.run_all([self.__probe(file) for file in files], cancel=self.cancel)
+
+        uncounted = []
+        for file, probe in zip(files, probes):
+            if probe is not None and self.__add_tracks(file, probe):
+                uncounted.append((file, probe))
+
+        if self.thorough:
+            if uncounted:
+                self.runner.run_all([self.__count_packets(file, probe) for file, probe in uncounted], cancel=self.cancel)
+            seconds_per_image = self.__time_samples(files)
+        else:
+            for file, probe in uncounted:
+                self.__estimate_display_sets(file, probe)
+            seconds_per_image = {}
+
+        for file in files:
+            for track in file.tracks:
+                images = track.display_sets * IMAGE_SHARE.get(track.codec, 0)
+                track.ocr_seconds = images * seconds_per_image.get(track.lang, DEFAULT_SECONDS_PER_IMAGE)
+
+            file.io_seconds = 2 * file.size / COPY_SPEED
+            file.ocr_seconds = schedule_longest_first([track.ocr_seconds for track in file.tracks], self.workers) if file.tracks else 0
+            file.total_seconds = file.io_seconds + file.ocr_seconds
+
+        # files are converted one after another, so this doesn't shorten the batch, it shows problems with the long files early
+        files.sort(key=lambda file: (file.error is not None, -file.total_seconds))
+        plan = BatchPlan(files, self.workers, seconds_per_image, sum(file.total_seconds for file in files), time.perf_counter() - start)
+        logger.info(f'Planned {len(files)} files in {plan.planning_seconds:.1f}s, estimated time {plan.total_seconds:.0f}s.')
+        return plan
+
+    async def __probe(self, file: FilePlan) -> dict | None:
+        try:
+            file.size = os.path.getsize(file.path)
+            result = await self.runner.run_async(['ffprobe', '-of', 'json', '-show_entries', 'format:stream', file.path], path=file.path, timeout=60)
+        except (OSError, ProcessTimeoutError) as e:
+            file.error = str(e)
+            return None
+
+        if result.returncode != 0:
+            file.error = (result.stderr.strip().splitlines() or [f'ffprobe exited with code {result.returncode}'])[-1]
+            return None
+
+        try:
+            return json.loads(result.stdout)
+        except ValueError as e:
+            file.error = f'Invalid output of ffprobe: {e}'
+            return None
+
+    def __add_tracks(self, file: FilePlan, probe: dict) -> bool:
+        '''
+        Add the subtitle tracks of the file, returns whether the display sets of a track have to be counted.
+        '''
+        installed_langs = Capabilities().get_languages()
+        subtitle_streams = [stream for stream in probe['streams'] if stream.get('codec_type') == 'subtitle']
+        uncounted = False
+
+        for track_id, stream in enumerate(subtitle_streams):
+            tags = stream.get('tags', {})
+            lang = subhelper.convert_language(tags.get('language', 'und'))
+            lang = self.diff_langs.get(lang, lang)
+            codec = stream.get('codec_name', '')
+
+            # mkvmerge writes statistics tags like NUMBER_OF_FRAMES-eng
+            frames = next((value for key, value in tags.items() if key.upper().startswith('NUMBER_OF_FRAMES')), None)
+            counted = codec in IMAGE_CODECS and frames is None
+            uncounted |= counted
+
+            file.tracks.append(TrackPlan(track_id, codec, lang if lang in installed_langs else 'eng', int(frames or 0), counted))
+
+        return uncounted
+
+    def __estimate_display_sets(self, file: FilePlan, probe: dict):
+        try:
+            duration = float(probe.get('format', {}).get('duration', 0))
+        except ValueError:
+            duration = 0
+
+        for track in file.tracks:
+            if track.counted:
+                track.display_sets = round(duration * ESTIMATED_IMAGES_PER_SECOND / IMAGE_SHARE[track.codec])
+                track.counted = False
+                track.estimated = True
+
+    async def __count_packets(self, file: FilePlan, probe: dict):
+        '''
+        Count the packets of the subtitle streams, ffprobe only demuxes the file and decodes nothing.
+        Without a count the display sets are estimated like in a plan that isn't thorough.
+        '''
+        command = ['ffprobe', '-v', 'error', '-select_streams', 's', '-count_packets', '-show_entries', 'stream=nb_read_packets', '-of', 'json', file.path]
+        try:
+            result = await self.runner.run_async(command, path=file.path, timeout=self.runner.timeout_for(file.path))
+        except ProcessTimeoutError:
+            result = None
+
+        counts = None
+        if result is not None and result.returncode == 0:
+            try:
+                counts = [int(stream.get('nb_read_packets', 0)) for stream in json.loads(result.stdout).get('streams', [])]
+            except (ValueError, AttributeError): # invalid output of ffprobe
+                pass
+
+        if counts is None:
+            logger.warning(f'Could not count the display sets of {file.path}, estimating them from its duration.')
+            self.__estimate_display_sets(file, probe)
+            return
+
+        for track, count in zip(file.tracks, counts):
+            if track.counted:
+                track.display_sets = count
+
+    def __time_samples(self, files: list[FilePlan]) -> dict[str, float]:
+        '''
+        Seconds per image for every language, from the OCR of a few images at the start of its first PGS track.
+        '''
+        seconds_per_image = {}
+        sampled_langs = set()
+
+        with tempfile.TemporaryDirectory(prefix='plan-') as sample_dir:
+            for file in files:
+                for track in file.tracks:
+                    if track.codec != 'hdmv_pgs_subtitle' or track.lang in sampled_langs or not track.display_sets:
+                        continue
+                    sampled_langs.add(track.lang)
+
+                    if self.cancel is not None:
+                        self.cancel.raise_if_cancelled()
+
+                    try:
+                        seconds = self.__time_sample(file.path, track, Path(sample_dir) / f'{track.lang}.sup')
+                    except ConversionCancelled:
+                        raise
+                    except Exception as e:
+                        logger.warning(f'Could not time the OCR of subtitle #{track.track_id} of {file.path}: {e}')
+                        continue
+
+                    if seconds is not None:
+                        seconds_per_image[track.lang] = seconds
+
+        return seconds_per_image
+
+    def __time_sample(self, path: str, track: TrackPlan, sample_path: Path) -> float | None:
+        # the OCR is only imported when there is something to sample
+        import backend.pgs.pgsreader as pgsreader
+        from backend.pgs.imagemaker import ImageMaker
+        from backend.ocrengine import OCREngine
+
+        # only the start of the file is read
+        command = ['ffmpeg', '-y', '-t', str(SAMPLE_DURATION), '-i', path, '-map', f'0:s:{track.track_id}', '-c', 'copy', str(sample_path)]
+        result = self.runner.run(command, cancel=self.cancel, path=path, timeout=self.runner.timeout_for(path))
+        if result.returncode != 0 or not sample_path.exists():
+            return None
+
+        image_maker = ImageMaker(self.text_brightness_diff)
+        samples = []
+        for ds in pgsreader.PGSReader(sample_path).iter_displaysets():
+            if ds.has_image:
+                samples.append(image_maker.make_image(ds.ods[0], ds.pds[0]) / 255)
+            if len(samples) == SAMPLE_SIZE:
+                break
+        if not samples:
+            return None
+
+        # without the glyph cache, the sample measures Tesseract like on a track with unknown glyphs
+        ocr = OCREngine(None if track.lang == 'eng' else track.lang, self.text_brightness_diff, False, self.ocr_profile, self.cancel)
+        ocr.calibrate_scale(samples)
+        start = time.perf_counter()
+        for img in samples:
+            ocr.recognize(img)
+
+        return (time.perf_counter() - start) / len(samples)
+
+
+def plan_files(paths: list[str], options: 'ConversionOptions', thorough: bool = False) -> BatchPlan:
+    '''
+    Plan the conversion of the files with the options without converting them, `thorough` for a dry run.
+    '''
+    return BatchPlanner(options, thorough).plan(paths)
@@ -0,0 +1,384 @@
+import asyncio
+from collections.abc import Callable, Coroutine
+from concurrent.futures import CancelledError
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+from threading import Lock, Thread
+from backend.cancellation import CancellationToken, ConversionCancelled
+from backend.concurrency import available_cpus
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProcessResult:
+    command: list[str]
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+class ProcessTimeoutError(Exception):
+    '''Raised when an external tool runs longer than its timeout or stops making progress.'''
+
+
+def get_device(path: str | os.PathLike | None) -> int | None:
+    '''
+    Device of a path (st_dev), a file that doesn't exist yet is on the device of its nearest existing parent.
+    '''
+    if path is None:
+        return None
+
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def parse_ffmpeg_progress(line: str) -> float | None:
+    '''
+    Returns the progress in seconds from the output of "ffmpeg -progress pipe:1".
+    '''
+    match = re.match(r'out_time_us=(\d+)', line)
+    return int(match.group(1)) / 1_000_000 if match else None
+
+
+def parse_mkvextract_progress(line: str) -> float | None:
+    '''
+    Returns the progress in percent from a line like "Progress: 42%".
+    '''
+    match = re.match(r'\w+: (\d+)%', line.strip())
+    return float(match.group(1)) if match else None
+
+
+def kill_process_tree(pid: int):
+    '''
+    Kill a process that runs in its own process group (its own session on POSIX) with the processes it started.
+    '''
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class ProcessGroups:
+    '''
+    Process groups of the running commands of a converter in shared memory. The commands run in their own
+    sessions, so killing the converter doesn't kill them and its parent kills them with kill_all instead.
+    '''
+
+    SIZE = 256
+
+    def __init__(self):
+        self.groups = multiprocessing.Array('q', self.SIZE)
+
+    def add(self, group: int):
+        with self.groups.get_lock():
+            for i in range(self.SIZE):
+                if self.groups[i] == 0:
+                    self.groups[i] = group
+                    return
+
+    def remove(self, group: int):
+        with self.groups.get_lock():
+            for i in range(self.SIZE):
+                if self.groups[i] == group:
+                    self.groups[i] = 0
+                    return
+
+    def kill_all(self):
+        with self.groups.get_lock():
+            groups = [group for group in self.groups if group != 0]
+
+        for group in groups:
+            kill_process_tree(group)
+
+
+class ProcessRunner:
+    '''
+    Runs the external tools (ffmpeg, ffprobe, mkvextract) of a batch as asyncio subprocesses in one event loop
+    thread instead of one blocking thread per process. The number of processes is limited globally and per
+    device of the files they read and write, because several processes copying from or to the same disk slow
+    each other down with seeking. Commands whose files are on different devices run in parallel, the limit of a
+    device is iProcessesPerDevice or its entry in sDeviceLimits (e.g. 1 for a NAS share or a spinning disk).
+
+    A watchdog kills the process group of a command that writes no output (its heartbeat) for the stall timeout
+    or runs longer than its timeout, so a corrupt file cannot hang the batch.
+
+    Commands run with a CancellationToken are cancelled with it, run and run_all raise ConversionCancelled once
+    the process groups of the commands were killed. The groups of the running commands are recorded in
+    `process_groups` if it is set, so the converter process can be killed with its commands.
+    '''
+
+    WATCHDOG_INTERVAL = 1
+
+    runner = None
+    runner_lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not cls.runner:
+            with cls.runner_lock:
+                if not cls.runner:
+                    runner = super(ProcessRunner, cls).__new__(cls, *args, **kwargs)
+                    runner._initialize_runner()
+                    cls.runner = runner
+        return cls.runner
+
+    def _initialize_runner(self):
+        self.config = Config()
+        max_processes = self.config.get_value(Config.Settings.MAX_PROCESSES)
+        self.processes_per_device = self.config.get_value(Config.Settings.PROCESSES_PER_DEVICE)
+        self.stall_timeout = self.config.get_value(Config.Settings.STALL_TIMEOUT)
+        self.timeout_per_gb = self.config.get_value(Config.Settings.TIMEOUT_PER_GB)
+        self.stats = {'kills': 0, 'retries': 0}
+
+        self.loop = asyncio.new_event_loop()
+        # the tools mostly copy streams and wait for the disk, so by default two processes per CPU
+        self.semaphore = asyncio.Semaphore(max_processes if max_processes > 0 else 2 * available_cpus())
+        self.device_semaphores = {}
+        self.devices = {} # path -> device, only used in the event loop
+        self.device_limits = self.__read_device_limits()
+        self.tasks = {} # running task -> token it is cancelled with
+        self.process_groups: ProcessGroups | None = None
+
+        Thread(name="Process runner", target=self.loop.run_forever, daemon=True).start()
+
+    def run(self, command: list[str], cancel: CancellationToken | None = None, **kwargs) -> ProcessResult:
+        '''
+        Run a command and wait for it, see run_async for the arguments.
+        '''
+        return self.__call(self.run_async(command, **kwargs), cancel)
+
+    def run_all(self, coroutines: list[Coroutine], cancel: CancellationToken | None = None) -> list:
+        '''
+        Run coroutines of run_async at the same time and wait for all of them.
+        '''
+        async def gather():
+            # let the other commands finish instead of leaving them running
+            results = await asyncio.gather(*coroutines, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return results
+
+        return self.__call(gather(), cancel)
+
+    def timeout_for(self, path: str, base: float = 120) -> float | None:
+        '''
+        Timeout for a command that reads the whole file, proportional to its size. None if there is no limit.
+        '''
+        if self.timeout_per_gb <= 0:
+            return None
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        return base + size / 1024**3 * self.timeout_per_gb
+
+    def cancel_all(self):
+        '''
+        Cancel all running commands, their processes are killed.
+        '''
+        for task in list(self.tasks):
+            self.loop.call_soon_threadsafe(task.cancel)
+
+    def __cancel_tasks(self, cancel: CancellationToken):
+        # runs in the event loop, tasks that start later see the cancelled token in __track
+        for task, token in list(self.tasks.items()):
+            if token is cancel:
+                task.cancel()
+
+    async def run_async(self, command: list[str], path: str | None = None, timeout: float | None = None,
+                        parse_progress: Callable[[str], float | None] | None = None,
+                        on_progress: Callable[[float], None] | None = None, retries: int = 0,
+                        output: str | None = None) -> ProcessResult:
+        '''
+        Run a command once the global limit and the limits of the devices of `path` (the file the command reads)
+        and `output` (a large file it writes) allow it.
+        Every line of stdout and stderr is passed to `parse_progress`, results that are not None to `on_progress`.
+        Raises ProcessTimeoutError after `timeout` seconds or if the command stalls, after `retries` more attempts.
+        The process group is killed if the command times out or is cancelled.
+        '''
+        devices = await self.__get_devices([path, output])
+
+        async with AsyncExitStack() as slots:
+            # always in the order of the devices, so two commands never wait for each other's device
+            # the global slot last, a command that waits for a busy device must not block the other devices
+            for semaphore in self.__get_device_semaphores(devices):
+                await slots.enter_async_context(semaphore)
+            await slots.enter_async_context(self.semaphore)
+
+            for attempt in range(retries + 1):
+                try:
+                    return await self.__run_once(command, timeout, parse_progress, on_progress)
+                except ProcessTimeoutError as e:
+                    if attempt == retries:
+                        raise
+                    self.stats['retries'] += 1
+                    logger.warning(f'{e} Retrying ({attempt + 1}/{retries}).')
+
+    async def __run_once(self, command: list[str], timeout: float | None, parse_progress, on_progress) -> ProcessResult:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Running {" ".join(str(part) for part in command)}.')
+
+        # a process group, so tools started by the command are killed as well
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+
+        process = await asyncio.create_subprocess_exec(*[str(part) for part in command], stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **group)
+        if self.process_groups is not None:
+            self.process_groups.add(process.pid)
+
+        try:
+            start = heartbeat = self.loop.time()
+
+            def on_output():
+                nonlocal heartbeat
+                heartbeat = self.loop.time()
+
+            output = asyncio.gather(
+                self.__read(process.stdout, parse_progress, on_progress, on_output),
+                self.__read(process.stderr, parse_progress, on_progress, on_output),
+                process.wait()
+            )
+
+            try:
+                while not output.done():
+                    await asyncio.wait({output}, timeout=self.WATCHDOG_INTERVAL)
+                    now = self.loop.time()
+
+                    if output.done():
+                        break
+                    elif timeout is not None and now - start > timeout:
+                        reason = f'did not finish within {timeout:.0f}s'
+                    elif self.stall_timeout > 0 and now - heartbeat > self.stall_timeout:
+                        reason = f'made no progress for {self.stall_timeout}s'
+                    else:
+                        continue
+
+                    self.stats['kills'] += 1
+                    logger.error(f'Killed {command[0]} (pid {process.pid}), it {reason}.')
+                    await self.__kill(process, output)
+                    raise ProcessTimeoutError(f'{command[0]} {reason}.')
+            except asyncio.CancelledError:
+                await self.__kill(process, output)
+                raise
+
+            stdout, stderr, returncode = output.result()
+            return ProcessResult(command, returncode, stdout, stderr)
+        finally:
+            if self.process_groups is not None:
+                self.process_groups.remove(process.pid)
+
+    def __call(self, coroutine: Coroutine, cancel: CancellationToken | None = None):
+        task_future = asyncio.run_coroutine_threadsafe(self.__track(coroutine, cancel), self.loop)
+        if cancel is None:
+            return task_future.result()
+
+        # the task itself is cancelled instead of the future, so the result is only raised after the kill
+        with cancel.on_cancel(lambda: self.loop.call_soon_threadsafe(self.__cancel_tasks, cancel)):
+            try:
+                return task_future.result()
+            except CancelledError:
+                cancel.raise_if_cancelled()
+                raise
+
+    async def __track(self, coroutine: Coroutine, cancel: CancellationToken | None = None):
+        if cancel is not None and cancel.cancelled:
+            coroutine.close()
+            raise ConversionCancelled()
+
+        task = asyncio.current_task()
+        self.tasks[task] = cancel
+        try:
+            return await coroutine
+        finally:
+            self.tasks.pop(task, None)
+
+    def __read_device_limits(self) -> dict[int, int]:
+        '''
+        Limits of sDeviceLimits ("path=limit, ..."), by the device of the path.
+        '''
+        limits = {}
+        for entry in (self.config.get_value(Config.Settings.DEVICE_LIMITS) or '').split(','):
+            path, _, limit = entry.strip().rpartition('=')
+            if not path:
+                continue
+
+            device = get_device(path) if os.path.exists(path) else None
+            if device is None or not limit.strip().isdigit():
+                logger.warning(f'Ignoring the device limit "{entry.strip()}", the path doesn\'t exist or the limit is no number.')
+                continue
+            limits[device] = max(1, int(limit))
+
+        return limits
+
+    async def __get_devices(self, paths: list[str | None]) -> list[int]:
+        '''
+        Devices of the paths, os.stat runs in a thread, because it can hang on an unreachable share and would
+        block all commands in the event loop.
+        '''
+        for path in paths:
+            if path is not None and path not in self.devices:
+                self.devices[path] = await asyncio.to_thread(get_device, path)
+
+        return sorted({self.devices[path] for path in paths if path is not None and self.devices[path] is not None})
+
+    def __get_device_semaphores(self, devices: list[int]) -> list[asyncio.Semaphore]:
+        for device in devices:
+            if device not in self.device_semaphores:
+                self.device_semaphores[device] = asyncio.Semaphore(self.device_limits.get(device, self.processes_per_device))
+        return [self.device_semaphores[device] for device in devices]
+
+    async def __read(self, stream: asyncio.StreamReader, parse_progress, on_progress, on_output) -> str:
+        output = []
+        buffer = ''
+
+        while chunk := await stream.read(4096):
+            on_output()
+            buffer += chunk.decode(errors='replace')
+            # progress lines of mkvextract end with \r
+            *lines, buffer = re.split(r'\r\n|\r|\n', buffer)
+            for line in lines:
+                output.append(line)
+                if parse_progress and on_progress:
+                    progress = parse_progress(line)
+                    if progress is not None:
+                        on_progress(progress)
+
+        if buffer:
+            output.append(buffer)
+        return '\n'.join(output)
+
+    async def __kill(self, process: asyncio.subprocess.Process, output: asyncio.Future):
+        if process.returncode is None:
+            try:
+                if os.name == 'nt':
+                    killer = await asyncio.create_subprocess_exec('taskkill', '/F', '/T', '/PID', str(process.pid), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+                    await killer.wait()
+                else:
+                    os.killpg(process.pid, signal.SIGKILL)
+            except (OSError, ProcessLookupError):
+                process.kill()
+
+        output.cancel()
+        await process.wait()
@@ -0,0 +1,157 @@
+'''
+Local staging of input files on network shares. Extracting every track and muxing read the whole file each,
+so a file with N image based tracks is read N + 1 times. A staged file is copied to a local directory once,
+all passes read the local copy and the new file is written back with one sequential copy.
+'''
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from backend.cancellation import CancellationToken
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# file systems of network shares in /proc/mounts (Linux) and in the output of mount (macOS)
+REMOTE_FILE_SYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afpfs', 'webdav', 'davfs', 'fuse.sshfs', 'fuse.rclone',
+                       'glusterfs', 'fuse.glusterfs', 'ceph', 'fuse.ceph', 'afs', '9p', 'lustre'}
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# free space that stays free on the staging disk
+FREE_SPACE_MARGIN = 1024**3
+
+
+def get_mounts() -> list[tuple[str, str]]:
+    '''
+    Mount points with their file system type, the longest mount points first.
+    '''
+    mounts = []
+    try:
+        if sys.platform.startswith('darwin'):
+            # "//user@server/share on /Volumes/share (smbfs, nodev, nosuid, mounted by user)"
+            output = subprocess.run(['mount'], capture_output=True, text=True, timeout=10).stdout
+            for line in output.splitlines():
+                _, _, rest = line.partition(' on ')
+                mount_point, _, options = rest.rpartition(' (')
+                mounts.append((mount_point, options.split(',')[0]))
+        else:
+            with open('/proc/mounts', 'r', encoding='utf8') as file:
+                for line in file:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # spaces in mount points are escaped as \040
+                        mounts.append((fields[1].replace('\\040', ' '), fields[2]))
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+    return sorted(mounts, key=lambda mount: len(mount[0]), reverse=True)
+
+
+def is_remote(path: str | Path) -> bool:
+    '''
+    Whether the file is on a network share: a UNC path or a network drive on Windows, a mount with the file
+    system of a network share elsewhere.
+    '''
+    path = os.path.realpath(path)
+
+    if sys.platform.startswith('win'):
+        if path.startswith('\\\\'):
+            return True
+        import ctypes
+        DRIVE_REMOTE = 4
+        return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + '\\') == DRIVE_REMOTE
+
+    for mount_point, file_system in get_mounts():
+        if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+            return file_system.lower() in REMOTE_FILE_SYSTEMS
+    return False
+
+
+@dataclass
+class StagedFile:
+    original: Path
+    path: Path # the local copy
+    size: int
+
+    @property
+    def directory(self) -> Path:
+        return self.path.parent
+
+
+class Staging:
+    '''
+    Copies input files to the staging directory (sStagingDir, by default "staging" in the data directory) if
+    sStaging is "always" or "auto" and the file is on a network share. A file is only staged if it and the new
+    file fit into the quota (iStagingQuota in GB) and the free space of the staging disk.
+    '''
+
+    def __init__(self, cancel: CancellationToken | None = None):
+        self.config = Config()
+        self.cancel = cancel or CancellationToken()
+        self.mode = self.config.get_value(Config.Settings.STAGING)
+        self.directory = Path(self.config.get_value(Config.Settings.STAGING_DIR) or self.config.get_datadir() / 'staging')
+        self.quota = self.config.get_value(Config.Settings.STAGING_QUOTA) * 1024**3
+
+    def should_stage(self, path: str) -> bool:
+        match self.mode:
+            case 'always':
+                return True
+            case 'auto':
+                return is_remote(path)
+            case _:
+                return False
+
+    def stage(self, path: str, name: str) -> StagedFile | None:
+        '''
+        Copy the file to its own directory `name` in the staging directory, None if it isn't staged.
+        '''
+        if not self.should_stage(path):
+            return None
+
+        size = os.path.getsize(path)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # the staged file and the new file, which is about as large
+        needed = 2 * size
+        # files staged by another conversion count towards the quota
+        used = sum(file.stat().st_size for file in self.directory.rglob('*') if file.is_file())
+        free = shutil.disk_usage(self.directory).free - FREE_SPACE_MARGIN
+
+        if used + needed > self.quota or needed > free:
+            logger.info(f'Not staging {path}: {needed / 1024**3:.1f} GB needed, {used / 1024**3:.1f} of {self.quota / 1024**3:.0f} GB used, {max(free, 0) / 1024**3:.1f} GB free.')
+            return None
+
+        staged = StagedFile(Path(path), self.directory / name / os.path.basename(path), size)
+        staged.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            self.copy(staged.original, staged.path)
+            # same modification time, so the fingerprint and the cached files of the original match
+            shutil.copystat(staged.original, staged.path)
+        except BaseException:
+            self.remove(staged)
+            raise
+
+        logger.info(f'Staged {path} ({size / 1024**2:.0f} MB) in {staged.directory}.')
+        return staged
+
+    def write_back(self, source: Path, destination: Path):
+        '''
+        Copy a new file back next to the original in one sequential write, a partial file never has the final name.
+        '''
+        part_path = destination.with_name(destination.name + '.part')
+        try:
+            self.copy(source, part_path)
+            os.replace(part_path, destination)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+
+    def remove(self, staged: StagedFile):
+        shutil.rmtree(staged.directory, ignore_errors=True)
+
+    def copy(self, source: Path, destination: Path):
+        with open(source, 'rb') as input_file, open(destination, 'wb') as output_file:
+            while chunk := input_file.read(COPY_BUFFER_SIZE):
+                self.cancel.raise_if_cancelled()
+                output_file.write(chunk)
@@ -1,7 +1,9 @@
-from threading import Thread
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 import backend.helper as subhelper
+import backend.concurrency as concurrency
+import logging
 import os
-import pytesseract
 import backend.pgs.pgsreader as pgsreader
 from backend.pgs.imagemaker import ImageMaker
 from tqdm import tqdm
@@ -9,18 +11,32 @@ from pysrt import SubRipFile, SubRipItem, SubRipTime
 import backend.srtchecker as srtchecker
 import pysubs2
 from controller.sub_formats import SubtitleFileEndings
+from controller.ocr_profiles import OCRProfiles
 from config import Config
 from backend.vob.vob_sub_parser import VobSubParser
 from backend.vob.vob_sub_merge_pack import VobSubMergedPack
+from backend.glyphmatcher import GlyphMatcher
+from backend.ocrengine import OCREngine
+from backend.langdetector import LanguageDetector
+from backend.ocrpool import OCRDispatcher
+from backend.journal import OCRJournal
+from backend.artifactcache import ArtifactCache
+from backend.imagearchive import ImageArchive
+from backend.cancellation import CancellationToken, ConversionCancelled
+from backend.events import ConversionEvent, TrackProgressReporter, TrackResult
+from collections.abc import Callable
+from backend.capabilities import Capabilities
 from pathlib import Path
 import numpy as np
 from PIL import Image
 from datetime import timedelta
-import cv2
+from dataclasses import asdict
+
+logger = logging.getLogger(__name__)
 
 
 class SubtitleConverter:
-    def __init__(self, subtitle_counter: int, sub_langs: list, diff_langs: dict, sub_dir: str, img_dir: str, sub_format: SubtitleFileEndings, keep_imgs: bool, text_brightness_diff: float):
+    def __init__(self, subtitle_counter: int, sub_langs: list, diff_langs: dict, sub_dir: str, img_dir: str, sub_format: SubtitleFileEndings, keep_imgs: bool, text_brightness_diff: float, ocr_profile: OCRProfiles = OCRProfiles.BALANCED, cache: ArtifactCache | None = None, on_event: Callable[[ConversionEvent], None] | None = None, cancel: CancellationToken | None = None):
         self.subtitle_counter = subtitle_counter
         self.subtitle_languages = sub_langs
         self.diff_langs = diff_langs
@@ -29,72 +45,158 @@ class SubtitleConverter:
         self.format = sub_format
         self.keep_imgs = keep_imgs
         self.text_brightness_diff = text_brightness_diff
+        self.ocr_profile = OCRProfiles.get_profile(ocr_profile)
+        self.cache = cache or ArtifactCache.in_memory(sub_dir) # without a cache nothing is reused
+        self.on_event = on_event
+        self.cancel = cancel or CancellationToken()
+        self.track_results = []
+        self.track_stats = {}
+        self.detected_languages = {}
+        self.sample_size = 10
 
-        self.continue_flag = None
         self.config = Config()
         self.translate = self.config.translate
+        self.use_glyph_cache = self.config.get_value(Config.Settings.GLYPH_CACHE)
+        self.tune_brightness = self.config.get_value(Config.Settings.BRIGHTNESS_TUNING)
 
     def convert_subtitles(self): # convert PGS subtitles to SRT subtitles
-        thread_pool = []
+        futures = []
+
+        self.cancel.raise_if_cancelled()
+
+        concurrency.set_opencv_threads()
+        workers = concurrency.ocr_workers()
+        self.dispatcher = OCRDispatcher(workers, concurrency.ocr_executor() == 'processes')
 
-        if self.continue_flag is False:
-            return
+        # Tesseract runs with a single thread, so there is one worker per CPU instead of one thread per track
+        with self.cancel.on_cancel(self.dispatcher.cancel_pending), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Convert subtitle") as executor:
+            # the longest tracks first, so a long track doesn't start last while the other workers are idle
+            for id in sorted(range(self.subtitle_counter), key=self.__get_track_size, reverse=True):
 
-        for id in range(self.subtitle_counter):
+                # get language to use in subtitle
+                lang_code = self.subtitle_languages[id]
+                language = self.__get_lang(lang_code)
+                candidates = self.__get_detection_candidates(id)
 
-            # get language to use in subtitle
-            lang_code = self.subtitle_languages[id]
-            language = self.__get_lang(lang_code)
+                if os.path.exists(os.path.join(self.sub_dir, f'{id}.sup')):
+                    futures.append(executor.submit(self.__convert_sup_to_srt, language, id, candidates))
+                elif os.path.exists(os.path.join(self.sub_dir, f'{id}.sub')):
+                    futures.append(executor.submit(self.__convert_sub_to_srt, language, id, candidates))
 
-            if os.path.exists(os.path.join(self.sub_dir, f'{id}.sup')):
-                thread = Thread(name=f"Convert subtitle #{id}", target=self.__convert_sup_to_srt, args=(language, id))
-                thread.start()
-                thread_pool.append(thread)
-            elif os.path.exists(os.path.join(self.sub_dir, f'{id}.sub')):
-                thread = Thread(name=f"Convert subtitle #{id}", target=self.__convert_sub_to_srt, args=(language, id))
-                thread.start()
-                thread_pool.append(thread)
+        try:
+            results = sorted((future.result() for future in futures), key=lambda result: result.track_id) # raise errors of the tracks
+        finally:
+            self.dispatcher.close()
 
-        for thread in thread_pool:
-            thread.join()
+        self.track_results = results
+        self.track_stats = {result.track_id: result.stats for result in results}
+        self.detected_languages = {result.track_id: result.detected_lang for result in results if result.detected_lang}
 
-        if pgsreader.exit_code != 0:
-            self.config.logger.error(f'Error while converting subtitle #{id}. See messages before for more information.')
-            raise Exception(self.translate("Error while converting subtitle #{id}. See logs for more info.").format(id=id))
-            # TODO Print error message by exit code, therefore check which warnings trigger exceptions
+        if self.use_glyph_cache:
+            for glyph_matcher in GlyphMatcher.matchers.values():
+                glyph_matcher.save()
+
+        for result in results:
+            if result.exit_code != 0:
+                logger.error(f'Error while converting subtitle #{result.track_id}. See messages before for more information.')
+                raise Exception(self.translate("Error while converting subtitle #{id}. See logs for more info.").format(id=result.track_id))
+                # TODO Print error message by exit code, therefore check which warnings trigger exceptions
 
         # no multithreading here because it's already fast enough
         if self.format != SubtitleFileEndings.SRT.value:
             for id in range(self.subtitle_counter):
+                format_key = self.cache.key('format', {'srt': self.cache.get_key(f'{id}.srt'), 'format': self.format})
+                if self.cache.is_valid(f'{id}.{self.format}', format_key):
+                    continue
+
+                self.cancel.raise_if_cancelled()
+                self.cache.invalidate(f'{id}.{self.format}')
+
                 new_sub = pysubs2.load(os.path.join(self.sub_dir, f'{id}.srt'))
                 open(os.path.join(self.sub_dir, f'{id}.{self.format}'), 'w').close()
                 new_sub.save(os.path.join(self.sub_dir, f'{id}.{self.format}'))
+                self.cache.store(f'{id}.{self.format}', format_key)
+
+    def __get_track_size(self, track_id: int) -> int:
+        '''
+        Size of the extracted track, the number of its images and so the time of its OCR grow with it.
+        '''
+        for file_ending in ('sup', 'sub'):
+            path = os.path.join(self.sub_dir, f'{track_id}.{file_ending}')
+            if os.path.exists(path):
+                return os.path.getsize(path)
+        return 0
 
     def __get_lang(self, lang_code: str) -> str | None:
 
         lang_code = subhelper.convert_language(lang_code)
         new_lang = self.diff_langs.get(lang_code) # check if user wants to use a different language
+        installed_langs = Capabilities().get_languages()
 
         if new_lang is  not None:
-            if new_lang in pytesseract.get_languages():
+            if new_lang in installed_langs:
                 return new_lang
             else:
-                self.config.logger.warning(f'Language "{new_lang}" is not installed, using "{lang_code}" instead.')
+                logger.warning(f'Language "{new_lang}" is not installed, using "{lang_code}" instead.')
 
-        if lang_code in pytesseract.get_languages(): # when user doesn't want to change language or changed language is not installed
+        if lang_code in installed_langs: # when user doesn't want to change language or changed language is not installed
             return lang_code
         else:
-            self.config.logger.warning(f'Language "{lang_code}" is not installed, using English instead.')
+            logger.warning(f'Language "{lang_code}" is not installed, using English instead.')
+            return None
+
+    def __get_detection_candidates(self, track_id: int) -> list[str] | None:
+        '''
+        Returns the installed languages to try for a track or None if its language doesn't need to be detected.
+        Untagged tracks and tracks whose language is not installed would otherwise be read with English.
+        '''
+        mode = self.config.get_value(Config.Settings.LANGUAGE_DETECTION)
+        lang_code = subhelper.convert_language(self.subtitle_languages[track_id])
+        installed_langs = Capabilities().get_languages()
+
+        if mode == 'off' or lang_code in self.diff_langs: # the user already chose the language
             return None
+        if mode != 'always' and lang_code in installed_langs:
+            return None
+
+        # languages of the other tracks are the most likely ones, the tagged language comes first to win ties
+        configured_langs = (self.config.get_value(Config.Settings.DETECTION_LANGUAGES) or '').split(',')
+        other_langs = [subhelper.convert_language(lang) for lang in self.subtitle_languages]
+        candidates = []
+        for lang in [lang_code, *other_langs, *configured_langs]:
+            lang = self.diff_langs.get(lang, lang.strip())
+            if lang in installed_langs and lang not in candidates:
+                candidates.append(lang)
+
+        return candidates if len(candidates) > 1 else None
 
-    def __convert_sup_to_srt(self, lang:str, track_id: int):
+    def __detect_lang(self, track_id: int, candidates: list[str], samples: list[np.ndarray]) -> str | None:
+        detector = LanguageDetector(candidates, self.text_brightness_diff, self.ocr_profile, self.cancel)
+        detected_lang, scores = detector.detect(self.sample(samples, detector.SAMPLE_SIZE))
+
+        scores = ', '.join(f'{candidate}: {score:.1f}' for candidate, score in scores.items())
+        if detected_lang is None:
+            logger.info(f'Could not detect the language of subtitle #{track_id}, no text found.')
+            return None
+
+        logger.info(f'Detected language "{detected_lang}" for subtitle #{track_id} ({scores}).')
+        return detected_lang
+
+    def __convert_sup_to_srt(self, lang:str, track_id: int, candidates: list[str] | None = None) -> TrackResult:
         srt_file = os.path.join(self.sub_dir, f'{track_id}.srt')
         pgs_file = os.path.join(self.sub_dir, f'{track_id}.sup')
+        result = TrackResult(track_id, lang)
 
         # extracted subtitle was already srt
         if (not os.path.exists(pgs_file)) and os.path.exists(srt_file):
-            return 
+            return result
 
+        settings = self.__get_ocr_settings(f'{track_id}.sup', lang, candidates)
+        ocr_key = self.cache.key('ocr', settings)
+        if self.cache.is_valid(f'{track_id}.srt', ocr_key):
+            return self.__get_cached_result(result)
+
+        self.cache.invalidate(f'{track_id}.srt') # unfinished until the OCR is done
         open(srt_file, "w").close() # create empty SRT file
 
         pgs = pgsreader.PGSReader(pgs_file)
@@ -107,47 +209,83 @@ class SubtitleConverter:
         # loading DisplaySets
         all_sets = [ds for ds in tqdm(pgs.iter_displaysets(), unit=" ds")]
 
-        if pgsreader.exit_code != 0:
-            return
+        if pgs.exit_code != 0:
+            result.exit_code = pgs.exit_code
+            return result
         
-        if self.continue_flag is False:
-            return
+        self.cancel.raise_if_cancelled()
 
         # building SRT file from DisplaySets
-        sub_text = ""
+        sub_ocr = None
         sub_start = 0
-        sub_index = 0
+        pending = deque()
         im = ImageMaker(self.text_brightness_diff)
-        progress_bar = tqdm(all_sets, unit=" ds")
-        for ds in progress_bar:
-            if ds.has_image:
-                try:
-                    pds = ds.pds[0] # get Palette Definition Segment
-                    ods = ds.ods[0] # get Object Definition Segment
-                    img = im.make_image(ods, pds)
-
-                    # TODO add exit code check for ImageMaker
-                    
-                    if self.keep_imgs:
-                        image = Image.fromarray(img, 'RGBA')
-                        image.save(os.path.join(track_img_dir, f"{sub_index}.webp"))
-                    
-                    img = self.process_image(img/255)
-
-                    sub_text = pytesseract.image_to_string(img, lang)
-                    sub_start = ods.presentation_timestamp
-                except Exception as e:
-                    self.config.logger.warning(f'Error processing image in subtitle #{track_id}: {e}. Skipping this image.')
-                    sub_text = ''
-                    sub_start = ds.start[0].presentation_timestamp if ds.start else 0
-            else:
-                start_time = SubRipTime(milliseconds=int(sub_start))
-                end_time = SubRipTime(milliseconds=int(ds.end[0].presentation_timestamp))
-                srt.append(SubRipItem(sub_index, start_time, end_time, sub_text))
-                sub_index += 1
+        journal = OCRJournal(os.path.join(self.sub_dir, f'{track_id}.journal'), pgs_file, settings)
+        resume = journal.load()
+        images = self.__open_images(track_id, f'{track_id}.sup', resume)
 
-        self.config.logger.debug(f'Finished converting subtitle #{track_id} in {int(progress_bar.format_dict["elapsed"])}s.')
+        try:
+            if resume:
+                ocr = self.__resume_ocr(result, journal)
+            else:
+                image_sets = [(index, ds) for index, ds in enumerate(all_sets) if ds.has_image]
+                samples = []
+                for index, ds in self.sample(image_sets):
+                    try:
+                        samples.append(images.get(index, lambda: im.make_image(ds.ods[0], ds.pds[0]), store=False)/255)
+                    except Exception as e: # the main loop skips the image as well
+                        logger.warning(f'Error processing sample image in subtitle #{track_id}: {e}. Skipping this image.')
+                ocr = self.__create_ocr(result, candidates, samples, journal)
+
+            srt.extend(journal.items)
+            sub_index = len(srt)
+
+            progress = TrackProgressReporter(self.on_event, track_id, len(all_sets))
+            progress_bar = tqdm(all_sets, unit=" ds")
+            for index, ds in enumerate(progress_bar):
+                if index <= journal.checkpoint: # recognized before the conversion was stopped
+                    continue
+                self.__check_cancelled(journal)
+                progress.update(index + 1, ocr.stats['images'])
+
+                if ds.has_image:
+                    try:
+                        pds = ds.pds[0] # get Palette Definition Segment
+                        ods = ds.ods[0] # get Object Definition Segment
+                        img = images.get(index, lambda: im.make_image(ods, pds))
+
+                        # TODO add exit code check for ImageMaker
+                        
+                        if self.keep_imgs:
+                            image = Image.fromarray(img, 'RGBA')
+                            image.save(os.path.join(track_img_dir, f"{sub_index}.webp"))
+                        
+                        sub_ocr = self.dispatcher.submit(ocr, img/255)
+                        sub_start = ods.presentation_timestamp
+                    except Exception as e:
+                        logger.warning(f'Error processing image in subtitle #{track_id}: {e}. Skipping this image.')
+                        sub_ocr = None
+                        sub_start = ds.start[0].presentation_timestamp if ds.start else 0
+                else:
+                    start_time = SubRipTime(milliseconds=int(sub_start))
+                    end_time = SubRipTime(milliseconds=int(ds.end[0].presentation_timestamp))
+                    item = SubRipItem(sub_index, start_time, end_time, '')
+                    srt.append(item)
+                    pending.append((index, item, sub_ocr))
+                    sub_index += 1
+                    self.__collect_texts(track_id, pending, journal, wait=False)
+
+            images.finish()
+            self.__collect_texts(track_id, pending, journal)
+        finally:
+            images.close()
+            journal.close() # kept if the track failed
+
+        progress.update(len(all_sets), ocr.stats['images'], force=True)
+        logger.debug(f'Finished converting subtitle #{track_id} in {int(progress_bar.format_dict["elapsed"])}s.')
+        self.__log_ocr_stats(result, ocr)
         srt.save(srt_file) # save as SRT file
+        journal.remove()
 
         # remove \f and new double empty lines from file
         # with open(srt_file, "r") as file:
@@ -160,6 +298,136 @@ class SubtitleConverter:
         #     file.write(content)
 
         srtchecker.check_srt(srt_file, True) # check SRT file for common OCR mistakes
+        self.cache.store(f'{track_id}.srt', ocr_key, {'lang': result.lang, 'detected_lang': result.detected_lang, 'stats': result.stats})
+        return result
+
+
+    def __check_cancelled(self, journal: OCRJournal):
+        '''
+        Stop the track at a display set after a cancellation, its journal is kept to resume the OCR later.
+        '''
+        if self.cancel.cancelled:
+            journal.close()
+            self.cancel.raise_if_cancelled()
+
+
+    def __collect_texts(self, track_id: int, pending: deque[tuple[int, SubRipItem, Future | None]], journal: OCRJournal, wait: bool = True):
+        '''
+        Set the texts of the subtitles when their OCR is done and write them to the journal in order.
+        Without `wait` only the subtitles whose OCR is already done are written.
+        '''
+        while pending:
+            self.__check_cancelled(journal) # the OCR of the pending images may have been dropped
+            index, item, sub_ocr = pending[0]
+
+            if sub_ocr is not None:
+                if not wait and not sub_ocr.done():
+                    return
+
+                try:
+                    item.text = sub_ocr.result().text
+                except (ConversionCancelled, CancelledError):
+                    # the subtitle is not journaled, so resuming recognizes it again
+                    journal.close()
+                    self.cancel.raise_if_cancelled()
+                    raise
+                except Exception as e:
+                    logger.warning(f'Error processing image in subtitle #{track_id}: {e}. Skipping this image.')
+
+            journal.append(index, item)
+            pending.popleft()
+
+
+    def __get_ocr_settings(self, source: str, lang: str | None, candidates: list[str] | None) -> dict:
+        '''
+        Settings that affect the OCR of a track, a journal or a cached SRT file is only used with the same settings.
+        '''
+        return {
+            'source': self.cache.get_key(source),
+            'lang': lang,
+            'candidates': candidates,
+            'profile': asdict(self.ocr_profile),
+            'text_brightness_diff': self.text_brightness_diff,
+            'tune_brightness': self.tune_brightness
+        }
+
+
+    def __open_images(self, track_id: int, source: str, resume: bool) -> ImageArchive:
+        '''
+        Archive of the decoded images of a track. A resumed OCR doesn't decode all images, so it doesn't write them.
+        '''
+        # the decoded images only depend on the stream, the brightness deviation is applied by the OCR
+        key = self.cache.key('decode', {'source': self.cache.get_key(source)})
+        return ImageArchive(self.cache, f'{track_id}.images.npz', key, write=not resume)
+
+
+    def __get_cached_result(self, result: TrackResult) -> TrackResult:
+        meta = self.cache.get_meta(f'{result.track_id}.srt')
+        result.lang = meta.get('lang', result.lang)
+        result.detected_lang = meta.get('detected_lang')
+        result.stats = meta.get('stats', {})
+
+        logger.info(f'Subtitle #{result.track_id} was already converted with the same settings, reusing it.')
+        return result
+
+
+    def __create_ocr(self, result: TrackResult, candidates: list[str] | None, samples: list[np.ndarray], journal: OCRJournal) -> OCREngine:
+        '''
+        Detect the language and calibrate the OCR on a sample of the images of the track.
+        '''
+        if candidates:
+            result.detected_lang = self.__detect_lang(result.track_id, candidates, samples)
+            result.lang = result.detected_lang or result.lang
+
+        ocr = OCREngine(result.lang, self.text_brightness_diff, self.use_glyph_cache, self.ocr_profile, self.cancel)
+        ocr.calibrate_scale(samples)
+        if self.tune_brightness:
+            ocr.calibrate_brightness(self.sample(samples, ocr.TUNING_SAMPLE_SIZE))
+
+        journal.start({'lang': result.lang, 'detected_lang': result.detected_lang, 'scale': ocr.scale, 'brightness_window': ocr.brightness_window})
+        return ocr
+
+
+    def __resume_ocr(self, result: TrackResult, journal: OCRJournal) -> OCREngine:
+        '''
+        Create the OCR with the calibration of the stopped conversion.
+        '''
+        calibration = journal.calibration
+        result.lang = calibration['lang']
+        result.detected_lang = calibration['detected_lang']
+
+        ocr = OCREngine(result.lang, self.text_brightness_diff, self.use_glyph_cache, self.ocr_profile, self.cancel)
+        ocr.scale = ocr.stats['scale'] = calibration['scale']
+        ocr.brightness_window = ocr.stats['brightness_window'] = calibration['brightness_window']
+
+        logger.info(f'Resuming subtitle #{result.track_id} after display set {journal.checkpoint} with {len(journal.items)} recognized subtitles.')
+        return ocr
+
+
+    def __log_ocr_stats(self, result: TrackResult, ocr: OCREngine):
+        track_id = result.track_id
+        result.stats = ocr.stats
+        images = ocr.stats['images']
+        tier_two = ocr.stats['tier_two']
+        share = tier_two / images * 100 if images else 0
+        logger.info(f'Subtitle #{track_id}: {tier_two} of {images} images ({share:.1f}%) needed the second OCR pass.')
+
+        if ocr.stats['timeouts']:
+            logger.warning(f'Subtitle #{track_id}: {ocr.stats["timeouts"]} Tesseract calls timed out.')
+
+        if ocr.stats['tuning_calls']:
+            logger.info(f'Subtitle #{track_id}: tuned the brightness window to {ocr.stats["brightness_window"]:g} with {ocr.stats["tuning_calls"]} sample reads in {ocr.stats["tuning_time"]:.1f}s.')
+
+
+    def sample(self, items: list, count: int | None = None) -> list:
+        '''
+        Returns up to `count` evenly spaced items, e.g. to calibrate the OCR on a few images of a track.
+        '''
+        count = count or self.sample_size
+        if len(items) <= count:
+            return list(items)
+
+        return [items[int(i * len(items) / count)] for i in range(count)]
 
 
     def create_subfile_timings(self, pack: VobSubMergedPack):
@@ -186,15 +454,22 @@ class SubtitleConverter:
         return img
 
     
-    def __convert_sub_to_srt(self, lang:str, track_id: int):
+    def __convert_sub_to_srt(self, lang:str, track_id: int, candidates: list[str] | None = None) -> TrackResult:
         sub_file = os.path.join(self.sub_dir, f'{track_id}.sub')
         idx_file = os.path.join(self.sub_dir, f'{track_id}.idx')
         srt_file = os.path.join(self.sub_dir, f'{track_id}.srt')
+        result = TrackResult(track_id, lang)
 
         # extracted subtitle was already srt
         if (not os.path.exists(sub_file)) and os.path.exists(srt_file):
-            return
+            return result
 
+        settings = self.__get_ocr_settings(f'{track_id}.sub', lang, candidates)
+        ocr_key = self.cache.key('ocr', settings)
+        if self.cache.is_valid(f'{track_id}.srt', ocr_key):
+            return self.__get_cached_result(result)
+
+        self.cache.invalidate(f'{track_id}.srt') # unfinished until the OCR is done
         open(srt_file, "w").close() # create empty SRT file
 
         vob_sub_parser = VobSubParser(True)
@@ -208,35 +483,67 @@ class SubtitleConverter:
         vob_sub_merged_pack_list = vob_sub_parser.merge_vob_sub_packs()
         palette = vob_sub_parser.idx_palette
         
-        if self.continue_flag is False:
-            return
+        self.cancel.raise_if_cancelled()
 
         # building SRT file from DisplaySets
-        sub_text = ""
         sub_start = 0
-        sub_index = 0
-
-        for pack in tqdm(vob_sub_merged_pack_list):
-            img = self.extract_subtitle_image_from_pack(pack, palette)
-            
-            if self.keep_imgs:
-                image = Image.fromarray((img * 255).astype('uint8'), 'RGBA')
-                image.save(os.path.join(track_img_dir, f"{sub_index}.webp"))
-
-            img = self.crop_image(img)
-            img = self.process_image(img)
-
-            sub_text = pytesseract.image_to_string(img, lang)
-            
-            sub_start, sub_end = self.create_subfile_timings(pack)
-            start_time = SubRipTime(seconds=sub_start)
-            end_time = SubRipTime(seconds=sub_end)
-            
-            srt.append(SubRipItem(sub_index, start_time, end_time, sub_text))
-            sub_index += 1
-
-        # self.config.logger.debug(f'Finished converting subtitle #{track_id} in {int(progress_bar.format_dict["elapsed"])}s.')
+        pending = deque()
+        journal = OCRJournal(os.path.join(self.sub_dir, f'{track_id}.journal'), sub_file, settings)
+        resume = journal.load()
+        images = self.__open_images(track_id, f'{track_id}.sub', resume)
+
+        # the images are cropped to their text, like the images of PGS tracks
+        def decode(pack: VobSubMergedPack) -> np.ndarray:
+            return self.crop_image(self.extract_subtitle_image_from_pack(pack, palette))
+
+        try:
+            if resume:
+                ocr = self.__resume_ocr(result, journal)
+            else:
+                sample_packs = self.sample(list(enumerate(vob_sub_merged_pack_list)))
+                samples = [images.get(index, lambda: decode(pack), store=False) for index, pack in sample_packs]
+                ocr = self.__create_ocr(result, candidates, samples, journal)
+
+            srt.extend(journal.items)
+            sub_index = len(srt)
+
+            progress = TrackProgressReporter(self.on_event, track_id, len(vob_sub_merged_pack_list))
+            for index, pack in enumerate(tqdm(vob_sub_merged_pack_list)):
+                if index <= journal.checkpoint: # recognized before the conversion was stopped
+                    continue
+                self.__check_cancelled(journal)
+                progress.update(index + 1, ocr.stats['images'])
+
+                img = images.get(index, lambda: decode(pack))
+                
+                if self.keep_imgs:
+                    image = Image.fromarray((img * 255).astype('uint8'), 'RGBA')
+                    image.save(os.path.join(track_img_dir, f"{sub_index}.webp"))
+
+                sub_ocr = self.dispatcher.submit(ocr, img)
+                
+                sub_start, sub_end = self.create_subfile_timings(pack)
+                start_time = SubRipTime(seconds=sub_start)
+                end_time = SubRipTime(seconds=sub_end)
+                
+                item = SubRipItem(sub_index, start_time, end_time, '')
+                srt.append(item)
+                pending.append((index, item, sub_ocr))
+                sub_index += 1
+                self.__collect_texts(track_id, pending, journal, wait=False)
+
+            images.finish()
+            self.__collect_texts(track_id, pending, journal)
+        finally:
+            images.close()
+            journal.close() # kept if the track failed
+
+        progress.update(len(vob_sub_merged_pack_list), ocr.stats['images'], force=True)
+
+        # logger.debug(f'Finished converting subtitle #{track_id} in {int(progress_bar.format_dict["elapsed"])}s.')
+        self.__log_ocr_stats(result, ocr)
         srt.save(srt_file) # save as SRT file
+        journal.remove()
 
         # remove \f and new double empty lines from file
         # with open(srt_file, "r") as file:
@@ -249,51 +556,5 @@ class SubtitleConverter:
         #     file.write(content)
 
         srtchecker.check_srt(srt_file, True) # check SRT file for common OCR mistakes
-
-
-    def process_image(self, img: np.ndarray) -> Image.Image:
-        self.brightness_diff = self.text_brightness_diff
-
-        image = np.zeros((img.shape[0], img.shape[1], 4), dtype=np.uint8) # Create a black rgba background
-        image[:, :, :] = np.array(img*255, dtype=np.uint8) # Set the text color to white and keep the alpha channel as it is (for forced subtitles)
-
-        # Convert image to HSV color space (ignoring alpha channel)
-        hsv_image = cv2.cvtColor(image[:,:,:3], cv2.COLOR_BGR2HSV)
-        v_channel = hsv_image[:,:,2]
-        
-        # Only consider pixels where alpha > 0 (not transparent)
-        alpha_channel = image[:,:,3]
-        valid_pixels = v_channel[alpha_channel > 0]
-        
-        if len(valid_pixels) > 0:
-            max_v_value = np.max(valid_pixels)
-        else:
-            max_v_value = np.max(v_channel)
-
-        # Create a mask to only select the pixels with the highest V value (+- tolerance)
-        mask = cv2.inRange(v_channel, np.array(max_v_value - self.brightness_diff), np.array(max_v_value + self.brightness_diff))
-        
-        # Only apply mask to non-transparent pixels
-        mask[alpha_channel == 0] = 0
-
-        # create empty white image (to make background white)
-        result = np.full((image.shape[0], image.shape[1], 3), 255, dtype=np.uint8)
-
-        # set pixels of mask to black (so text becomes black)
-        result[mask == 255] = [0, 0, 0]
-
-        img = Image.fromarray(result)
-
-        scale = 1
-        padding = 25
-        
-        img = img.resize((img.width*scale, img.height*scale), Image.NEAREST)
-
-        # add padding to image so text is not at the edge to improve OCR
-        width, height = img.size
-        new_width = width + 2*padding
-        new_height = height + 2*padding
-
-        new_img = Image.new(img.mode, (new_width, new_height), (255, 255, 255))
-        new_img.paste(img, (padding, padding))
-        return new_img
+        self.cache.store(f'{track_id}.srt', ocr_key, {'lang': result.lang, 'detected_lang': result.detected_lang, 'stats': result.stats})
+        return result
@@ -1,22 +1,34 @@
+import logging
 import os
-from threading import Thread
 import json
-import subprocess
+import time
+from collections.abc import Callable
 from datetime import datetime
 from pathlib import Path
 from config import Config
-import time
+from backend.processes import ProcessRunner, parse_ffmpeg_progress, parse_mkvextract_progress
+from backend.artifactcache import ArtifactCache
+from backend.cancellation import CancellationToken
+from backend.events import PROGRESS_INTERVAL, ConversionEvent, ExtractionProgress
+
+logger = logging.getLogger(__name__)
 
 
 class SubExtractor:
-    def __init__(self, file_path: str, sub_dir: Path):
+    def __init__(self, file_path: str, sub_dir: Path, cache: ArtifactCache, on_event: Callable[[ConversionEvent], None] | None = None, cancel: CancellationToken | None = None):
         self.file_path = file_path
+        self.cache = cache
+        self.on_event = on_event
+        self.cancel = cancel or CancellationToken()
         self.config = Config()
-        self.continue_flag = None
         self.sub_dir = sub_dir
         self.subtitle_counter = 0
+        self.extractions = 0 # commands that read the whole file
         self.probe = None
-        self.subtitle_languages = []
+        self.subtitle_streams = []
+        self.subtitle_languages = [] # in the order of the extracted files
+        self.runner = ProcessRunner()
+        self.probe_timeout = 60
 
     def start(self):
         self.__extract_metadata()
@@ -25,88 +37,42 @@ class SubExtractor:
         self.__extract_srt_subtitles()
 
     def __extract_metadata(self):
-        self.probe = os.popen(f"ffprobe \"{self.file_path}\" -of json -show_entries format:stream").read()
-        self.probe = json.loads(self.probe)
-
-        self.subtitle_languages = []
-        metadata_file = str(Path(self.config.get_datadir(), "metadata.txt"))
-
-        command = [
-            "ffmpeg", "-i", self.file_path,
-            "-map", "0:s?", "-c", "copy", "-y",
-            "-f", "ffmetadata", metadata_file
-        ]
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, text=True)
-
-        for line in iter(process.stderr.readline, ''):
-            passed_time = self.__get_seconds_progress_from_ffmpeg_output(line)
-            if passed_time > 0:
-                process.communicate('q')
-                break
-
-        time.sleep(1)
-
-        with open(metadata_file, "r") as file:
-            metadata = file.read()
-            metadata = metadata.splitlines()
-            languages = [line for line in metadata if "language" in line]
-            self.subtitle_languages = [line.split("=")[1] for line in languages]
-        os.remove(metadata_file)
-
-    def __get_seconds_progress_from_ffmpeg_output(self, line: str) -> float:
-        start_time = datetime(1900, 1, 1)
-        line = line.strip()
+        result = self.runner.run(["ffprobe", "-of", "json", "-show_entries", "format:stream", self.file_path], cancel=self.cancel, path=self.file_path, timeout=self.probe_timeout)
+        self.probe = json.loads(result.stdout)
 
-        if "time=" in line:
-            line = line.split("time=")[1]
-            line = line.split(" bitrate=")[0]
-            line = line.strip()
-            
-            if 'N/A' in line:
-                return -1
-            if line.startswith('-'):
-                line = "00:00:00.000"
-            
-            subtitle_time = line.split('.')[0]
-            subtitle_time = datetime.strptime(subtitle_time, "%H:%M:%S")
-            subtitle_time = subtitle_time - start_time
-            
-            return subtitle_time.total_seconds()
-        
-        return -1
-    
+        # all subtitle streams in the order of "-map 0:s"
+        self.subtitle_streams = [stream for stream in self.probe['streams'] if stream.get('codec_type') == 'subtitle']
 
-    def __get_progress_from_mkvextract_output(self, line: str) -> float:
-        line = line.strip()
+    def __add_file(self, subtitle: dict) -> int:
+        '''
+        Returns the id of the next extracted file. Every file has its own id, so an extracted text stream never
+        has the name of the OCR result of an image based track.
+        '''
+        self.subtitle_languages.append(subtitle.get('tags', {}).get('language', 'und'))
+        self.subtitle_counter += 1
+        return self.subtitle_counter - 1
 
-        if ":" in line:
-            line = line.split(":")[1]
-            line = line.split("%")[0]
-            line = line.strip()
-            
-            if 'N/A' in line:
-                return -1
-            if line.startswith('-'):
-                line = "00:00:00.000"
-            
-            return float(line)
-        
-        return -1
 
+    def __get_key(self, track_id: int, file_ending: str) -> str:
+        return self.cache.key('extract', {'track': track_id, 'format': file_ending})
 
-    # helper function for threading
-    def __extract(self, file_id: int, track_id: int, file_ending: str, times: dict[int, int], finished: dict[int, bool]):
+
+    async def __extract(self, file_id: int, track_id: int, file_ending: str, duration: float):
         file_path = Path(self.sub_dir, f"{file_id}.{file_ending}")
         
         if file_ending in ['sup', 'srt']:
             command = [
                 "ffmpeg",
                 "-y",
+                "-nostats", "-progress", "pipe:1",
                 "-i", self.file_path,
                 "-map", f"0:s:{track_id}",
                 "-c", "copy",
                 str(file_path)
             ]
+            parse_progress = parse_ffmpeg_progress
+            # ffmpeg reports the time of the stream
+            get_fraction = lambda progress: min(progress / duration, 1) if duration > 0 else None
 
         elif file_ending == 'sub':
             command = [
@@ -115,18 +81,34 @@ class SubExtractor:
                 self.file_path,
                 f'{track_id}:{str(file_path)}'
             ]
+            parse_progress = parse_mkvextract_progress
+            get_fraction = lambda progress: progress / 100
+
+        last_event = 0
 
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        def on_progress(progress: float):
+            nonlocal last_event
+            now = time.perf_counter()
+            if self.on_event is None or now - last_event < PROGRESS_INTERVAL:
+                return
 
-        for line in iter(process.stderr.readline, ''):
-            if file_ending == 'sup':
-                times[file_id] = self.__get_seconds_progress_from_ffmpeg_output(line)
-            elif file_ending == 'sub':
-                # TODO: instead of percentage put time in list
-                times[file_id] = self.__get_progress_from_mkvextract_output(line)
+            last_event = now
+            size = file_path.stat().st_size if file_path.exists() else 0
+            self.on_event(ExtractionProgress(file_id, size, get_fraction(progress)))
 
-        process.wait()
-        finished[file_id] = True
+        self.extractions += 1
+        # an overwritten file is unfinished until the extraction succeeds
+        self.cache.invalidate(file_path.name)
+
+        # a stalled extraction is killed and tried once more, then the file fails
+        result = await self.runner.run_async(command, path=self.file_path, timeout=self.runner.timeout_for(self.file_path),
+                                             parse_progress=parse_progress, on_progress=on_progress, retries=1)
+
+        if result.returncode != 0:
+            last_line = (result.stderr.strip().splitlines() or [''])[-1]
+            logger.warning(f'{command[0]} exited with code {result.returncode} while extracting subtitle #{file_id}: {last_line}')
+        else:
+            self.cache.store(file_path.name, self.__get_key(track_id, file_ending))
 
 
     def calculate_subtitle_duration(self, start_time: datetime, subtitle: dict) -> float:
@@ -145,112 +127,81 @@ class SubExtractor:
 
 
     def __extract_sup_subtitles(self) -> list[int]:
-        thread_pool = []
+        extractions = []
 
-        if self.continue_flag is False:
-            return
+        self.cancel.raise_if_cancelled()
 
-        subtitle_streams = [stream for stream in self.probe['streams'] if stream['codec_name'] == 'hdmv_pgs_subtitle']
-        total_time = 0
-        current_times = {}
-        finished = {}
+        # the index of the stream in "-map 0:s"
+        subtitle_streams = [(i, stream) for i, stream in enumerate(self.subtitle_streams) if stream.get('codec_name') == 'hdmv_pgs_subtitle']
         start_time = datetime(1900, 1, 1)
 
         if not os.path.exists(self.sub_dir):
             self.sub_dir.mkdir(parents=True, exist_ok=True)
             
-        for i, subtitle in enumerate(subtitle_streams):
+        for i, subtitle in subtitle_streams:
 
-            # calculate total timelength of subtitles
             subtitle_time = self.calculate_subtitle_duration(start_time, subtitle)
-            total_time += subtitle_time
 
-            self.subtitle_counter += 1
+            file_id = self.__add_file(subtitle)
 
-            # skip if subtitle already exists
-            if os.path.exists(str(self.sub_dir / f'{self.subtitle_counter - 1}.sup')):
+            # skip if subtitle was already extracted from this file
+            if self.cache.is_valid(f'{file_id}.sup', self.__get_key(i, 'sup')):
                 continue
             
-            current_times[i] = 0
-            thread = Thread(name=f"Extract subtitle #{i}", target=self.__extract, args=(i, i, 'sup', current_times, finished))
-            finished[i] = False
-            thread.start()
-            thread_pool.append(thread)
+            extractions.append(self.__extract(file_id, i, 'sup', subtitle_time))
 
-        for thread in thread_pool:
-            thread.join()
+        self.runner.run_all(extractions, cancel=self.cancel)
 
 
     def __extract_sub_subtitles(self) -> list[int]:
-        thread_pool = []
+        extractions = []
 
-        if self.continue_flag is False:
-            return
+        self.cancel.raise_if_cancelled()
 
-        subtitle_streams = [stream for stream in self.probe['streams'] if stream['codec_name'] == 'dvd_subtitle']
-        total_time = 0
-        current_times = {}
-        finished = {}
+        subtitle_streams = [stream for stream in self.subtitle_streams if stream.get('codec_name') == 'dvd_subtitle']
         start_time = datetime(1900, 1, 1)
 
         if not os.path.exists(self.sub_dir):
             self.sub_dir.mkdir(parents=True, exist_ok=True)
 
-        for i, subtitle in enumerate(subtitle_streams):
+        for subtitle in subtitle_streams:
             index = subtitle['index']
 
-            # calculate total timelength of subtitles
             subtitle_time = self.calculate_subtitle_duration(start_time, subtitle)
-            total_time += subtitle_time
 
-            self.subtitle_counter += 1
+            file_id = self.__add_file(subtitle)
 
-            # skip if subtitle already exists
-            if os.path.exists(str(self.sub_dir / f'{index}.sub')):
+            # skip if subtitle was already extracted from this file
+            if self.cache.is_valid(f'{file_id}.sub', self.__get_key(index, 'sub')):
                 continue
             
-            current_times[i] = 0
-            thread = Thread(name=f"Extract subtitle #{i}", target=self.__extract, args=(i, index, 'sub', current_times, finished))
-            finished[i] = False
-            thread.start()
-            thread_pool.append(thread)
+            extractions.append(self.__extract(file_id, index, 'sub', subtitle_time))
 
-        for thread in thread_pool:
-            thread.join()
+        self.runner.run_all(extractions, cancel=self.cancel)
 
 
     def __extract_srt_subtitles(self) -> list[int]:
-        thread_pool = []
+        extractions = []
 
-        if self.continue_flag is False:
-            return
+        self.cancel.raise_if_cancelled()
 
-        subtitle_streams = [stream for stream in self.probe['streams'] if stream['codec_name'] == 'subrip']
-        total_time = 0
-        current_times = {}
-        finished = {}
+        # the index of the stream in "-map 0:s"
+        subtitle_streams = [(i, stream) for i, stream in enumerate(self.subtitle_streams) if stream.get('codec_name') == 'subrip']
         start_time = datetime(1900, 1, 1)
 
         if not os.path.exists(self.sub_dir):
             self.sub_dir.mkdir(parents=True, exist_ok=True)
             
-        for i, subtitle in enumerate(subtitle_streams):
+        for i, subtitle in subtitle_streams:
 
-            # calculate total timelength of subtitles
             subtitle_time = self.calculate_subtitle_duration(start_time, subtitle)
-            total_time += subtitle_time
 
-            self.subtitle_counter += 1
+            file_id = self.__add_file(subtitle)
 
-            # skip if subtitle already exists
-            if os.path.exists(str(self.sub_dir / f'{self.subtitle_counter - 1}.srt')):
+            # skip if subtitle was already extracted from this file
+            if self.cache.is_valid(f'{file_id}.srt', self.__get_key(i, 'srt')):
                 continue
             
-            current_times[i] = 0
-            thread = Thread(name=f"Extract subtitle #{i}", target=self.__extract, args=(i, i, 'srt', current_times, finished))
-            finished[i] = False
-            thread.start()
-            thread_pool.append(thread)
-
-        for thread in thread_pool:
-            thread.join()
+            extractions.append(self.__extract(file_id, i, 'srt', subtitle_time))
+
+        self.runner.run_all(extractions, cancel=self.cancel)
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def find_text_lines(mask: np.ndarray, min_height_ratio: float = 0.4) -> list[tuple[int, int]]:
+    '''
+    Find the text lines of a binarized subtitle image by horizontal projection.
+    `mask` must be True (or non zero) where the text is.
+    Returns a list of (top, bottom) row ranges, bottom is exclusive.
+    '''
+    rows = np.flatnonzero(mask.any(axis=1))
+
+    if len(rows) == 0:
+        return []
+
+    # split the rows with text into runs which are separated by empty rows
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+    runs = [[int(start), int(end)] for start, end in zip(starts, ends)]
+
+    # dots and accents above lowercase letters (e.g. "in", "ü") can be separated by an empty row,
+    # so small runs are merged into the closest neighbouring run
+    max_height = max(end - start for start, end in runs)
+    lines = []
+    pending = None
+
+    for run in runs:
+        if pending is not None:
+            run[0] = pending[0]
+            pending = None
+
+        if run[1] - run[0] < max_height * min_height_ratio:
+            pending = run # belongs to the line below
+            continue
+
+        lines.append(run)
+
+    if pending is not None:
+        if lines:
+            lines[-1][1] = pending[1]
+        else:
+            lines.append(pending)
+
+    return [(start, end) for start, end in lines]
@@ -0,0 +1,57 @@
+'''
+Throughput of the OCR for combinations of worker threads and OpenMP threads per Tesseract process.
+
+Usage: python -m benchmarks.concurrency [--fixtures DIR] [--lang eng] [--workers 1 2 4 8] [--omp-threads 1 2 4] [--repeat 2]
+'''
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+from backend.concurrency import available_cpus
+from backend.ocrengine import OCREngine
+from benchmarks.fixtures import load_fixtures
+
+
+def benchmark(fixtures: list, lang: str, workers: int, omp_threads: int) -> float:
+    # OCREngine.run_tesseract starts Tesseract with the environment of this process
+    os.environ['OMP_THREAD_LIMIT'] = str(omp_threads)
+
+    # one engine per worker like one engine per track in the converter
+    engines = local()
+
+    def recognize(img):
+        if not hasattr(engines, 'ocr'):
+            engines.ocr = OCREngine(lang, 0.03, use_glyph_cache=False)
+        return engines.ocr.recognize(img)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(recognize, [img for img, _ in fixtures]))
+
+    return len(fixtures) / (time.perf_counter() - start)
+
+
+def main():
+    cpus = available_cpus()
+    default_workers = sorted({1, 2, 4, cpus // 2 or 1, cpus, cpus * 2})
+
+    parser = argparse.ArgumentParser(description='Benchmark worker and OpenMP thread counts.')
+    parser.add_argument('--fixtures', help='directory with *.png images and *.txt ground truth (default: synthetic set)')
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers)
+    parser.add_argument('--omp-threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeat', type=int, default=2, help='use the fixture set multiple times')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) * args.repeat
+    print(f'{len(fixtures)} images, {cpus} available CPUs, images/s:')
+    print(f'{"workers":>8} ' + ' '.join(f'{f"OMP={omp}":>8}' for omp in args.omp_threads))
+
+    for workers in args.workers:
+        results = [benchmark(fixtures, args.lang, workers, omp) for omp in args.omp_threads]
+        print(f'{workers:>8} ' + ' '.join(f'{result:>8.2f}' for result in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Throughput of the OCR in the track threads compared with the OCR processes, like sOCRExecutor in the config.
+On a free-threaded interpreter the thread mode decodes and binarizes the images of all tracks in parallel.
+
+Usage: python -m benchmarks.executors [--fixtures DIR] [--lang eng] [--workers 4] [--tracks 4] [--repeat 2]
+'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backend.concurrency import available_cpus, is_free_threaded
+from backend.ocrengine import OCREngine
+from backend.ocrpool import OCRDispatcher
+from benchmarks.fixtures import load_fixtures
+
+
+def benchmark(fixtures: list, lang: str, workers: int, tracks: int, use_processes: bool) -> float:
+    dispatcher = OCRDispatcher(workers, use_processes)
+
+    # every track has its own engine and collects its results at the end like the converter
+    def convert_track(images):
+        ocr = OCREngine(lang, 0.03, use_glyph_cache=False)
+        futures = [dispatcher.submit(ocr, img) for img in images]
+        return [future.result() for future in futures]
+
+    try:
+        # start the OCR processes before measuring
+        if use_processes:
+            dispatcher.submit(OCREngine(lang, 0.03, use_glyph_cache=False), fixtures[0][0]).result()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(convert_track, [[img for img, _ in fixtures[track::tracks]] for track in range(tracks)]))
+        return len(fixtures) / (time.perf_counter() - start)
+    finally:
+        dispatcher.close()
+
+
+def main():
+    cpus = available_cpus()
+
+    parser = argparse.ArgumentParser(description='Benchmark the OCR in threads and processes.')
+    parser.add_argument('--fixtures', help='directory with *.png images and *.txt ground truth (default: synthetic set)')
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--workers', type=int, default=cpus)
+    parser.add_argument('--tracks', type=int, default=4, help='number of tracks the fixtures are split into')
+    parser.add_argument('--repeat', type=int, default=2, help='use the fixture set multiple times')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) * args.repeat
+    print(f'{len(fixtures)} images, {args.tracks} tracks, {args.workers} workers, free-threaded: {is_free_threaded()}')
+
+    for mode, use_processes in (('threads', False), ('processes', True)):
+        print(f'{mode:<10} {benchmark(fixtures, args.lang, args.workers, args.tracks, use_processes):>8.2f} images/s')
+
+
+if __name__ == '__main__':
+    main()
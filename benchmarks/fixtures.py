@@ -0,0 +1,71 @@
+'''
+Fixture images for the benchmarks.
+
+A fixture set is a directory with RGBA subtitle images (*.png) and the expected text of every image
+in a text file with the same name (*.txt). Without a directory a synthetic set is rendered with the
+default font of Pillow in the text sizes of DVD, HD and UHD subtitles.
+'''
+from pathlib import Path
+import tempfile
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+SENTENCES = [
+    "I don't know what you're talking about.",
+    "We have to leave before sunrise.\nThey're already looking for us.",
+    "Where were you last night?",
+    "- Is everything ready?\n- Almost, give me five minutes.",
+    "That's the last time I trust him!",
+    "Do you remember the lighthouse?",
+    "It's 9:45, we're running late.",
+    "Nobody leaves this room\nuntil we find the key.",
+]
+
+SIZES = (24, 40, 80)
+
+
+def render_fixtures(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+
+    for size in SIZES:
+        font = ImageFont.load_default(size=size)
+        for i, sentence in enumerate(SENTENCES):
+            # white text with a black outline on a transparent background, like most PGS subtitles
+            left, top, right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).multiline_textbbox((0, 0), sentence, font=font, stroke_width=2)
+            img = Image.new('RGBA', (right - left + 20, bottom - top + 20), (0, 0, 0, 0))
+            ImageDraw.Draw(img).multiline_text((10 - left, 10 - top), sentence, font=font, fill=(255, 255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0, 255), align='center')
+
+            name = f'{size}px-{i}'
+            img.save(directory / f'{name}.png')
+            (directory / f'{name}.txt').write_text(sentence, encoding='utf8')
+
+
+def load_fixtures(directory: str | None = None) -> list[tuple[np.ndarray, str]]:
+    '''
+    Returns (RGBA image with values between 0 and 1, expected text) tuples.
+    '''
+    if directory is None:
+        directory = Path(tempfile.mkdtemp(prefix='mkv-subtitle-converter-fixtures-'))
+        render_fixtures(directory)
+
+    fixtures = []
+    for image_path in sorted(Path(directory).glob('*.png')):
+        img = np.array(Image.open(image_path).convert('RGBA')) / 255
+        text = image_path.with_suffix('.txt').read_text(encoding='utf8').strip()
+        fixtures.append((img, text))
+
+    return fixtures
+
+
+def character_error_rate(expected: str, actual: str) -> float:
+    '''
+    Levenshtein distance between the texts divided by the length of the expected text.
+    '''
+    previous = list(range(len(actual) + 1))
+    for i, expected_char in enumerate(expected, 1):
+        current = [i]
+        for j, actual_char in enumerate(actual, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (expected_char != actual_char)))
+        previous = current
+
+    return previous[-1] / max(len(expected), 1)
@@ -0,0 +1,51 @@
+'''
+Compare the throughput and accuracy of the OCR profiles.
+
+Usage: python -m benchmarks.ocr_profiles [--fixtures DIR] [--lang eng] [--profiles fast best] [--glyph-cache]
+'''
+import argparse
+import time
+from backend.ocrengine import OCREngine
+from benchmarks.fixtures import load_fixtures, character_error_rate
+from controller.ocr_profiles import OCRProfiles
+
+
+def benchmark_profile(profile: OCRProfiles, fixtures: list, lang: str, text_brightness_diff: float, glyph_cache: bool) -> dict:
+    ocr = OCREngine(lang, text_brightness_diff, glyph_cache, OCRProfiles.get_profile(profile))
+    ocr.calibrate_scale([img for img, _ in fixtures])
+
+    errors = []
+    start = time.perf_counter()
+    for img, expected in fixtures:
+        result = ocr.recognize(img)
+        errors.append(character_error_rate(expected, result.text))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'profile': profile.value,
+        'images_per_second': len(fixtures) / elapsed,
+        'cer': sum(errors) / len(errors),
+        'tier_two': ocr.stats['tier_two'] / max(ocr.stats['images'], 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OCR profiles.')
+    parser.add_argument('--fixtures', help='directory with *.png images and *.txt ground truth (default: synthetic set)')
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--profiles', nargs='+', default=[profile.value for profile in OCRProfiles])
+    parser.add_argument('--brightness-diff', type=float, default=0.03)
+    parser.add_argument('--glyph-cache', action='store_true', help='also use the glyph matcher')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    print(f'{len(fixtures)} images')
+    print(f'{"profile":<10} {"images/s":>10} {"CER":>8} {"tier 2":>8}')
+
+    for name in args.profiles:
+        result = benchmark_profile(OCRProfiles.get_name(name), fixtures, args.lang, args.brightness_diff, args.glyph_cache)
+        print(f'{result["profile"]:<10} {result["images_per_second"]:>10.2f} {result["cer"]:>8.2%} {result["tier_two"]:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
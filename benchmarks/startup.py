@@ -0,0 +1,93 @@
+'''
+Startup time of the GUI (time until the window is shown) and of the CLI (time until the first byte of output),
+measured in fresh interpreters. With --imports the slowest imports of both paths are listed (python -X importtime),
+so a module that is imported eagerly again shows up at the top.
+
+Without a display the GUI is measured until its modules are imported.
+
+Usage: python -m benchmarks.startup [--repeat 5] [--imports 10]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WINDOW_SCRIPT = '''
+import main
+from gui.gui import GUI
+try:
+    gui = GUI()
+    gui.window.update()
+    print('window', flush=True)
+except Exception: # no display
+    print('imports', flush=True)
+'''
+
+
+def time_to_first_byte(command: list[str]) -> tuple[float, str]:
+    '''
+    Seconds until the command writes its first line to stdout and that line, the command is killed afterwards.
+    '''
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        line = process.stdout.readline()
+        return time.perf_counter() - start, line.strip()
+    finally:
+        process.kill()
+        process.wait()
+
+
+def slowest_imports(command: list[str], count: int) -> list[tuple[int, str]]:
+    '''
+    The modules with the highest cumulative import time in microseconds, from the output of -X importtime.
+    '''
+    result = subprocess.run([command[0], '-X', 'importtime'] + command[1:], cwd=ROOT, capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        imports.append((int(cumulative), module.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the GUI and the CLI.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--imports', type=int, default=0, metavar='N', help='list the N slowest imports of each path')
+    args = parser.parse_args()
+
+    # the CLI writes its first event when the conversion starts, the file doesn't have to be a valid MKV file
+    with tempfile.NamedTemporaryFile(suffix='.mkv', delete=False) as file:
+        dummy_file = file.name
+
+    commands = {
+        'GUI': [sys.executable, '-c', WINDOW_SCRIPT],
+        'CLI': [sys.executable, 'cli.py', '--keep-old-mkvs', dummy_file]
+    }
+
+    try:
+        for name, command in commands.items():
+            times = []
+            for _ in range(args.repeat):
+                seconds, line = time_to_first_byte(command)
+                times.append(seconds)
+
+            target = {'window': 'time to window', 'imports': 'time to import (no display)'}.get(line.split(' ')[0], 'time to first byte')
+            print(f'{name} {target:<28} median {statistics.median(times) * 1000:>7.0f} ms, min {min(times) * 1000:>7.0f} ms')
+
+            for cumulative, module in slowest_imports(command, args.imports):
+                print(f'    {cumulative / 1000:>8.1f} ms  {module}')
+    finally:
+        os.remove(dummy_file)
+
+
+if __name__ == '__main__':
+    main()
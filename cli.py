@@ -0,0 +1,186 @@
+'''
+Converts MKV files without the GUI, e.g. on a headless server. Progress and results are written to stdout as
+JSON lines (one event per line), the log is written to the log directory like in the GUI.
+
+Usage: python cli.py [options] FILE_OR_GLOB [FILE_OR_GLOB ...]
+
+Before converting, the files are planned (unless disabled in the config): the time of every file is estimated
+and the longest files are converted first. --dry-run only plans, --plan also writes the plan to a JSON file.
+
+Exit codes: 0 all files were converted, 1 at least one file failed (or couldn't be planned in a dry run),
+2 invalid arguments, 130 interrupted.
+'''
+import argparse
+from dataclasses import asdict
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from threading import Lock, Thread
+from config import Config
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+# events are sent by the track threads and the process runner as well
+output_lock = Lock()
+
+
+def emit(event: str, **values):
+    line = json.dumps({'event': event, 'time': round(time.time(), 3), **values}, default=str)
+    with output_lock:
+        print(line, flush=True)
+
+
+def emit_conversion_event(event):
+    from backend.events import ExtractionProgress, FileFailed, FileFinished, JobStarted, TrackProgress
+
+    match event:
+        case JobStarted():
+            emit('job', file=event.file, job=event.job.name)
+        case ExtractionProgress():
+            emit('extraction_progress', file=event.file, track=event.track_id, bytes=event.bytes, fraction=event.fraction)
+        case TrackProgress():
+            emit('track_progress', file=event.file, track=event.track_id, processed=event.processed, total=event.total,
+                 images_per_second=round(event.images_per_second, 2), eta=round(event.eta, 1) if event.eta is not None else None)
+        case FileFinished():
+            emit('file_finished', file=event.file, tracks=[asdict(track) for track in event.result.tracks],
+                 languages=event.result.languages, timings=event.result.timings, bytes_saved=event.result.bytes_saved)
+        case FileFailed():
+            emit('file_error', file=event.file, message=event.result.error, timings=event.result.timings)
+
+
+def expand_paths(patterns: list[str]) -> tuple[list[str], list[str]]:
+    '''
+    Returns the files the paths and glob patterns match (without duplicates) and the patterns without a match.
+    '''
+    files = []
+    missing = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        matches = [os.path.abspath(path) for path in matches if os.path.isfile(path)]
+        if not matches:
+            missing.append(pattern)
+        files += [path for path in matches if path not in files]
+
+    return files, missing
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Convert the image based subtitles of MKV files to text based subtitles.')
+    parser.add_argument('paths', nargs='+', metavar='FILE_OR_GLOB', help='MKV files or glob patterns like "movies/**/*.mkv"')
+    parser.add_argument('--format', default='srt', choices=['srt', 'ass', 'ssa', 'vtt'], help='format of the new subtitles (default: srt)')
+    parser.add_argument('--diff-langs', action='append', default=[], metavar='OLD->NEW', help='use the language model NEW for subtitles in OLD, e.g. "eng->ger" (repeatable)')
+    parser.add_argument('--brightness-diff', type=float, default=3, metavar='PERCENT', help='allowed text color brightness deviation in percent (default: 3)')
+    parser.add_argument('--ocr-profile', choices=['fast', 'balanced', 'best'], help='OCR profile (default: from the config)')
+    parser.add_argument('--keep-images', action='store_true', help='keep the subtitle images')
+    parser.add_argument('--keep-old-mkvs', action='store_true', help='write the new file next to the old one instead of replacing it')
+    parser.add_argument('--keep-old-subs', action='store_true', help='keep the extracted image based subtitles')
+    parser.add_argument('--keep-new-subs', action='store_true', help='keep the new text based subtitles')
+    parser.add_argument('--on-error', choices=['continue', 'stop'], default='continue', help='continue with the next file or stop after an error (default: continue)')
+    parser.add_argument('--dry-run', action='store_true', help='only plan the batch: estimate its time without converting')
+    parser.add_argument('--plan', metavar='FILE', help='write the plan of the batch as JSON to FILE')
+
+    performance = parser.add_argument_group('performance', 'override the [Performance] section of the config for this run')
+    performance.add_argument('--ocr-workers', type=int, metavar='N', help='tracks converted at the same time, 0 = one per CPU')
+    performance.add_argument('--ocr-executor', choices=['auto', 'threads', 'processes'])
+    performance.add_argument('--max-processes', type=int, metavar='N', help='external tools running at the same time, 0 = two per CPU')
+    performance.add_argument('--processes-per-device', type=int, metavar='N', help='external tools reading from the same disk at the same time')
+    performance.add_argument('--staging', choices=['auto', 'always', 'off'], help='copy the files to a local directory first: auto = files on network shares')
+    performance.add_argument('--staging-dir', metavar='DIR', help='local directory for staged files')
+    performance.add_argument('--device-limits', metavar='PATH=N,...', help='other limits for the devices of these paths, e.g. "/mnt/nas=1"')
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    files, missing = expand_paths(args.paths)
+    if missing:
+        parser.error(f'no files match {", ".join(missing)}')
+
+    config = Config()
+    overrides = {
+        Config.Settings.OCR_WORKERS: args.ocr_workers,
+        Config.Settings.OCR_EXECUTOR: args.ocr_executor,
+        Config.Settings.MAX_PROCESSES: args.max_processes,
+        Config.Settings.PROCESSES_PER_DEVICE: args.processes_per_device,
+        Config.Settings.DEVICE_LIMITS: args.device_limits,
+        Config.Settings.STAGING: args.staging,
+        Config.Settings.STAGING_DIR: args.staging_dir,
+        Config.Settings.OCR_PROFILE: args.ocr_profile
+    }
+    config.override_settings({setting: value for setting, value in overrides.items() if value is not None})
+
+    emit('start', files=files)
+    start = time.perf_counter()
+
+    import backend.concurrency as concurrency
+    concurrency.set_thread_limits() # before numpy and OpenCV are imported
+
+    # imported after the thread limits are set and only when there is something to convert
+    from backend.main import ConversionOptions, convert_files
+    from backend.cancellation import CancellationToken, ConversionCancelled
+    import backend.helper as subhelper
+    from controller.ocr_profiles import OCRProfiles
+    from controller.sub_formats import SubtitleFormats
+
+    options = ConversionOptions(keep_imgs=args.keep_images,
+                                keep_old_mkvs=args.keep_old_mkvs,
+                                keep_old_subs=args.keep_old_subs,
+                                keep_new_subs=args.keep_new_subs,
+                                diff_langs=subhelper.diff_langs_from_text('\n'.join(args.diff_langs)),
+                                sub_format=SubtitleFormats.get_name(args.format),
+                                text_brightness_diff=args.brightness_diff / 100,
+                                ocr_profile=OCRProfiles.get_name(config.get_value(Config.Settings.OCR_PROFILE)),
+                                on_error=args.on_error,
+                                cancel=CancellationToken())
+
+    def interrupt(signum, frame):
+        # the conversion stops cooperatively, a second Ctrl+C interrupts right away
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        # not in the handler, it could interrupt the main thread while it holds the lock of the token
+        Thread(name="Cancel", target=options.cancel.cancel).start()
+
+    signal.signal(signal.SIGINT, interrupt)
+
+    if args.dry_run or args.plan or config.get_value(Config.Settings.PLAN_BATCH):
+        from backend.planner import plan_files
+
+        try:
+            # only a dry run reads the files again to count their display sets and time the OCR
+            plan = plan_files(files, options, thorough=bool(args.dry_run or args.plan))
+        except ConversionCancelled:
+            emit('interrupted', finished=0)
+            return EXIT_INTERRUPTED
+
+        emit('plan', **asdict(plan))
+        if args.plan:
+            with open(args.plan, 'w', encoding='utf8') as file:
+                file.write(plan.to_json())
+        if args.dry_run:
+            # a file that can't be planned, e.g. an unreadable one, would fail the conversion as well
+            return EXIT_FAILED if any(file.error is not None for file in plan.files) else EXIT_OK
+        files = plan.order
+
+    results = convert_files(files, options, emit_conversion_event)
+
+    if options.cancel.cancelled:
+        emit('interrupted', finished=sum(result.success for result in results))
+        return EXIT_INTERRUPTED
+
+    failed = sum(not result.success for result in results)
+    emit('finished', files=len(files), finished=len(results) - failed, failed=failed, elapsed=round(time.perf_counter() - start, 3),
+         bytes_saved=sum(result.bytes_saved for result in results))
+
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
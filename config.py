@@ -1,16 +1,31 @@
 __version__ = "v1.5.1"
 
+import atexit
 import configparser
+from dataclasses import dataclass
 from enum import Enum
 import gettext
 import os
-from babel import Locale
+import queue
 import sys
 from pathlib import Path
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import multiprocessing
 from datetime import datetime
+from threading import Lock
 from controller.sub_formats import SubtitleFormats
-import darkdetect
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    '''
+    Immutable copy of the settings of the parent process that is sent to worker processes,
+    so they don't read the config file again.
+    '''
+    settings: tuple[tuple[str, str, str], ...] # section, option, value
+    datadir: str
+
 
 class Config:
     class Settings(Enum):
@@ -18,39 +33,156 @@ class Config:
         LANGUAGE = 'sLanguage'
         FIRST_START = 'bFirstStart'
         THEME = 'sTheme'
+        GLYPH_CACHE = 'bGlyphCache'
+        OCR_PROFILE = 'sOCRProfile'
+        TESSDATA_FAST = 'sTessdataFast'
+        TESSDATA_BEST = 'sTessdataBest'
+        LANGUAGE_DETECTION = 'sLanguageDetection'
+        DETECTION_LANGUAGES = 'sDetectionLanguages'
+        BRIGHTNESS_TUNING = 'bBrightnessTuning'
+        OCR_WORKERS = 'iOCRWorkers'
+        OMP_THREADS = 'iOMPThreads'
+        OPENCV_THREADS = 'iOpenCVThreads'
+        BLAS_THREADS = 'iBLASThreads'
+        OCR_EXECUTOR = 'sOCRExecutor'
+        MAX_PROCESSES = 'iMaxProcesses'
+        PROCESSES_PER_DEVICE = 'iProcessesPerDevice'
+        STALL_TIMEOUT = 'iStallTimeout'
+        TIMEOUT_PER_GB = 'iTimeoutPerGB'
+        OCR_TIMEOUT = 'iOCRTimeout'
+        PLAN_BATCH = 'bPlanBatch'
+        DEVICE_LIMITS = 'sDeviceLimits'
+        STAGING = 'sStaging'
+        STAGING_DIR = 'sStagingDir'
+        STAGING_QUOTA = 'iStagingQuota'
+        CACHE_QUOTA = 'iCacheQuota'
+        LOG_LEVEL = 'sLogLevel'
+        COMPONENT_LOG_LEVELS = 'sComponentLogLevels'
+        LOG_MAX_SIZE = 'iLogMaxSize'
+        LOG_BACKUPS = 'iLogBackups'
 
     
     config = None
     _new_config = None
+    _lock = Lock()
+    _worker_datadir = None # data directory of the parent, set in worker processes
+    log_queue = None
 
     def __new__(cls, *args, **kwargs):
         if not cls.config:
-            cls.config = super(Config, cls).__new__(cls, *args, **kwargs)
-            cls.config._initialize_config()
+            # threads must not see the instance before it is initialized
+            with cls._lock:
+                if not cls.config:
+                    config = super(Config, cls).__new__(cls, *args, **kwargs)
+                    config._initialize_config()
+                    cls.config = config
         return cls.config
 
     def _initialize_config(self):
-        self.logger = self.create_logger()
-
         self.config_path = str(self.get_datadir() / 'config.ini')
         self.config = configparser.ConfigParser()
         self.config.read(self.config_path)
+        self.translation = None # loaded by the first translate call
+        self.languages = None # language codes and names, loaded by the first get_languages call
+
+        # the config file is only written if it doesn't exist yet or settings of a newer version are missing
         self.create_default_config()
-        self._new_config.read(self.config_path)
-        self.save_config()
+        if self._new_config is not None:
+            self._new_config.read(self.config_path)
+            self.save_config()
 
-        language: str = self.get_value(self.Settings.LANGUAGE) # get the language set in the config
-        self.translation = gettext.translation('messages', self.get_resource_path('languages'), [language, 'en_US'], fallback=True)
-        self.translation.install()
+        # after reading the config, it has the log levels
+        self.logger = self.create_logger()
         
+    @classmethod
+    def initialize_worker(cls, snapshot: ConfigSnapshot, log_queue):
+        '''
+        Replace the config of a worker process (e.g. inherited by fork) with the snapshot of its parent.
+        Nothing is written to the filesystem: the log records are sent to the parent through the log queue
+        and the translations are not loaded, messages of workers are logged in English.
+        '''
+        config = super(Config, cls).__new__(cls)
+        config._worker_datadir = Path(snapshot.datadir)
+        config.config_path = str(config._worker_datadir / 'config.ini')
+        config.config = configparser.ConfigParser()
+        for section, option, value in snapshot.settings:
+            if not config.config.has_section(section):
+                config.config.add_section(section)
+            config.config.set(section, option, value)
+        config.translation = gettext.NullTranslations()
+        config.languages = None
+
+        # workers of this worker send their records to the same queue
+        config.log_queue = log_queue
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(QueueHandler(log_queue))
+        config.set_log_levels() # records below the levels are dropped in the worker, not sent to the parent
+        config.logger = logging.getLogger(__name__)
+
+        with cls._lock:
+            cls.config = config
+
+    def get_worker_args(self) -> tuple[ConfigSnapshot, multiprocessing.Queue]:
+        '''
+        Arguments of initialize_worker for a new worker process, e.g. as initializer of a process pool.
+        '''
+        settings = tuple((section, option, value) for section in self.config.sections() for option, value in self.config.items(section))
+        return ConfigSnapshot(settings, str(self.get_datadir())), self.get_log_queue()
+
+    def get_log_queue(self) -> multiprocessing.Queue:
+        '''
+        Queue for the log records of worker processes, this process writes them with its own handlers.
+        '''
+        with self._lock:
+            if self.log_queue is None:
+                self.log_queue = multiprocessing.get_context('spawn').Queue() # works for forked and spawned workers
+                listener = QueueListener(self.log_queue, *logging.getLogger().handlers)
+                listener.start()
+                atexit.register(listener.stop) # write the remaining records
+
+        return self.log_queue
+
     def create_default_config(self):
         settings = {}
         settings[self.Settings.CHECK_FOR_UPDATES] = True
         settings[self.Settings.LANGUAGE] = 'en_US'
         settings[self.Settings.FIRST_START] = True
         settings[self.Settings.THEME] = 'Light'
-
-        self.save_settings(settings)
+        settings[self.Settings.GLYPH_CACHE] = True
+        settings[self.Settings.OCR_PROFILE] = 'balanced'
+        settings[self.Settings.TESSDATA_FAST] = ''
+        settings[self.Settings.TESSDATA_BEST] = ''
+        settings[self.Settings.LANGUAGE_DETECTION] = 'untagged' # untagged, always or off
+        settings[self.Settings.DETECTION_LANGUAGES] = 'eng,deu,fra,spa,ita,por'
+        settings[self.Settings.BRIGHTNESS_TUNING] = True
+        settings[self.Settings.OCR_WORKERS] = 0 # 0 = one per CPU
+        settings[self.Settings.OMP_THREADS] = 1
+        settings[self.Settings.OPENCV_THREADS] = 1
+        settings[self.Settings.BLAS_THREADS] = 1
+        settings[self.Settings.OCR_EXECUTOR] = 'auto' # auto, threads or processes
+        settings[self.Settings.MAX_PROCESSES] = 0 # 0 = two per CPU
+        settings[self.Settings.PROCESSES_PER_DEVICE] = 2
+        settings[self.Settings.DEVICE_LIMITS] = '' # path=limit for the devices of these paths, e.g. /mnt/nas=1
+        settings[self.Settings.STAGING] = 'auto' # copy inputs to a local directory: auto (network shares), always or off
+        settings[self.Settings.STAGING_DIR] = '' # empty = "staging" in the data directory
+        settings[self.Settings.STAGING_QUOTA] = 50 # GB
+        settings[self.Settings.CACHE_QUOTA] = 10 # GB of extracted streams, decoded images and OCR results
+        settings[self.Settings.STALL_TIMEOUT] = 120 # seconds without output, 0 = no limit
+        settings[self.Settings.TIMEOUT_PER_GB] = 300 # seconds per GB of the file, 0 = no limit
+        settings[self.Settings.OCR_TIMEOUT] = 30 # seconds per Tesseract call, 0 = no limit
+        settings[self.Settings.PLAN_BATCH] = True # estimate the time and convert the longest files first
+        settings[self.Settings.LOG_LEVEL] = 'INFO' # DEBUG logs every image of the OCR
+        settings[self.Settings.COMPONENT_LOG_LEVELS] = 'PIL=INFO, backend.ocrengine=INFO' # logger=level, the OCR engine logs every image
+        settings[self.Settings.LOG_MAX_SIZE] = 10 # MB
+        settings[self.Settings.LOG_BACKUPS] = 5
+
+        if os.path.exists(self.config_path):
+            settings = {setting: value for setting, value in settings.items() if not self.config.has_option(self._get_section(setting), setting.value)}
+
+        if settings:
+            self.save_settings(settings)
 
 
     def check_for_updates(self):        
@@ -60,6 +192,11 @@ class Config:
         return self.get_value(self.Settings.CHECK_FOR_UPDATES)
 
     def save_settings(self, settings: dict[Settings]):
+        config_exists = os.path.exists(self.config_path)
+
+        # check if there are any changes, so save_config doesn't write the same file again
+        if config_exists and all(self.get_value(setting) == settings[setting] for setting in settings):
+            return
 
         # Make changes to the config without saving the file
         if self._new_config is None:
@@ -67,22 +204,30 @@ class Config:
             self._new_config.optionxform = str
             self._new_config.read(self.config_path)
 
-        if not os.path.exists(self.config_path):
+        if not config_exists:
             for setting in self.Settings:
                 section = self._get_section(setting)
                 if not self._new_config.has_section(section):
                     self._new_config.add_section(section)
                 self._new_config.set(section, setting.value, self._convert_value_to_config_value(setting, settings[setting]))
-        else:
-            # check if there are any changes
-            if all(self.get_value(setting) == settings[setting] for setting in settings):
-                return
         
         for setting in settings:
             section = self._get_section(setting)
             value = self._convert_value_to_config_value(setting, settings[setting])
+            if not self._new_config.has_section(section): # settings added in a newer version
+                self._new_config.add_section(section)
             self._new_config.set(section, setting.value, value)
 
+    def override_settings(self, settings: dict[Settings]):
+        '''
+        Change settings for this run only (e.g. command line options) without writing them to the config file.
+        '''
+        for setting, value in settings.items():
+            section = self._get_section(setting)
+            if not self.config.has_section(section):
+                self.config.add_section(section)
+            self.config.set(section, setting.value, self._convert_value_to_config_value(setting, value))
+
     def save_config(self):
         # Return if there are no changes
         if self._new_config is None:
@@ -96,10 +241,7 @@ class Config:
         # TODO: just do _initialize_config() but there is currently a bug
         self.config = configparser.ConfigParser()
         self.config.read(self.config_path)
-
-        language: str = self.get_value(self.Settings.LANGUAGE) # get the language set in the config
-        self.translation = gettext.translation('messages', self.get_resource_path('languages'), [language, 'en_US'], fallback=True)
-        self.translation.install()
+        self.translation = None # the language may have changed
 
         self._new_config = None
 
@@ -109,11 +251,16 @@ class Config:
                 return '1' if value else '0'
             case 's':
                 return str(value)
+            case 'i':
+                return str(int(value))
             
     def _get_section(self, setting: Settings):
         config = {
             'General': ['bUpdates', 'sLanguage', 'sTheme'],
-            'Misc': ['bFirstStart']
+            'Misc': ['bFirstStart'],
+            'OCR': ['bGlyphCache', 'sOCRProfile', 'sTessdataFast', 'sTessdataBest', 'sLanguageDetection', 'sDetectionLanguages', 'bBrightnessTuning'],
+            'Performance': ['iOCRWorkers', 'iOMPThreads', 'iOpenCVThreads', 'iBLASThreads', 'sOCRExecutor', 'iMaxProcesses', 'iProcessesPerDevice', 'iStallTimeout', 'iTimeoutPerGB', 'iOCRTimeout', 'bPlanBatch', 'sDeviceLimits', 'sStaging', 'sStagingDir', 'iStagingQuota', 'iCacheQuota'],
+            'Logging': ['sLogLevel', 'sComponentLogLevels', 'iLogMaxSize', 'iLogBackups']
         }
 
         for section, settings in config.items():
@@ -121,37 +268,52 @@ class Config:
                 return section
             
     def get_value(self, setting: Settings):
-        value = self.config.get(self._get_section(setting), setting.value)
+        value = self.config.get(self._get_section(setting), setting.value, fallback=None)
 
         match setting.value[0]:
             case 'b':
                 return value == '1'
             case 's':
                 return value
+            case 'i':
+                return int(value) if value is not None else None
 
     def get_version(self):
         return __version__
     
     def translate(self, text: str):
+        if self.translation is None:
+            language: str = self.get_value(self.Settings.LANGUAGE) # get the language set in the config
+            self.translation = gettext.translation('messages', self.get_resource_path('languages'), [language, 'en_US'], fallback=True)
+            self.translation.install()
+
         return self.translation.gettext(text)
     
     def get_language(self):
+        from babel import Locale
+
         lang_code = self.get_value(self.Settings.LANGUAGE)
         return Locale.parse(lang_code).get_display_name()
     
-    def get_languages(self):
-        lang_codes = [code.name for code in os.scandir(self.get_resource_path('languages')) if code.is_dir()]
-        languages = [Locale.parse(code).get_display_name() for code in lang_codes]
+    def __get_language_names(self) -> dict[str, str]:
+        # parsing the locales is slow and the translations don't change while the program runs
+        if self.languages is None:
+            from babel import Locale
+
+            lang_codes = [code.name for code in os.scandir(self.get_resource_path('languages')) if code.is_dir()]
+            self.languages = {code: Locale.parse(code).get_display_name() for code in lang_codes}
 
-        return languages
+        return self.languages
+
+    def get_languages(self):
+        return list(self.__get_language_names().values())
 
     def convert_language_to_code(self, language: str):
         if language.strip() == '':
             return 'en_US'
         
-        lang_codes = [code.name for code in os.scandir(self.get_resource_path('languages')) if code.is_dir()]
-        languages = [Locale.parse(code).get_display_name() for code in lang_codes]
-        return lang_codes[languages.index(language)]
+        languages = self.__get_language_names()
+        return list(languages.keys())[list(languages.values()).index(language)]
     
     def get_datadir(self) -> Path:
         """
@@ -163,6 +325,9 @@ class Config:
         # Windows: C:/Users/<USER>/AppData/Roaming/MKV Subtitle Converter
         """
 
+        if self._worker_datadir is not None:
+            return self._worker_datadir
+
         if sys.platform.startswith("win"):
             path = Path(os.getenv("LOCALAPPDATA"))
         elif sys.platform.startswith("darwin"):
@@ -211,16 +376,48 @@ class Config:
         raise FileNotFoundError(f"Resource file not found: {relative_path}")
     
     def create_logger(self):
+        '''
+        All threads put their records into a queue and one listener thread writes them to the log file, so a log
+        call in an OCR thread doesn't wait for the disk or the lock of the file. The records of worker processes
+        arrive through the log queue (get_log_queue) and are written by the same thread.
+        '''
         self.logger = logging.getLogger(__name__)
         date = datetime.now().strftime('%Y-%m-%d %H.%M.%S')
         logs_dir = Path(self.get_datadir() / 'logs')
-        # logs_dir = Path('logs')
         logs_dir.mkdir(parents=True, exist_ok=True)
-        logging.basicConfig(filename=str(logs_dir / f'{date}.log'), level=logging.DEBUG, format='[%(levelname)s] %(asctime)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+        file_handler = RotatingFileHandler(logs_dir / 'mkv-subtitle-converter.log', maxBytes=self.get_value(self.Settings.LOG_MAX_SIZE) * 1024 * 1024,
+                                           backupCount=self.get_value(self.Settings.LOG_BACKUPS), encoding='utf8', delay=True)
+        file_handler.setFormatter(logging.Formatter('[%(levelname)s] %(asctime)s %(processName)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
         # logging.getLogger().addHandler(logging.StreamHandler())  # print logs to console
+
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, file_handler)
+        listener.start()
+        atexit.register(listener.stop) # write the remaining records
+
+        logging.getLogger().addHandler(QueueHandler(records))
+        self.set_log_levels()
         self.logger.debug(f'Program started at {date}.')
 
         return self.logger
+
+    def set_log_levels(self):
+        '''
+        Set the level of the root logger and the levels of single components (loggers), e.g. "backend.ocrengine=DEBUG".
+        Disabled records are dropped by the logger before they are formatted.
+        '''
+        logging.getLogger().setLevel(self.get_value(self.Settings.LOG_LEVEL).upper())
+
+        for component_level in self.get_value(self.Settings.COMPONENT_LOG_LEVELS).split(','):
+            if '=' not in component_level:
+                continue
+
+            component, level = (part.strip() for part in component_level.split('=', 1))
+            try:
+                logging.getLogger(component).setLevel(level.upper())
+            except ValueError:
+                logging.getLogger(__name__).warning(f'Unknown log level "{level}" for {component}.')
     
     def get_allowed_sub_formats(self) -> list[str]:
         return [sub_format.value for sub_format in SubtitleFormats]
@@ -229,6 +426,7 @@ class Config:
         theme = self.get_value(self.Settings.THEME)
 
         if theme.lower() == 'auto':
+            import darkdetect
             theme = 'Dark' if darkdetect.isDark() else 'Light'
 
         return theme.lower()
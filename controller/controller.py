@@ -1,15 +1,35 @@
 from gui.gui import GUI
 from config import Config
-from backend.main import SubMain
 import backend.helper as subhelper
+import logging
+import os
+import queue
 import time
+from pathlib import Path
 from controller.jobs import Jobs
 from controller.sub_formats import SubtitleFormats
-from multiprocessing import Process, Manager
+from controller.ocr_profiles import OCRProfiles
+from multiprocessing import Event, Process, Queue
+from threading import Thread
+from backend.cancellation import CancellationToken, ConversionCancelled
+from backend.capabilities import Capabilities
+from backend.processes import ProcessGroups, ProcessRunner, kill_process_tree
+from backend.events import BatchPlanned, ConversionEvent, EditRequested, ExtractionProgress, FileFailed, FileFinished, JobStarted, TrackProgress
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend.main import ConversionOptions, SubMain
+
+logger = logging.getLogger(__name__)
 
 class Controller:
     controller = None
 
+    # seconds between two updates of the GUI while no event arrives
+    UPDATE_INTERVAL = 0.1
+    # seconds the converter gets to stop on its own after a cancellation before it is killed
+    CANCEL_TIMEOUT = 5
+
     def __new__(cls, *args, **kwargs):
         if not cls.controller:
             cls.controller = super(Controller, cls).__new__(cls, *args, **kwargs)
@@ -27,16 +47,25 @@ class Controller:
         self.sc_error_msg = ""
         self.sc_edit_flag = False
         self.sub_dir = None
+        self.job_progress = None # progress of the current job (0-1), None if unknown
+        self.job_detail = ''
+        self.progress_events = {} # latest progress event of every track of the current job
+        self.estimates = {} # estimated seconds of the files that are not finished
+        self.current_file = None
+        self.file_started = 0
 
     def register_gui(self, gui: GUI):
         self.gui = gui
 
-    def register_subconverter(self, subconverter: SubMain):
+    def register_subconverter(self, subconverter: 'SubMain'):
         self.subconverter = subconverter
 
     def start_program(self):
+        # probe the external tools in the background, they are cached for the converter
+        Thread(name="Probe tools", target=Capabilities().refresh, daemon=True).start()
+
         if self.config.check_for_updates():
-            self.gui.check_for_updates()
+            self.gui.check_for_updates_in_background()
 
         while self.exit_code != 1:
             self.run_program()
@@ -63,7 +92,67 @@ class Controller:
         self.job = job
 
     def notify_gui(self):
-        self.gui.update(self.file_counter, self.finished_files_counter, self.files_with_error_counter, self.job, self.sc_error_code, self.sc_error_msg, self.sc_edit_flag, self.sub_dir)
+        self.gui.update(self.file_counter, self.finished_files_counter, self.files_with_error_counter, self.job, self.sc_error_code, self.sc_error_msg, self.sc_edit_flag, self.sub_dir, self.job_progress, self.job_detail, self.get_batch_detail())
+
+    def handle_event(self, event: ConversionEvent):
+        match event:
+            case JobStarted():
+                self.job = event.job
+                if event.file != self.current_file:
+                    self.current_file = event.file
+                    self.file_started = time.monotonic()
+                self.progress_events.clear()
+                self.job_progress = None
+                self.job_detail = ''
+            case ExtractionProgress() | TrackProgress():
+                self.progress_events[event.track_id] = event
+                self.update_job_progress()
+            case BatchPlanned():
+                self.estimates = dict(event.estimates)
+            case FileFinished():
+                self.finished_files_counter += 1
+                self.estimates.pop(event.file, None)
+            case FileFailed():
+                self.files_with_error_counter += 1
+                self.estimates.pop(event.file, None)
+                self.sc_error_code = 2
+                file_name = os.path.splitext(os.path.basename(event.file))[0]
+                self.sc_error_msg = self.translate('Error while processing {file_name}: {error}').format(file_name=file_name, error=event.result.error)
+            case EditRequested():
+                self.sc_edit_flag = True
+                self.sub_dir = event.sub_dir
+
+    def update_job_progress(self):
+        events = list(self.progress_events.values())
+
+        if all(isinstance(event, TrackProgress) for event in events):
+            total = sum(event.total for event in events)
+            self.job_progress = sum(event.processed for event in events) / total if total else None
+            images_per_second = sum(event.images_per_second for event in events)
+            etas = [event.eta for event in events if event.eta is not None]
+            self.job_detail = self.translate('{images_per_second:.1f} images/s').format(images_per_second=images_per_second)
+            if etas:
+                self.job_detail += ', ' + self.translate('{time} left').format(time=format_duration(max(etas)))
+        else:
+            fractions = [event.fraction for event in events if isinstance(event, ExtractionProgress) and event.fraction is not None]
+            self.job_progress = sum(fractions) / len(fractions) if fractions else None
+            extracted = sum(event.bytes for event in events if isinstance(event, ExtractionProgress))
+            self.job_detail = self.translate('{size:.1f} MB extracted').format(size=extracted / 1024**2)
+
+    def get_batch_detail(self) -> str:
+        '''
+        Estimated time of the files that are not finished, the current file counts with its remaining estimate.
+        '''
+        if not self.estimates:
+            return ''
+
+        remaining = sum(self.estimates.values())
+        if self.current_file in self.estimates:
+            remaining -= min(self.estimates[self.current_file], time.monotonic() - self.file_started)
+        return self.translate('about {time} left').format(time=format_duration(remaining))
+
+    def translate(self, text: str) -> str:
+        return self.config.translate(text)
 
     def start_subconverter(self):
         if self.exit_code == 0:
@@ -77,55 +166,154 @@ class Controller:
                 'keep_new_subs': self.sc_values['keep_new_subs'],
                 'diff_langs': subhelper.diff_langs_from_text(self.sc_values['diff_langs']),
                 'sub_format': SubtitleFormats.get_name(self.sc_values['sub_format']),
-                'brightness_diff': self.sc_values['brightness_diff'] / 100
+                'brightness_diff': self.sc_values['brightness_diff'] / 100,
+                'ocr_profile': OCRProfiles.get_name(self.config.get_value(Config.Settings.OCR_PROFILE))
             }
 
-            manager = Manager()
-            shared_dict = manager.dict({'done': False})
+            self.finished_files_counter = 0
+            self.files_with_error_counter = 0
+            self.job = Jobs.IDLE
+            self.estimates = {}
+            self.current_file = None
+
+            # the converter sends its events through one queue, the answers of the user go back through the other
+            events = Queue()
+            answers = Queue()
+            stop = Event()
+            process_groups = ProcessGroups()
+            cancel_deadline = None
 
-            thread = Process(target=start_subconverter_thread, args=(sc_values, shared_dict))
-            thread.start()
+            process = Process(target=start_subconverter_thread, args=(sc_values, events, answers, stop, process_groups, *self.config.get_worker_args()))
+            process.start()
 
-            while not shared_dict['done']:  # Wait until the subprocess signals completion
-                self.finished_files_counter = shared_dict.get('finished_files_counter', 0)
-                self.files_with_error_counter = shared_dict.get('files_with_error_counter', 0)
-                self.job = shared_dict.get('current_job', Jobs.IDLE)
-                self.sc_error_code = shared_dict.get('error_code', 0)
-                self.sc_error_msg = shared_dict.get('error_message', "")
-                self.sc_edit_flag = shared_dict.get('edit_flag', False)
-                self.sub_dir = shared_dict.get('sub_dir', None)
+            done = False
+            while not done:
+                # wait for events instead of polling, but update the GUI at least every UPDATE_INTERVAL
+                received = get_events(events, self.UPDATE_INTERVAL)
+                for event in received:
+                    if event is None: # the converter finished
+                        done = True
+                    else:
+                        self.handle_event(event)
+
+                if not received and not process.is_alive(): # the converter crashed
+                    done = True
 
                 self.notify_gui()
 
+                # every answer of the user is sent once, the next error or edit waits for a new one
                 if self.gui.continue_flag is not None:
-                    shared_dict['continue_flag'] = self.gui.continue_flag
+                    answers.put(self.gui.continue_flag)
+                    self.sc_error_code = 0
+                    self.sc_error_msg = ''
+                    self.gui.continue_flag = None
                 if self.gui.edit_flag is not None:
-                    shared_dict['edit_flag'] = self.gui.edit_flag
-                if self.gui.get_stop_flag():
-                    # Handle stop flag if needed
-                    thread.terminate()
+                    answers.put(True)
+                    self.sc_edit_flag = False
+                    self.gui.edit_flag = None
+                if self.gui.get_stop_flag() and cancel_deadline is None:
+                    # the converter kills its commands and removes unfinished files itself
+                    stop.set()
+                    answers.put(False) # don't continue after an error or an edit the converter waits for
+                    cancel_deadline = time.monotonic() + self.CANCEL_TIMEOUT
+                elif cancel_deadline is not None and time.monotonic() > cancel_deadline:
+                    logger.warning(f'The converter did not stop within {self.CANCEL_TIMEOUT}s after cancelling, killing it.')
+                    # its OCR processes and their Tesseract processes are in its group, its commands in their own
+                    kill_process_tree(process.pid)
+                    process_groups.kill_all()
                     break
 
-                time.sleep(1)
-
             self.gui.hide_progress()
             self.gui.show_finish_dialog()
 
 
-def start_subconverter_thread(sc_values, shared_dict):
-    sc = SubMain(sc_values['selected_paths'],
-                 sc_values['edit_subs'],
-                 sc_values['save_images'],
-                 sc_values['keep_old_mkvs'],
-                 sc_values['keep_old_subs'],
-                 sc_values['keep_new_subs'],
-                 sc_values['diff_langs'],
-                 sc_values['sub_format'],
-                 sc_values['brightness_diff'],
-                 shared_dict)
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+    return f'{seconds // 60}:{seconds % 60:02d}'
+
+
+def get_events(events: Queue, timeout: float) -> list:
+    '''
+    Wait for the next event and return it with all events that are already waiting.
+    '''
+    try:
+        received = [events.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+
+    try:
+        while True:
+            received.append(events.get_nowait())
+    except queue.Empty:
+        return received
+
+
+def start_subconverter_thread(sc_values, events: Queue, answers: Queue, stop: Event, process_groups: ProcessGroups, config_snapshot, log_queue):
+    # a process group of the converter and the processes it starts, so the controller can kill all of them
+    if os.name != 'nt':
+        os.setsid()
+
+    Config.initialize_worker(config_snapshot, log_queue)
+    ProcessRunner().process_groups = process_groups
+
+    cancel = CancellationToken()
+    Thread(name="Cancel", target=lambda: stop.wait() and cancel.cancel(), daemon=True).start()
+
+    # the converter and its libraries (OpenCV, numpy, Tesseract) are only imported by the converter process
+    from backend.main import ConversionOptions, FileResult, convert_files
+
+    def on_error(result: FileResult) -> bool:
+        # the GUI asks the user after the FileFailed event
+        return answers.get()
+
+    def on_edit(sub_dir: Path):
+        events.put(EditRequested(sub_dir))
+        if os.name == "nt":
+            os.system(f"explorer.exe \"{os.path.join(os.getcwd(), sub_dir)}\"")
+
+        answers.get() # the user is done with editing
+
+    options = ConversionOptions(keep_imgs=sc_values['save_images'],
+                                keep_old_mkvs=sc_values['keep_old_mkvs'],
+                                keep_old_subs=sc_values['keep_old_subs'],
+                                keep_new_subs=sc_values['keep_new_subs'],
+                                diff_langs=sc_values['diff_langs'],
+                                sub_format=sc_values['sub_format'],
+                                text_brightness_diff=sc_values['brightness_diff'],
+                                ocr_profile=sc_values['ocr_profile'],
+                                on_error=on_error,
+                                on_edit=on_edit if sc_values['edit_subs'] else None,
+                                cancel=cancel)
+
+    paths = sc_values['selected_paths']
+    if Config().get_value(Config.Settings.PLAN_BATCH):
+        paths = plan_batch(paths, options, events)
 
     # Start the conversion process
-    sc.convert()
+    if paths:
+        convert_files(paths, options, events.put)
+
+    events.put(JobStarted(Jobs.CANCEL if cancel.cancelled else Jobs.FINISHED))
+    events.put(None)  # Indicate completion
+
+
+def plan_batch(paths: list[str], options: 'ConversionOptions', events: Queue) -> list[str]:
+    '''
+    Estimate the time of the batch and return the files in the order of the plan (longest first),
+    no files if the conversion was cancelled while planning.
+    '''
+    from backend.planner import plan_files
+
+    events.put(JobStarted(Jobs.PLAN))
+    try:
+        plan = plan_files(paths, options)
+    except ConversionCancelled:
+        return []
+    except Exception as e: # the files are converted in the selected order without an estimate
+        logger.warning(f'Could not plan the batch: {e}')
+        return paths
 
-    # Update shared_dict with the final state after conversion
-    shared_dict['done'] = True  # Indicate completion
+    events.put(BatchPlanned(plan.total_seconds, {file.path: file.total_seconds for file in plan.files}))
+    return plan.order
@@ -2,17 +2,23 @@ from enum import Enum
 from config import Config
 
 class Jobs(Enum):
-    config = Config()
-    IDLE     = config.translate('Idle')
-    EXTRACT  = config.translate('Extracting')
-    CONVERT  = config.translate('Converting')
-    REPLACE  = config.translate('Replacing')
-    MUXING   = config.translate('Muxing new video')
-    FINISHED = config.translate('Finished')
-    CANCEL   = config.translate('Cancelled')
+    # translated by get_text, so importing the jobs doesn't load the config
+    IDLE     = 'Idle'
+    PLAN     = 'Planning'
+    EXTRACT  = 'Extracting'
+    CONVERT  = 'Converting'
+    REPLACE  = 'Replacing'
+    MUXING   = 'Muxing new video'
+    FINISHED = 'Finished'
+    CANCEL   = 'Cancelled'
+
+    def get_text(job) -> str:
+        return Config().translate(job.value)
 
     def get_percentage(job) -> int:
         match job:
+            case Jobs.PLAN:
+                return 0
             case Jobs.IDLE:
                 return 20
             case Jobs.EXTRACT:
@@ -24,4 +30,4 @@ class Jobs(Enum):
             case Jobs.FINISHED:
                 return 100
             case Jobs.CANCEL:
-                return 0
\ No newline at end of file
+                return 0
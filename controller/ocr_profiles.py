@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+from enum import Enum
+
+@dataclass(frozen=True)
+class OCRProfile:
+    oem: int                      # Tesseract OCR engine mode
+    psm: int                      # Tesseract page segmentation mode for a single line
+    model: str                    # 'fast', 'best' or 'default' (the tessdata directory of Tesseract)
+    rescale: bool                 # scale the text to the optimal x-height
+    tier_two: bool                # second OCR pass for images with a low confidence
+    tier_two_scale: int
+    confidence_threshold: float
+
+class OCRProfiles(Enum):
+    FAST     = 'fast'
+    BALANCED = 'balanced'
+    BEST     = 'best'
+
+    def get_name(name: str):
+        name = name.lower()
+        for profile in OCRProfiles:
+            if name == profile.name.lower() or name == profile.value:
+                return profile
+
+        raise ValueError(f'Unknown OCR profile: {name}.')
+
+    def get_profile(profile) -> OCRProfile:
+        match profile:
+            case OCRProfiles.FAST:
+                return OCRProfile(oem=1, psm=7, model='fast', rescale=True, tier_two=False, tier_two_scale=1, confidence_threshold=0)
+            case OCRProfiles.BALANCED:
+                return OCRProfile(oem=3, psm=7, model='default', rescale=True, tier_two=True, tier_two_scale=2, confidence_threshold=75)
+            case OCRProfiles.BEST:
+                return OCRProfile(oem=1, psm=7, model='best', rescale=True, tier_two=True, tier_two_scale=3, confidence_threshold=90)
@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import ttk
 from config import Config
 from gui.licenses import LicensesWindow
+from backend.capabilities import Capabilities
 
 class AboutWindow(tk.Toplevel):
     
@@ -10,7 +11,7 @@ class AboutWindow(tk.Toplevel):
         self.translate = parent.config.translate
         
         self.title(self.translate("About"))
-        self.geometry("250x250")
+        self.geometry("250x330")
         self.resizable(False, False)
 
         self.wait_visibility()
@@ -23,6 +24,7 @@ class AboutWindow(tk.Toplevel):
         
         name_label = tk.Label(self, text='MKV Subtitle Converter')
         version_label = tk.Label(self, text=self.config.get_version())
+        tools_label = tk.Label(self, text=self.get_tool_versions(), justify='left')
         updateButton = ttk.Button(self, text=self.translate("Check for updates"), command=self.check_for_updates)
         licenses_btn = ttk.Button(self, text=self.translate("View Licenses"), command=self.show_licenses)
 
@@ -35,6 +37,7 @@ class AboutWindow(tk.Toplevel):
         version_label.grid(row=1, column=0, padx=5, pady=5)
         updateButton.grid(row=2, column=0, padx=5, pady=5)
         licenses_btn.grid(row=4, column=0, padx=5, pady=5)
+        tools_label.grid(row=5, column=0, padx=5, pady=5)
 
         self.columnconfigure(0, weight=1)
 
@@ -43,6 +46,16 @@ class AboutWindow(tk.Toplevel):
         self.rowconfigure(2, weight=1)
         self.rowconfigure(3, weight=1)  # Falls noch eine Zeile nötig ist
         self.rowconfigure(4, weight=1)
+        self.rowconfigure(5, weight=1)
+
+    def get_tool_versions(self) -> str:
+        capabilities = Capabilities()
+        lines = []
+        for tool in Capabilities.TOOLS:
+            version = capabilities.get_version(tool)
+            lines.append(f'{tool}: {version or self.translate("not found")}')
+
+        return '\n'.join(lines)
 
 
     def check_for_updates(self):
@@ -5,14 +5,13 @@ import os
 from gui.settings import SettingsWindow
 from gui.about import AboutWindow
 import math
-import requests
-from packaging.version import Version
 from config import Config
 import webbrowser
 import logging
 from controller.jobs import Jobs
 import time
 import sys
+from threading import Thread
 
 class GUI:
     
@@ -26,6 +25,9 @@ class GUI:
         self.reloaded = False
         self.continue_flag = None
         self.edit_flag = None
+        self.job_progress = None
+        self.job_detail = ''
+        self.batch_detail = ''
 
         self.window = tk.Tk()
 
@@ -326,6 +328,10 @@ class GUI:
         self.run_settings_help_window_row += 1
 
     def update_available(self):
+        # only needed for the update check, importing requests takes longer than showing the window
+        import requests
+        from packaging.version import Version
+
         logging.info("Checking for updates.")
 
         try:
@@ -340,9 +346,28 @@ class GUI:
         update_available, latest_version = self.update_available()
 
         if update_available:
-            update = tk.messagebox.askyesno(self.translate("Update available"), self.translate("Version {latest_version} is available. Do you want to download it?").format(latest_version=latest_version))
-            if update:
-                webbrowser.open('https://github.com/raphael-klbm/MKV-Subtitle-Converter/releases/latest')
+            self.show_update_dialog(latest_version)
+
+    def check_for_updates_in_background(self):
+        '''
+        Ask for the latest version in a thread, so the window doesn't wait for the request.
+        The dialog is shown by the Tk thread once the answer is there.
+        '''
+        answer = []
+        Thread(name="Check for updates", target=lambda: answer.append(self.update_available()), daemon=True).start()
+
+        def show_answer():
+            if not answer:
+                self.window.after(200, show_answer)
+            elif answer[0][0]:
+                self.show_update_dialog(answer[0][1])
+
+        self.window.after(200, show_answer)
+
+    def show_update_dialog(self, latest_version: str):
+        update = tk.messagebox.askyesno(self.translate("Update available"), self.translate("Version {latest_version} is available. Do you want to download it?").format(latest_version=latest_version))
+        if update:
+            webbrowser.open('https://github.com/raphael-klbm/MKV-Subtitle-Converter/releases/latest')
 
     def reload(self):
         self.reloaded = True
@@ -353,12 +378,15 @@ class GUI:
         self.wait_var.set(wait_var)
 
 
-    def update(self, file_counter, finished_files_counter, files_with_error_counter, job, sc_error_code, sc_error_msg, sc_edit_flag, sc_sub_dir):
+    def update(self, file_counter, finished_files_counter, files_with_error_counter, job, sc_error_code, sc_error_msg, sc_edit_flag, sc_sub_dir, job_progress=None, job_detail='', batch_detail=''):
         """Update the GUI while the subconverter is running"""
         self.file_counter = file_counter
         self.finished_files_counter = finished_files_counter
         self.files_with_error_counter = files_with_error_counter
         self.job = job
+        self.job_progress = job_progress
+        self.job_detail = job_detail
+        self.batch_detail = batch_detail
 
         if sc_error_code != 0:
             self.window.bell()
@@ -395,20 +423,26 @@ class GUI:
             self.job_progress_label.grid(row=2, column=0, padx=int(10*self.scaling), pady=(int(5*self.scaling), int(3*self.scaling)), sticky="w")
             self.job_progress_bar.grid(row=3, column=0, padx=int(10*self.scaling), pady=(0, int(5*self.scaling)), sticky="w")
 
+            # created once, so a click isn't reset by the next refresh of the window
+            self.stop_flag = tk.BooleanVar(value=False)
+            self.cancel_button = ttk.Button(self.progress_window, text=self.translate("Cancel"), command=self.cancel_conversion)
+            self.cancel_button.grid(row=4, column=0, padx=int(10*self.scaling), pady=(int(5*self.scaling), int(5*self.scaling)), sticky="e")
+
             self.progress_window.tkraise()
 
         current_video_counter = self.finished_files_counter + self.files_with_error_counter + 1
         self.video_progress_label["text"] = "Video #{current_video_counter}/{total_video_counter}".format(current_video_counter=current_video_counter, total_video_counter=self.file_counter)
+        if self.batch_detail:
+            self.video_progress_label["text"] += f" ({self.batch_detail})"
         # video_progress_bar value is the number of finished videos plus the percentage of the current video based on the current job
         self.video_progress_bar["value"] = (current_video_counter - 1) / self.file_counter * 100 + (Jobs.get_percentage(self.job) * (1 / self.file_counter))
-        self.job_progress_label["text"] = self.translate("Current job: {job}").format(job=self.job.value)
-        self.job_progress_bar["value"] = Jobs.get_percentage(self.job)
+        self.job_progress_label["text"] = self.translate("Current job: {job}").format(job=self.job.get_text())
+        if self.job_detail:
+            self.job_progress_label["text"] += f" ({self.job_detail})"
+        # the progress of the current job if the converter reports it
+        self.job_progress_bar["value"] = self.job_progress * 100 if self.job_progress is not None else Jobs.get_percentage(self.job)
         self.progress_window.after(100, self.show_progress)
 
-        self.stop_flag = tk.BooleanVar(value=False)
-        cancel_button = ttk.Button(self.progress_window, text=self.translate("Cancel"), command=lambda: self.stop_flag.set(True))
-        cancel_button.grid(row=4, column=0, padx=int(10*self.scaling), pady=(int(5*self.scaling), int(5*self.scaling)), sticky="e")
-
     def hide_progress(self):
         time.sleep(5)
         self.progress_window.destroy()
@@ -420,5 +454,9 @@ class GUI:
     def show_no_files_selected_dialog(self):
         tk.messagebox.showerror(self.translate("Error"), self.translate("No files selected. Please select at least one file."))
 
+    def cancel_conversion(self):
+        self.stop_flag.set(True)
+        self.cancel_button["state"] = "disabled" # the converter stops at its next cancellation point
+
     def get_stop_flag(self):
         return self.stop_flag.get()
@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
 from config import Config
 
 class SettingsWindow(tk.Toplevel):
@@ -25,8 +26,10 @@ class SettingsWindow(tk.Toplevel):
 
         general_settings = SidebarOption(self.sidebar, self.translate("General"), lambda: self.show_frame(GeneralSettings))
         graphics_settings = SidebarOption(self.sidebar, self.translate("Graphics"), lambda: self.show_frame(GraphicsSettings))
+        ocr_settings = SidebarOption(self.sidebar, self.translate("OCR"), lambda: self.show_frame(OCRSettings))
         general_settings.grid(row=0, column=0, padx=5, pady=(5, 0), sticky="w")
         graphics_settings.grid(row=1, column=0, padx=5, pady=(5, 0), sticky="w")
+        ocr_settings.grid(row=2, column=0, padx=5, pady=(5, 0), sticky="w")
 
         # --------------------  MULTI PAGE SETTINGS ----------------------------
 
@@ -36,7 +39,7 @@ class SettingsWindow(tk.Toplevel):
 
         self.frames = {}
 
-        for F in {GeneralSettings, GraphicsSettings}:
+        for F in {GeneralSettings, GraphicsSettings, OCRSettings}:
             frame = F(settings_frames_container)
             self.frames[F] = frame
             frame.place(relx=0, rely=0, relwidth=1, relheight=1)
@@ -158,6 +161,80 @@ class GraphicsSettings(SettingsFrame):
 
         self.config.save_settings(settings)
 
+
+class OCRSettings(SettingsFrame):
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        # variables
+        self.glyph_cache = tk.BooleanVar()
+        self.brightness_tuning = tk.BooleanVar()
+        self.profile = tk.StringVar()
+        self.tessdata_fast = tk.StringVar()
+        self.tessdata_best = tk.StringVar()
+
+        # Map from config value to translated value for display
+        self.profiles = {
+            'fast': self.translate("Fast"),
+            'balanced': self.translate("Balanced"),
+            'best': self.translate("Best")
+        }
+
+        self.glyph_cache.set(self.config.get_value(Config.Settings.GLYPH_CACHE))
+        self.brightness_tuning.set(self.config.get_value(Config.Settings.BRIGHTNESS_TUNING))
+        self.profile.set(self.profiles.get(self.config.get_value(Config.Settings.OCR_PROFILE), self.profiles['balanced']))
+        self.tessdata_fast.set(self.config.get_value(Config.Settings.TESSDATA_FAST))
+        self.tessdata_best.set(self.config.get_value(Config.Settings.TESSDATA_BEST))
+
+        # gui
+        profile_label = ttk.Label(self, text=self.translate("Profile:"))
+        profile_label.grid(row=0, column=0, padx=5, pady=(5, 0), sticky="w")
+
+        profile_list = ttk.Combobox(self, values=list(self.profiles.values()), textvariable=self.profile, state="readonly")
+        profile_list.grid(row=0, column=1, padx=5, pady=(5, 0), sticky="w", columnspan=2)
+
+        tessdata_fast_label = ttk.Label(self, text=self.translate("tessdata_fast:"))
+        tessdata_fast_label.grid(row=1, column=0, padx=5, pady=(5, 0), sticky="w")
+        tessdata_fast = ttk.Entry(self, textvariable=self.tessdata_fast)
+        tessdata_fast.grid(row=1, column=1, padx=5, pady=(5, 0), sticky="we")
+        tessdata_fast_button = ttk.Button(self, text="...", width=3, command=lambda: self.choose_directory(self.tessdata_fast))
+        tessdata_fast_button.grid(row=1, column=2, padx=(0, 5), pady=(5, 0), sticky="w")
+
+        tessdata_best_label = ttk.Label(self, text=self.translate("tessdata_best:"))
+        tessdata_best_label.grid(row=2, column=0, padx=5, pady=(5, 0), sticky="w")
+        tessdata_best = ttk.Entry(self, textvariable=self.tessdata_best)
+        tessdata_best.grid(row=2, column=1, padx=5, pady=(5, 0), sticky="we")
+        tessdata_best_button = ttk.Button(self, text="...", width=3, command=lambda: self.choose_directory(self.tessdata_best))
+        tessdata_best_button.grid(row=2, column=2, padx=(0, 5), pady=(5, 0), sticky="w")
+
+        glyph_cache = ttk.Checkbutton(self, text=self.translate("Recognize known characters without Tesseract"), variable=self.glyph_cache)
+        glyph_cache.grid(row=3, column=0, padx=5, pady=(5, 0), sticky="w", columnspan=3)
+
+        brightness_tuning = ttk.Checkbutton(self, text=self.translate("Tune the text brightness deviation per subtitle"), variable=self.brightness_tuning)
+        brightness_tuning.grid(row=4, column=0, padx=5, pady=(5, 0), sticky="w", columnspan=3)
+
+        self.grid_columnconfigure(1, weight=1)
+
+    def choose_directory(self, variable: tk.StringVar):
+        directory = filedialog.askdirectory(title=self.translate("Select tessdata directory"))
+
+        if directory:
+            variable.set(directory)
+
+    def save_settings(self):
+        # Map from translated value back to config value for saving
+        profile = [value for value, name in self.profiles.items() if name == self.profile.get()]
+
+        settings = {
+            Config.Settings.GLYPH_CACHE: self.glyph_cache.get(),
+            Config.Settings.BRIGHTNESS_TUNING: self.brightness_tuning.get(),
+            Config.Settings.OCR_PROFILE: profile[0] if profile else 'balanced',
+            Config.Settings.TESSDATA_FAST: self.tessdata_fast.get().strip(),
+            Config.Settings.TESSDATA_BEST: self.tessdata_best.get().strip()
+        }
+
+        self.config.save_settings(settings)
+
 # ----------------------------- CUSTOM WIDGETS ---------------------------------
 
 class SidebarSubMenu(tk.Frame):
@@ -1,11 +1,17 @@
-from controller.controller import Controller
-from config import Config
-from gui.gui import GUI
 import multiprocessing
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
 
+    # spawned worker processes import this module as __mp_main__, they get their config from initialize_worker
+    # and must neither read or write config.ini and the log nor import the GUI
+    from config import Config
+    import backend.concurrency as concurrency
+    concurrency.set_thread_limits() # before numpy and OpenCV are imported
+
+    from controller.controller import Controller
+    from gui.gui import GUI
+
     # start the program
     controller = Controller()
     gui = GUI()